@@ -33,12 +33,23 @@
 # run with flags --trace-gc --trace-gc-nvp. Relies on gnuplot for actual
 # plotting.
 #
-# Usage: gc-nvp-trace-processor.py <GC-trace-filename>
+# Usage: gc-nvp-trace-processor.py [--follow] <GC-trace-filename>
+#
+# With --follow, the statistics are printed whenever GCs are added to the
+# trace, as for a log that is still being written.
+#
+# Requires NumPy, in either mode: the trace is parsed into NumPy columns (see
+# gc_nvp_common.GCTrace).
+#
+# Avg and dev are computed from the exact floating-point mean. Earlier
+# versions subtracted an integer-truncated mean when computing dev, so dev
+# differs from their output in the 3rd or 4th significant digit.
 #
 
 
 from __future__ import with_statement
-import sys, types, subprocess, math
+import sys, types, subprocess, time
+import numpy
 import gc_nvp_common
 
 def flatten(l):
@@ -133,24 +144,23 @@ def is_y2_used(plot):
           return True
   return False
 
-def get_field(trace_line, field):
+# Fields are names of trace columns or functions of the whole trace that
+# return a column.
+def get_field(trace, field):
   t = type(field)
   if t is types.StringType:
-    return trace_line[field]
+    return trace[field]
   elif t is types.FunctionType:
-    return field(trace_line)
+    return field(trace)
 
 def generate_datafile(datafile_name, trace, fields):
-  with open(datafile_name, 'w') as datafile:
-    for line in trace:
-      data_line = [str(get_field(line, field)) for field in fields]
-      datafile.write('\t'.join(data_line))
-      datafile.write('\n')
-
-def generate_script_and_datafile(plot, trace, datafile, output):
-  (fields, field_to_index) = collect_fields(plot)
-  generate_datafile(datafile, trace, fields)
+  columns = [get_field(trace, field) for field in fields]
+  numpy.savetxt(datafile_name, numpy.column_stack(columns),
+                fmt='%.15g', delimiter='\t')
+
+def generate_script(plot, context, output):
   script = [
+      'reset',
       'set terminal png',
       'set output "%s"' % output,
       'set autoscale',
@@ -163,22 +173,26 @@ def generate_script_and_datafile(plot, trace, datafile, output):
     script.append('set autoscale y2')
     script.append('set y2tics')
 
-  context = Context(datafile, field_to_index)
-
   for item in plot:
     script.append(item.to_gnuplot(context))
 
   return '\n'.join(script)
 
+# All plots read one datafile, and are drawn by one gnuplot process.
 def plot_all(plots, trace, prefix):
   charts = []
+  scripts = []
+  datafile = '~datafile'
+  (fields, field_to_index) = collect_fields(flatten(plots))
+  generate_datafile(datafile, trace, fields)
+  context = Context(datafile, field_to_index)
 
   for plot in plots:
     outfilename = "%s_%d.png" % (prefix, len(charts))
     charts.append(outfilename)
-    script = generate_script_and_datafile(plot, trace, '~datafile', outfilename)
+    scripts.append(generate_script(plot, context, outfilename))
     print 'Plotting %s...' % outfilename
-    gnuplot(script)
+  gnuplot('\n'.join(scripts))
 
   return charts
 
@@ -186,15 +200,12 @@ def reclaimed_bytes(row):
   return row['total_size_before'] - row['total_size_after']
 
 def other_scope(r):
-  if r['gc'] == 's':
-    # there is no 'other' scope for scavenging collections.
-    return 0
-  return r['pause'] - r['mark'] - r['sweep'] - r['external']
+  # there is no 'other' scope for scavenging collections.
+  return numpy.where(r['gc'] == 's', 0,
+                     r['pause'] - r['mark'] - r['sweep'] - r['external'])
 
 def scavenge_scope(r):
-  if r['gc'] == 's':
-    return r['pause'] - r['external']
-  return 0
+  return numpy.where(r['gc'] == 's', r['pause'] - r['external'], 0)
 
 
 def real_mutator(r):
@@ -260,91 +271,74 @@ plots = [
   ],
 ]
 
-def freduce(f, field, trace, init):
-  return reduce(lambda t,r: f(t, r[field]), trace, init)
-
-def calc_total(trace, field):
-  return freduce(lambda t,v: t + long(v), field, trace, long(0))
-
-def calc_max(trace, field):
-  return freduce(lambda t,r: max(t, r), field, trace, 0)
-
-def count_nonzero(trace, field):
-  return freduce(lambda t,r: t if r == 0 else t + 1, field, trace, 0)
+def phase_stats(trace):
+  pause = trace['pause']
+  gc = trace['gc']
+  rows = [('Total in GC', pause),
+          ('Scavenge', pause[gc == 's']),
+          ('MarkSweep', pause[gc == 'ms'])]
+  for (phase, field) in [('Mark', 'mark'),
+                         ('Sweep', 'sweep'),
+                         ('External', 'external')]:
+    values = trace[field]
+    rows.append((phase, values[values != 0]))
+  return [(phase,) + gc_nvp_common.column_stats(values)
+          for (phase, values) in rows]
+
+def throughputs(trace):
+  gc = trace['gc']
+  return [(name,) + gc_nvp_common.gc_throughput(trace, rows)
+          for (name, rows) in [('TOTAL', numpy.ones(len(trace), dtype=bool)),
+                               ('MS', gc == 'ms'),
+                               ('OLDSPACE', gc != 's')]]
+
+def HumanReadable(size):
+  suffixes = ['bytes', 'kB', 'MB', 'GB']
+  power = 1
+  for i in range(len(suffixes)):
+    if size < power*1024:
+      return "%.1f" % (float(size) / power) + " " + suffixes[i]
+    power *= 1024
+
+def throughput_lines(trace):
+  lines = []
+  for (name, total_live_after, total_live_before, total_gc) in throughputs(trace):
+    if total_gc == 0:
+      continue
+    lines.append('GC %s Throughput (after): %s / %d ms = %s/ms' %
+                 (name,
+                  HumanReadable(total_live_after),
+                  total_gc,
+                  HumanReadable(total_live_after / total_gc)))
+    lines.append('GC %s Throughput (before): %s / %d ms = %s/ms' %
+                 (name,
+                  HumanReadable(total_live_before),
+                  total_gc,
+                  HumanReadable(total_live_before / total_gc)))
+  lines.append('Mutator utilization: %.1f%%' %
+               (100 * gc_nvp_common.mutator_utilization(trace)))
+  return lines
 
 
 def process_trace(filename):
-  trace = gc_nvp_common.parse_gc_trace(filename)
-
-  marksweeps = filter(lambda r: r['gc'] == 'ms', trace)
-  scavenges = filter(lambda r: r['gc'] == 's', trace)
-  globalgcs = filter(lambda r: r['gc'] != 's', trace)
-
+  trace = gc_nvp_common.load_gc_trace(filename)
+  if not trace:
+    print "%s: no GCs found." % filename
+    return
 
   charts = plot_all(plots, trace, filename)
 
-  def stats(out, prefix, trace, field):
-    n = len(trace)
-    total = calc_total(trace, field)
-    max = calc_max(trace, field)
-    if n > 0:
-      avg = total / n
-    else:
-      avg = 0
-    if n > 1:
-      dev = math.sqrt(freduce(lambda t,r: t + (r - avg) ** 2, field, trace, 0) /
-                      (n - 1))
-    else:
-      dev = 0
-
-    out.write('<tr><td>%s</td><td>%d</td><td>%d</td>'
-              '<td>%d</td><td>%d [dev %f]</td></tr>' %
-              (prefix, n, total, max, avg, dev))
-
-  def HumanReadable(size):
-    suffixes = ['bytes', 'kB', 'MB', 'GB']
-    power = 1
-    for i in range(len(suffixes)):
-      if size < power*1024:
-        return "%.1f" % (float(size) / power) + " " + suffixes[i]
-      power *= 1024
-
-  def throughput(name, trace):
-    total_live_after = calc_total(trace, 'total_size_after')
-    total_live_before = calc_total(trace, 'total_size_before')
-    total_gc = calc_total(trace, 'pause')
-    if total_gc == 0:
-      return
-    out.write('GC %s Throughput (after): %s / %s ms = %s/ms<br/>' %
-              (name,
-               HumanReadable(total_live_after),
-               total_gc,
-               HumanReadable(total_live_after / total_gc)))
-    out.write('GC %s Throughput (before): %s / %s ms = %s/ms<br/>' %
-              (name,
-               HumanReadable(total_live_before),
-               total_gc,
-               HumanReadable(total_live_before / total_gc)))
-
-
   with open(filename + '.html', 'w') as out:
     out.write('<html><body>')
     out.write('<table>')
     out.write('<tr><td>Phase</td><td>Count</td><td>Time (ms)</td>')
     out.write('<td>Max</td><td>Avg</td></tr>')
-    stats(out, 'Total in GC', trace, 'pause')
-    stats(out, 'Scavenge', scavenges, 'pause')
-    stats(out, 'MarkSweep', marksweeps, 'pause')
-    stats(out, 'Mark', filter(lambda r: r['mark'] != 0, trace), 'mark')
-    stats(out, 'Sweep', filter(lambda r: r['sweep'] != 0, trace), 'sweep')
-    stats(out,
-          'External',
-          filter(lambda r: r['external'] != 0, trace),
-          'external')
+    for row in phase_stats(trace):
+      out.write('<tr><td>%s</td><td>%d</td><td>%d</td>'
+                '<td>%d</td><td>%d [dev %f]</td></tr>' % row)
     out.write('</table>')
-    throughput('TOTAL', trace)
-    throughput('MS', marksweeps)
-    throughput('OLDSPACE', globalgcs)
+    for line in throughput_lines(trace):
+      out.write(line + '<br/>')
     out.write('<br/>')
     for chart in charts:
       out.write('<img src="%s">' % chart)
@@ -352,8 +346,30 @@ def process_trace(filename):
 
   print "%s generated." % (filename + '.html')
 
-if len(sys.argv) != 2:
-  print "Usage: %s <GC-trace-filename>" % sys.argv[0]
+def follow_trace(filename, interval=1.0):
+  trace = gc_nvp_common.GCTrace()
+  with open(filename) as f:
+    while True:
+      if trace.update(f):
+        print '%-12s %8s %10s %8s %8s' % ('Phase', 'Count', 'Time (ms)',
+                                          'Max', 'Avg')
+        for row in phase_stats(trace):
+          print '%-12s %8d %10d %8d %8d [dev %f]' % row
+        for line in throughput_lines(trace):
+          print line
+        print
+        sys.stdout.flush()
+      time.sleep(interval)
+
+args = sys.argv[1:]
+follow = args[:1] == ['--follow']
+if follow:
+  args = args[1:]
+if len(args) != 1:
+  print "Usage: %s [--follow] <GC-trace-filename>" % sys.argv[0]
   sys.exit(1)
 
-process_trace(sys.argv[1])
+if follow:
+  follow_trace(args[0])
+else:
+  process_trace(args[0])
@@ -10,9 +10,16 @@
 from __future__ import with_statement
 import re
 
+try:
+  import numpy
+except ImportError:
+  numpy = None
+
+NVP_RE = re.compile(r"(\w+)=([-\w.]+)")
+
 def split_nvp(s):
   t = {}
-  for (name, value) in re.findall(r"(\w+)=([-\w]+)", s):
+  for (name, value) in NVP_RE.findall(s):
     try:
       t[name] = float(value)
     except ValueError:
@@ -30,3 +37,239 @@ def parse_gc_trace(input):
         info['i'] = len(trace)
         trace.append(info)
   return trace
+
+
+# Matches text in which no name=value pair starts.
+NO_NVP_PATTERN = r"(?:(?!\w+=[-\w.]).)*"
+
+def _compile_layout(line, matches):
+  """
+  Returns a regexp that matches the lines with the same names, in the same
+  order and with the same text between them, as |line|, whose NVP_RE matches
+  are |matches|. Its groups are the values.
+  """
+  parts = ["^", NO_NVP_PATTERN]
+  end = None
+  for m in matches:
+    if end is not None:
+      parts.append(re.escape(line[end:m.start()]))
+    parts.append(re.escape(m.group(1)) + r"=([-\w.]+)")
+    end = m.end()
+  parts.append(NO_NVP_PATTERN + "$")
+  return re.compile("".join(parts))
+
+
+def _to_float(value):
+  try:
+    return float(value)
+  except ValueError:
+    return numpy.nan
+
+
+class GCTrace(object):
+  """
+  A --trace-gc-nvp trace stored by column, with one NumPy array per field and
+  a row for each GC with a positive pause. trace['pause'] is the column of
+  pauses and trace['i'] the row numbers, as in parse_gc_trace.
+
+  Fields whose values are not numbers (gc=s, gc=ms) are stored as indices
+  into a list of their values. The kind of a field is fixed by the lines it
+  is first seen in: a field of numbers reads as NaN where a later value is
+  not a number, and any field reads as NaN or '' where a line lacks it.
+  """
+
+  # Lines parsed at a time.
+  CHUNK_LINES = 64 * 1024
+  # Layouts kept; the lines of any others are parsed pair by pair.
+  MAX_LAYOUTS = 32
+
+  def __init__(self):
+    if numpy is None:
+      raise ImportError("GCTrace requires NumPy")
+    self.length = 0
+    self.capacity = 0
+    self.numbers = {}  # Field -> float64 array.
+    self.codes = {}  # Field -> int32 array of indices into its values, or -1.
+    self.values = {}  # Field -> (list of values, dict of value -> index).
+    self.partial_line = ''
+    # (regexp, names) for each kind of line seen; see _compile_layout.
+    self.layouts = []
+
+  def __len__(self):
+    return self.length
+
+  def __contains__(self, field):
+    return field in self.numbers or field in self.codes
+
+  def __getitem__(self, field):
+    if field in self.codes:
+      values = numpy.array(self.values[field][0] + [''])
+      return values[self.codes[field][:self.length]]
+    return self.numbers[field][:self.length]
+
+  def fields(self):
+    return sorted(self.numbers.keys() + self.codes.keys())
+
+  def update(self, f, eof=False):
+    """
+    Parses the lines written to the open file |f| since the previous call,
+    so that a live log can be followed. An unfinished last line is kept
+    for the next call, unless |eof| is set. Returns the number of GCs added.
+    """
+    length = self.length
+    lines = []
+    while True:
+      line = f.readline()
+      if not line:
+        break
+      line = self.partial_line + line
+      self.partial_line = ''
+      if not line.endswith('\n') and not eof:
+        self.partial_line = line
+        break
+      lines.append(line)
+      if len(lines) == self.CHUNK_LINES:
+        self._add_lines(lines)
+        lines = []
+    if eof and self.partial_line:
+      lines.append(self.partial_line)
+      self.partial_line = ''
+    self._add_lines(lines)
+    return self.length - length
+
+  def _split_line(self, line):
+    """Returns the names and values in |line|, or None if it has none."""
+    for (layout_re, names) in self.layouts:
+      m = layout_re.match(line)
+      if m:
+        return (names, m.groups())
+    matches = list(NVP_RE.finditer(line))
+    if not matches:
+      return None
+    names = tuple(m.group(1) for m in matches)
+    if len(self.layouts) < self.MAX_LAYOUTS:
+      self.layouts.append((_compile_layout(line, matches), names))
+    return (names, tuple(m.group(2) for m in matches))
+
+  def _add_lines(self, lines):
+    # Lines that name the same fields in the same order are converted
+    # together, a column at a time.
+    layouts = {}  # Field names -> (row numbers, values).
+    count = 0
+    for line in lines:
+      split = self._split_line(line)
+      if split:
+        layout = layouts.setdefault(split[0], ([], []))
+        layout[0].append(count)
+        layout[1].append(split[1])
+        count += 1
+    numbers = {}
+    codes = {}
+    for (names, (rows, values)) in layouts.iteritems():
+      rows = numpy.array(rows)
+      for (name, strings) in zip(names, zip(*values)):
+        self._convert(name, rows, strings, count, numbers, codes)
+    if 'pause' not in numbers:
+      return
+    gcs = numbers['pause'] > 0
+    self._append(numpy.count_nonzero(gcs),
+                 dict((name, c[gcs]) for (name, c) in numbers.iteritems()),
+                 dict((name, c[gcs]) for (name, c) in codes.iteritems()))
+
+  def _convert(self, name, rows, strings, count, numbers, codes):
+    if name not in self.codes and name not in codes:
+      try:
+        converted = numpy.array(strings, dtype=numpy.float64)
+      except ValueError:
+        if name in self.numbers or name in numbers:
+          converted = numpy.array([ _to_float(s) for s in strings ])
+        else:
+          converted = None
+      if converted is not None:
+        if name not in numbers:
+          numbers[name] = numpy.full(count, numpy.nan)
+        numbers[name][rows] = converted
+        return
+    (values, index) = self.values.setdefault(name, ([], {}))
+    (unique, inverse) = numpy.unique(numpy.array(strings),
+                                     return_inverse=True)
+    for value in unique:
+      if value not in index:
+        index[value] = len(values)
+        values.append(value)
+    if name not in codes:
+      codes[name] = numpy.full(count, -1, dtype=numpy.int32)
+    codes[name][rows] = numpy.array([ index[v] for v in unique ],
+                                    dtype=numpy.int32)[inverse]
+
+  def _append(self, count, numbers, codes):
+    start = self.length
+    end = start + count
+    self._reserve(end, numbers, codes)
+    numbers['i'] = numpy.arange(start, end, dtype=numpy.float64)
+    for (name, column) in self.numbers.iteritems():
+      column[start:end] = numbers.get(name, numpy.nan)
+    for (name, column) in self.codes.iteritems():
+      column[start:end] = codes.get(name, -1)
+    self.length = end
+
+  def _reserve(self, length, numbers, codes):
+    if length > self.capacity:
+      capacity = max(length, 2 * self.capacity, 1024)
+      for (name, column) in self.numbers.iteritems():
+        self.numbers[name] = numpy.resize(column, capacity)
+      for (name, column) in self.codes.iteritems():
+        self.codes[name] = numpy.resize(column, capacity)
+      self.capacity = capacity
+    for name in set(numbers) | set(['i']):
+      if name not in self.numbers:
+        self.numbers[name] = numpy.full(self.capacity, numpy.nan)
+    for name in codes:
+      if name not in self.codes:
+        self.codes[name] = numpy.full(self.capacity, -1, dtype=numpy.int32)
+
+
+def load_gc_trace(input):
+  trace = GCTrace()
+  with open(input) as f:
+    trace.update(f, eof=True)
+  return trace
+
+
+def column_stats(values):
+  """
+  Returns (count, total, max, avg, dev) of the values in a NumPy array that
+  are not NaN. dev is the sample standard deviation.
+  """
+  values = values[~numpy.isnan(values)]
+  n = len(values)
+  if n == 0:
+    return (0, 0, 0, 0, 0)
+  total = values.sum()
+  if n > 1:
+    dev = values.std(ddof=1)
+  else:
+    dev = 0
+  return (n, total, values.max(), total / n, dev)
+
+
+def gc_throughput(trace, rows):
+  """
+  Returns the total live bytes after and before the GCs selected by |rows|,
+  a boolean array, and the total time in them.
+  """
+  return (numpy.nansum(trace['total_size_after'][rows]),
+          numpy.nansum(trace['total_size_before'][rows]),
+          numpy.nansum(trace['pause'][rows]))
+
+
+def mutator_utilization(trace):
+  """
+  Returns the fraction of the time covered by the trace that was spent in
+  the mutator rather than in GC pauses.
+  """
+  mutator = numpy.nansum(trace['mutator'])
+  total = mutator + numpy.nansum(trace['pause'])
+  if total == 0:
+    return 0
+  return mutator / total
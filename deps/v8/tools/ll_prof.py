@@ -32,6 +32,7 @@ import collections
 import ctypes
 import disasm
 import mmap
+import operator
 import optparse
 import os
 import re
@@ -204,95 +205,99 @@ class Code(object):
                                  inplace)
 
 
-class CodePage(object):
-  """Group of adjacent code objects."""
-
-  SHIFT = 20  # 1M pages
-  SIZE = (1 << SHIFT)
-  MASK = ~(SIZE - 1)
-
-  @staticmethod
-  def PageAddress(address):
-    return address & CodePage.MASK
-
-  @staticmethod
-  def PageId(address):
-    return address >> CodePage.SHIFT
-
-  @staticmethod
-  def PageAddressFromId(id):
-    return id << CodePage.SHIFT
-
-  def __init__(self, address):
-    self.address = address
-    self.code_objects = []
-
-  def Add(self, code):
-    self.code_objects.append(code)
-
-  def Remove(self, code):
-    self.code_objects.remove(code)
-
-  def Find(self, pc):
-    code_objects = self.code_objects
-    for i, code in enumerate(code_objects):
-      if code.start_address <= pc < code.end_address:
-        code_objects[0], code_objects[i] = code, code_objects[0]
-        return code
-    return None
-
-  def __iter__(self):
-    return self.code_objects.__iter__()
-
-
 class CodeMap(object):
-  """Code object map."""
+  """Code object map.
+
+  Code objects are kept in arrays sorted by start address, so that Find is
+  a binary search. Code objects added since the arrays were built are kept
+  in a separate, smaller sorted list, and removed ones in a set. They are
+  merged into the arrays in bulk once there are enough of them, before the
+  next lookup.
+  """
+
+  PAGE_SHIFT = 20  # 1M pages
+  # Changes are merged in when there are more than this many, or more than
+  # a quarter of the code objects in the arrays.
+  MIN_REBUILD_SIZE = 4096
+  # Larger added code objects are merged in before the next lookup, so that
+  # it need not search far back through the added ones.
+  MAX_ADDED_SIZE = 64 * 1024
 
   def __init__(self):
-    self.pages = {}
-    self.min_address = 1 << 64
-    self.max_address = -1
+    # Start and end address, and the code object, of each code object in
+    # the arrays. max_ends[i] is the largest end address of the first i + 1,
+    # which bounds the search for code objects that overlap.
+    self.starts = []
+    self.ends = []
+    self.codes = []
+    self.max_ends = []
+    self.indexed = set()
+    self.removed = set()
+    # The same for the added code objects, sorted by start address.
+    self.added_starts = []
+    self.added_ends = []
+    self.added_codes = []
+    self.max_added_size = 0
 
   def Add(self, code, max_pages=-1):
-    page_id = CodePage.PageId(code.start_address)
-    limit_id = CodePage.PageId(code.end_address + CodePage.SIZE - 1)
-    pages = 0
-    while page_id < limit_id:
-      if max_pages >= 0 and pages > max_pages:
+    end_address = code.end_address
+    if max_pages >= 0:
+      limit = (((code.start_address >> CodeMap.PAGE_SHIFT) + max_pages + 1)
+               << CodeMap.PAGE_SHIFT)
+      if end_address > limit:
         print >>sys.stderr, \
             "Warning: page limit (%d) reached for %s [%s]" % (
             max_pages, code.name, code.origin)
-        break
-      if page_id in self.pages:
-        page = self.pages[page_id]
-      else:
-        page = CodePage(CodePage.PageAddressFromId(page_id))
-        self.pages[page_id] = page
-      page.Add(code)
-      page_id += 1
-      pages += 1
-    self.min_address = min(self.min_address, code.start_address)
-    self.max_address = max(self.max_address, code.end_address)
+        end_address = limit
+    i = bisect.bisect_right(self.added_starts, code.start_address)
+    self.added_starts.insert(i, code.start_address)
+    self.added_ends.insert(i, end_address)
+    self.added_codes.insert(i, code)
+    self.max_added_size = max(self.max_added_size,
+                              end_address - code.start_address)
 
   def Remove(self, code):
-    page_id = CodePage.PageId(code.start_address)
-    limit_id = CodePage.PageId(code.end_address + CodePage.SIZE - 1)
-    removed = False
-    while page_id < limit_id:
-      if page_id not in self.pages:
-        page_id += 1
-        continue
-      page = self.pages[page_id]
-      page.Remove(code)
-      removed = True
-      page_id += 1
-    return removed
+    i = bisect.bisect_left(self.added_starts, code.start_address)
+    while (i < len(self.added_starts) and
+           self.added_starts[i] == code.start_address):
+      if self.added_codes[i] is code:
+        del self.added_starts[i]
+        del self.added_ends[i]
+        del self.added_codes[i]
+        return True
+      i += 1
+    if code in self.indexed and code not in self.removed:
+      self.removed.add(code)
+      return True
+    return False
+
+  def Rebuild(self):
+    entries = [entry for entry in zip(self.starts, self.ends, self.codes)
+               if entry[2] not in self.removed]
+    entries.extend(zip(self.added_starts, self.added_ends, self.added_codes))
+    entries.sort(key=operator.itemgetter(0))
+    self.starts = [entry[0] for entry in entries]
+    self.ends = [entry[1] for entry in entries]
+    self.codes = [entry[2] for entry in entries]
+    self.max_ends = []
+    max_end = -1
+    for end_address in self.ends:
+      if end_address > max_end:
+        max_end = end_address
+      self.max_ends.append(max_end)
+    self.indexed = set(self.codes)
+    self.removed = set()
+    self.added_starts = []
+    self.added_ends = []
+    self.added_codes = []
+    self.max_added_size = 0
 
   def AllCode(self):
-    for page in self.pages.itervalues():
-      for code in page:
-        if CodePage.PageAddress(code.start_address) == page.address:
-          yield code
+    for code in self.codes:
+      if code not in self.removed:
+        yield code
+    for code in self.added_codes:
+      yield code
 
   def UsedCode(self):
     for code in self.AllCode():
@@ -304,12 +309,26 @@ class CodeMap(object):
       print code
 
   def Find(self, pc):
-    if pc < self.min_address or pc >= self.max_address:
-      return None
-    page_id = CodePage.PageId(pc)
-    if page_id not in self.pages:
-      return None
-    return self.pages[page_id].Find(pc)
+    if (self.max_added_size > CodeMap.MAX_ADDED_SIZE or
+        len(self.added_codes) + len(self.removed) >
+        max(CodeMap.MIN_REBUILD_SIZE, len(self.codes) / 4)):
+      self.Rebuild()
+    i = bisect.bisect_right(self.added_starts, pc) - 1
+    while i >= 0 and self.added_starts[i] + self.max_added_size > pc:
+      if pc < self.added_ends[i]:
+        return self.added_codes[i]
+      i -= 1
+    # Code objects [0, i) in the arrays start at or before pc.
+    i = bisect.bisect_right(self.starts, pc) - 1
+    while i >= 0 and self.max_ends[i] > pc:
+      if pc < self.ends[i] and self.codes[i] not in self.removed:
+        return self.codes[i]
+      i -= 1
+    return None
+
+  def FindAll(self, pcs):
+    """Returns a dict from each of pcs to the code object containing it."""
+    return dict((pc, self.Find(pc)) for pc in set(pcs))
 
 
 class CodeInfo(object):
@@ -618,6 +637,9 @@ PERF_SAMPLE_EVENT_IP_FORMAT = "u64"
 PERF_RECORD_MMAP = 1
 PERF_RECORD_SAMPLE = 9
 
+# Samples whose code objects are looked up together, at most.
+TICK_BATCH_SIZE = 64 * 1024
+
 
 class TraceReader(object):
   """Perf (linux-2.6/tools/perf) trace file reader."""
@@ -645,7 +667,6 @@ class TraceReader(object):
         (perf_event_attr.sample_type & PERF_SAMPLE_CALLCHAIN) != 0
     if self.callchain_supported:
       self.ip_struct = Descriptor.CTYPE_MAP[PERF_SAMPLE_EVENT_IP_FORMAT]
-      self.ip_size = ctypes.sizeof(self.ip_struct)
 
   def ReadEventHeader(self):
     if self.offset >= self.limit:
@@ -669,12 +690,9 @@ class TraceReader(object):
                                               offset + self.header_size)
     if not self.callchain_supported:
       return sample
-    sample.ips = []
     offset += self.header_size + ctypes.sizeof(sample)
-    for _ in xrange(sample.nr):
-      sample.ips.append(
-        self.ip_struct.from_buffer(self.trace, offset).value)
-      offset += self.ip_size
+    sample.ips = list((self.ip_struct * sample.nr).from_buffer(self.trace,
+                                                              offset))
     return sample
 
   def Dispose(self):
@@ -939,6 +957,7 @@ if __name__ == "__main__":
   v8_internal_ticks = 0
   mmap_time = 0
   sample_time = 0
+  code_lookups = 0
 
   # Process the snapshot log to fill the snapshot name map.
   snapshot_name_map = {}
@@ -960,8 +979,41 @@ if __name__ == "__main__":
   library_repo = LibraryRepo()
   log_reader.ReadUpToGC()
   trace_reader = TraceReader(options.trace)
+  # (ip, callchain ips) of the samples read since the code map last
+  # changed. Their code objects are looked up together.
+  samples = []
   while True:
     header, offset = trace_reader.ReadEventHeader()
+    if (not header or header.type == PERF_RECORD_MMAP or
+        len(samples) >= TICK_BATCH_SIZE):
+      start = time.time()
+      ips = [ip for (ip, _) in samples]
+      ips.extend(ip for (_, callchain) in samples for ip in callchain)
+      code_lookups += len(ips)
+      code_by_ip = code_map.FindAll(ips)
+      for ip, callchain in samples:
+        ticks += 1
+        code = code_by_ip[ip]
+        if code:
+          code.Tick(ip)
+          if code.codetype == Code.OPTIMIZED:
+            optimized_ticks += 1
+          elif code.codetype == Code.FULL_CODEGEN:
+            generated_ticks += 1
+          elif code.codetype == Code.V8INTERNAL:
+            v8_internal_ticks += 1
+        else:
+          missed_ticks += 1
+        if not library_repo.Tick(ip) and not code:
+          really_missed_ticks += 1
+        for caller_ip in callchain:
+          caller_code = code_by_ip[caller_ip]
+          if caller_code:
+            if code:
+              caller_code.CalleeTick(code)
+            code = caller_code
+      samples = []
+      sample_time += time.time() - start
     if not header:
       break
     events += 1
@@ -974,29 +1026,12 @@ if __name__ == "__main__":
         library_repo.Load(mmap_info, code_map, options)
       mmap_time += time.time() - start
     elif header.type == PERF_RECORD_SAMPLE:
-      ticks += 1
       start = time.time()
       sample = trace_reader.ReadSample(header, offset)
-      code = code_map.Find(sample.ip)
-      if code:
-        code.Tick(sample.ip)
-        if code.codetype == Code.OPTIMIZED:
-          optimized_ticks += 1
-        elif code.codetype == Code.FULL_CODEGEN:
-          generated_ticks += 1
-        elif code.codetype == Code.V8INTERNAL:
-          v8_internal_ticks += 1
-      else:
-        missed_ticks += 1
-      if not library_repo.Tick(sample.ip) and not code:
-        really_missed_ticks += 1
       if trace_reader.callchain_supported:
-        for ip in sample.ips:
-          caller_code = code_map.Find(ip)
-          if caller_code:
-            if code:
-              caller_code.CalleeTick(code)
-            code = caller_code
+        samples.append((sample.ip, sample.ips))
+      else:
+        samples.append((sample.ip, ()))
       sample_time += time.time() - start
 
   if options.dot:
@@ -1024,6 +1059,9 @@ if __name__ == "__main__":
       print "%10d used symbols" % len([c for c in code_map.UsedCode()])
       print "%9.2fs library processing time" % mmap_time
       print "%9.2fs tick processing time" % sample_time
+      if sample_time > 0:
+        print "%10d ticks/s, %d code lookups/s tick processing rate" % (
+            ticks / sample_time, code_lookups / sample_time)
 
   log_reader.Dispose()
   trace_reader.Dispose()
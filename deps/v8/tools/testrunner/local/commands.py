@@ -25,9 +25,14 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-
+import errno
+import os
+import select
+import signal
 import subprocess
 import sys
+import time
+from collections import deque
 from threading import Timer
 
 from ..local import utils
@@ -37,6 +42,11 @@ from ..objects import output
 SEM_INVALID_VALUE = -1
 SEM_NOGPFAULTERRORBOX = 0x0002  # Microsoft Platform SDK WinBase.h
 
+# Largest amount of each of stdout and stderr kept from a process. A process
+# that writes more keeps the beginning and the end of its output.
+MAX_OUTPUT_SIZE = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
 
 def Win32SetErrorMode(mode):
   prev_error_mode = SEM_INVALID_VALUE
@@ -49,8 +59,269 @@ def Win32SetErrorMode(mode):
   return prev_error_mode
 
 
+def _SetNonBlocking(fd):
+  import fcntl
+  fcntl.fcntl(fd, fcntl.F_SETFL, os.O_NONBLOCK | fcntl.fcntl(fd, fcntl.F_GETFL))
+
+
+class OutputBuffer(object):
+  """Keeps at most max_size bytes of a stream: its first and last halves, and
+  the number of bytes dropped in between."""
+
+  def __init__(self, max_size=MAX_OUTPUT_SIZE):
+    self.head_room = max_size / 2
+    self.tail_room = max_size - self.head_room
+    self.head = []
+    self.tail = deque()
+    self.tail_size = 0
+    self.dropped = 0
+
+  def Append(self, data):
+    if self.head_room > 0:
+      self.head.append(data[:self.head_room])
+      data = data[self.head_room:]
+      self.head_room -= len(self.head[-1])
+    if not data:
+      return
+    self.tail.append(data)
+    self.tail_size += len(data)
+    while self.tail_size > self.tail_room:
+      excess = self.tail_size - self.tail_room
+      if len(self.tail[0]) <= excess:
+        excess = len(self.tail.popleft())
+      else:
+        self.tail[0] = self.tail[0][excess:]
+      self.tail_size -= excess
+      self.dropped += excess
+
+  def GetValue(self):
+    head = "".join(self.head)
+    tail = "".join(self.tail)
+    if self.dropped:
+      return "%s\n[... %d bytes of output omitted ...]\n%s" % (
+          head, self.dropped, tail)
+    return head + tail
+
+
+class SupervisedProcess(object):
+  """A child process whose stdout and stderr are read through non-blocking
+  pipes into OutputBuffers. It is driven by a ProcessSupervisor."""
+
+  def __init__(self, process, timeout=None):
+    self.process = process
+    if timeout is None:
+      self.deadline = None
+    else:
+      self.deadline = time.time() + timeout
+    self.timed_out = False
+    self.exit_code = None
+    self.stdout = OutputBuffer()
+    self.stderr = OutputBuffer()
+    self.pipes = {}  # fd -> (pipe, OutputBuffer)
+    for (pipe, buf) in [(process.stdout, self.stdout),
+                        (process.stderr, self.stderr)]:
+      if pipe is not None:
+        _SetNonBlocking(pipe.fileno())
+        self.pipes[pipe.fileno()] = (pipe, buf)
+
+  def ReadFrom(self, fd):
+    """Reads what is available from pipe |fd|. Returns False once the pipe is
+    closed."""
+    (pipe, buf) = self.pipes[fd]
+    while True:
+      try:
+        data = os.read(fd, READ_SIZE)
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          continue
+        if e.errno == errno.EAGAIN:
+          return True
+        raise
+      if not data:
+        pipe.close()
+        del self.pipes[fd]
+        return False
+      buf.Append(data)
+      if len(data) < READ_SIZE:
+        return True
+
+  def CheckExited(self):
+    """Reaps the child if it has exited. Whatever it wrote is then already in
+    the pipes, so they are drained and closed rather than waiting for EOF,
+    which never comes if the child left a process behind that holds them."""
+    if self.exit_code is None:
+      self.exit_code = self.process.poll()
+      if self.exit_code is not None:
+        for fd in self.pipes.keys():
+          if self.ReadFrom(fd):
+            self.pipes[fd][0].close()
+            del self.pipes[fd]
+    return self.exit_code is not None
+
+  def CheckTimeout(self, now):
+    """Kills the child if it is past its deadline."""
+    if self.deadline is None or now < self.deadline or self.timed_out:
+      return
+    if not self.CheckExited():
+      self.Kill()
+      self.timed_out = True
+
+  def Kill(self):
+    if self.exit_code is None:
+      try:
+        self.process.kill()
+      except OSError, e:
+        if e.errno != errno.ESRCH:
+          raise
+
+  def IsDone(self):
+    return self.exit_code is not None and not self.pipes
+
+
+class _SelectPoll(object):
+  """select.poll() for platforms that lack it (OS X)."""
+
+  def __init__(self):
+    self.fds = set()
+
+  def register(self, fd, eventmask=None):
+    self.fds.add(fd)
+
+  def unregister(self, fd):
+    self.fds.remove(fd)
+
+  def poll(self, timeout=None):
+    if timeout is not None:
+      timeout = timeout / 1000.0
+    (readable, _, _) = select.select(list(self.fds), [], [], timeout)
+    return [ (fd, 0) for fd in readable ]
+
+
+POLL_READ_EVENTS = getattr(select, "POLLIN", 0)
+
+
+class ProcessSupervisor(object):
+  """Waits for SupervisedProcesses without threads or sleeping. A single
+  poll() covers the pipes of every process and sleeps until the nearest
+  deadline. On the main thread, a SIGCHLD handler wakes it through a pipe
+  of its own as soon as a child exits. Not available on Windows."""
+
+  def __init__(self):
+    if hasattr(select, "poll"):
+      self.poll = select.poll()
+    else:
+      self.poll = _SelectPoll()
+    self.owners = {}  # fd -> SupervisedProcess
+    self.running = {}  # SupervisedProcess -> its fds that are registered
+    (self.wakeup_fd, self.wakeup_write_fd) = os.pipe()
+    for fd in self.wakeup_fd, self.wakeup_write_fd:
+      _SetNonBlocking(fd)
+    try:
+      self.old_wakeup_fd = signal.set_wakeup_fd(self.wakeup_write_fd)
+      self.old_sigchld_handler = signal.signal(signal.SIGCHLD,
+                                               lambda signum, frame: None)
+      # Let other system calls carry on when a child exits.
+      signal.siginterrupt(signal.SIGCHLD, False)
+      self.have_sigchld = True
+    except ValueError:
+      # Signals are only delivered to the main thread. Elsewhere, a child is
+      # reaped once its pipes close.
+      self.have_sigchld = False
+    self.poll.register(self.wakeup_fd, POLL_READ_EVENTS)
+
+  def Add(self, child):
+    self.running[child] = set(child.pipes)
+    for fd in child.pipes:
+      self.owners[fd] = child
+      self.poll.register(fd, POLL_READ_EVENTS)
+
+  def _Unregister(self, child):
+    """Stops watching the pipes that |child| has closed."""
+    registered = self.running[child]
+    for fd in [ fd for fd in registered if not fd in child.pipes ]:
+      self.poll.unregister(fd)
+      del self.owners[fd]
+      registered.remove(fd)
+
+  def Wait(self):
+    """Blocks until at least one process is done, and returns the processes
+    that are done. They are no longer watched."""
+    while True:
+      done = [ c for c in self.running if c.IsDone() ]
+      if done:
+        for child in done:
+          del self.running[child]
+        return done
+      deadlines = [ c.deadline for c in self.running
+                    if c.deadline is not None and not c.timed_out ]
+      if deadlines:
+        timeout = max(0, int((min(deadlines) - time.time()) * 1000) + 1)
+      else:
+        timeout = None
+      try:
+        events = self.poll.poll(timeout)
+      except select.error, e:
+        if e.args[0] != errno.EINTR:
+          raise
+        events = []
+      check_exited = False
+      for (fd, _) in events:
+        if fd == self.wakeup_fd:
+          try:
+            while os.read(fd, READ_SIZE):
+              pass
+          except OSError, e:
+            if e.errno != errno.EAGAIN:
+              raise
+          check_exited = True
+        elif fd in self.owners:
+          child = self.owners[fd]
+          if not child.ReadFrom(fd):
+            # Usually the child is exiting; don't wait for its SIGCHLD.
+            child.CheckExited()
+          self._Unregister(child)
+      now = time.time()
+      for child in self.running:
+        if check_exited:
+          child.CheckExited()
+        if (not child.pipes and child.exit_code is None and
+            not self.have_sigchld):
+          child.exit_code = child.process.wait()
+        child.CheckTimeout(now)
+        self._Unregister(child)
+
+  def Close(self):
+    if self.have_sigchld:
+      signal.signal(signal.SIGCHLD, self.old_sigchld_handler)
+      signal.set_wakeup_fd(self.old_wakeup_fd)
+    os.close(self.wakeup_fd)
+    os.close(self.wakeup_write_fd)
+
+
 def RunProcess(verbose, timeout, args, **rest):
   if verbose: print "#", " ".join(args)
+  if utils.IsWindows():
+    # Pipes can't be poll()ed on Windows.
+    return RunProcessWithTimer(verbose, timeout, args, **rest)
+  process = subprocess.Popen(
+    args=args,
+    stdout=subprocess.PIPE,
+    stderr=subprocess.PIPE,
+    **rest
+  )
+  child = SupervisedProcess(process, timeout)
+  supervisor = ProcessSupervisor()
+  try:
+    supervisor.Add(child)
+    supervisor.Wait()
+  finally:
+    child.Kill()
+    supervisor.Close()
+  return (child.exit_code, child.timed_out, child.stdout.GetValue(),
+          child.stderr.GetValue())
+
+
+def RunProcessWithTimer(verbose, timeout, args, **rest):
   popen_args = args
   prev_error_mode = SEM_INVALID_VALUE
   if utils.IsWindows():
@@ -27,7 +27,6 @@
 
 
 import os
-import shutil
 import sys
 import time
 
@@ -66,7 +65,6 @@ class Runner(object):
     self.datapath = os.path.join("out", "testrunner_data")
     self.perf_data_manager = perfdata.PerfDataManager(self.datapath)
     self.perfdata = self.perf_data_manager.GetStore(context.arch, context.mode)
-    self.perf_failures = False
     self.printed_allocations = False
     self.tests = [ t for s in suites for t in s.tests ]
     if not context.no_sorting:
@@ -95,7 +93,6 @@ class Runner(object):
       fun()
     except Exception, e:
       print("PerfData exception: %s" % e)
-      self.perf_failures = True
 
   def _GetJob(self, test):
     command = self.GetCommand(test)
@@ -247,13 +244,8 @@ class Runner(object):
     finally:
       self._VerbosePrint("Closing process pool.")
       pool.terminate()
-      self._VerbosePrint("Closing database connection.")
+      self._VerbosePrint("Saving perf data.")
       self._RunPerfSafe(lambda: self.perf_data_manager.close())
-      if self.perf_failures:
-        # Nuke perf data in case of failures. This might not work on windows as
-        # some files might still be open.
-        print "Deleting perf test data due to db corruption."
-        shutil.rmtree(self.datapath)
     if queued_exception[0]:
       raise queued_exception[0]
 
@@ -26,67 +26,276 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 
+import array
+import math
+import mmap
 import os
-import shelve
+import struct
+import sys
+import tempfile
 import threading
+import zlib
 
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+  import msvcrt
 
-class PerfDataEntry(object):
-  def __init__(self):
-    self.avg = 0.0
-    self.count = 0
 
-  def AddResult(self, result):
-    kLearnRateLimiter = 99  # Greater value means slower learning.
-    # We use an approximation of the average of the last 100 results here:
-    # The existing average is weighted with kLearnRateLimiter (or less
-    # if there are fewer data points).
-    effective_count = min(self.count, kLearnRateLimiter)
-    self.avg = self.avg * effective_count + result
-    self.count = effective_count + 1
-    self.avg /= self.count
+# On-disk layout of a store, all little-endian:
+#   header                    magic, history length H, record count N,
+#                             size of the keys, CRC-32 of everything after it
+#   N records                 key offset, key length, number of samples
+#   N * H float32 samples     the durations of each test, oldest first
+#   keys                      sorted, so that lookups can bisect them
+# Every record has room for H samples, so the file can be mapped into memory
+# and a test's samples found without reading the rest of the file.
+MAGIC = "V8PERF\x00\x01"
+HEADER = struct.Struct("<8sIIIi")
+RECORD = struct.Struct("<III")
+SAMPLE_SIZE = array.array("f").itemsize
+HISTORY_LENGTH = 32
+
+
+class PerfDataError(Exception):
+  pass
+
+
+class PerfDataFile(object):
+  """Read access to a store file, e.g. through an mmap."""
+
+  def __init__(self, data):
+    self.data = data
+    if len(data) < HEADER.size:
+      raise PerfDataError("truncated header")
+    (magic, self.history_length, self.count, keys_size,
+     checksum) = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+      raise PerfDataError("bad magic %r" % magic)
+    self.samples_offset = HEADER.size + self.count * RECORD.size
+    self.slot_size = self.history_length * SAMPLE_SIZE
+    self.keys_offset = self.samples_offset + self.count * self.slot_size
+    if len(data) != self.keys_offset + keys_size:
+      raise PerfDataError("size %d, expected %d" %
+                          (len(data), self.keys_offset + keys_size))
+    if zlib.crc32(data[HEADER.size:]) != checksum:
+      raise PerfDataError("checksum mismatch")
+
+  def __len__(self):
+    return self.count
+
+  def Key(self, index):
+    (offset, length, _) = RECORD.unpack_from(
+        self.data, HEADER.size + index * RECORD.size)
+    start = self.keys_offset + offset
+    return self.data[start:start + length]
+
+  def Find(self, key):
+    """Returns the index of the record for |key|, or None."""
+    low = 0
+    high = self.count
+    while low < high:
+      middle = (low + high) // 2
+      if self.Key(middle) < key:
+        low = middle + 1
+      else:
+        high = middle
+    if low < self.count and self.Key(low) == key:
+      return low
+    return None
+
+  def Record(self, index):
+    """Returns the number of samples of a record and its raw slot: the
+    samples, padded to the history length."""
+    (_, _, length) = RECORD.unpack_from(
+        self.data, HEADER.size + index * RECORD.size)
+    start = self.samples_offset + index * self.slot_size
+    return (length, self.data[start:start + self.slot_size])
+
+  def Samples(self, index):
+    (length, slot) = self.Record(index)
+    return array.array("f", slot[:length * SAMPLE_SIZE]).tolist()
+
+
+def PackSamples(samples, history_length=HISTORY_LENGTH):
+  """Returns the record length and raw slot for the last |history_length| of
+  |samples|."""
+  samples = samples[-history_length:]
+  padding = [0.0] * (history_length - len(samples))
+  return (len(samples), array.array("f", samples + padding).tostring())
+
+
+def WritePerfDataFile(f, entries, history_length=HISTORY_LENGTH):
+  """Writes |entries|, a list of (key, record length, raw slot) sorted by
+  key, in the store format."""
+  records = []
+  keys_size = 0
+  for (key, length, slot) in entries:
+    assert len(slot) == history_length * SAMPLE_SIZE
+    records.append(RECORD.pack(keys_size, len(key), length))
+    keys_size += len(key)
+  body = "".join(records +
+                 [ slot for (_, _, slot) in entries ] +
+                 [ key for (key, _, _) in entries ])
+  f.write(HEADER.pack(MAGIC, history_length, len(entries), keys_size,
+                      zlib.crc32(body)))
+  f.write(body)
 
 
 class PerfDataStore(object):
+  """Keeps the last HISTORY_LENGTH durations of each test of one arch and
+  mode. Updates are kept in memory until close(), when they are merged into
+  the file with those of any other runner that wrote it in the meantime."""
+
   def __init__(self, datadir, arch, mode):
-    filename = os.path.join(datadir, "%s.%s.perfdata" % (arch, mode))
-    self.database = shelve.open(filename, protocol=2)
+    self.filename = os.path.join(datadir, "%s.%s.durations" % (arch, mode))
+    self.pending = {}  # Key -> durations not yet written, oldest first.
+    self.file = None
+    self.mapping = None
     self.closed = False
     self.lock = threading.Lock()
+    self._Open()
 
   def __del__(self):
     self.close()
 
+  def _Open(self):
+    """Maps the current store file, if there is a usable one."""
+    self._Unmap()
+    try:
+      self.file = open(self.filename, "rb")
+    except IOError:
+      return
+    try:
+      self.mapping = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+      self.data = PerfDataFile(self.mapping)
+    except (EnvironmentError, ValueError, PerfDataError), e:
+      # The file is ignored, and replaced by the next Flush().
+      print("Ignoring perf data in %s: %s" % (self.filename, e))
+      self._Unmap()
+
+  def _Unmap(self):
+    self.data = None
+    if self.mapping is not None:
+      self.mapping.close()
+      self.mapping = None
+    if self.file is not None:
+      self.file.close()
+      self.file = None
+
   def close(self):
     if self.closed: return
-    self.database.close()
     self.closed = True
+    try:
+      self.Flush()
+    finally:
+      self._Unmap()
 
   def GetKey(self, test):
     """Computes the key used to access data for the given testcase."""
     flags = "".join(test.flags)
     return str("%s.%s.%s" % (test.suitename(), test.path, flags))
 
+  def FetchHistory(self, test):
+    """Returns the last observed durations for |test|, oldest first."""
+    return self.RawFetchHistory(self.GetKey(test))
+
+  def RawFetchHistory(self, testkey):
+    with self.lock:
+      history = []
+      if self.data is not None:
+        index = self.data.Find(testkey)
+        if index is not None:
+          history = self.data.Samples(index)
+      history += self.pending.get(testkey, [])
+      return history[-HISTORY_LENGTH:]
+
   def FetchPerfData(self, test):
     """Returns the observed duration for |test| as read from the store."""
-    key = self.GetKey(test)
-    if key in self.database:
-      return self.database[key].avg
+    history = self.FetchHistory(test)
+    if history:
+      return sum(history) / len(history)
     return None
 
+  def FetchPercentile(self, test, percentile):
+    """Returns the |percentile|th percentile (by nearest rank) of the observed
+    durations for |test|, e.g. 50 for the median."""
+    history = sorted(self.FetchHistory(test))
+    if not history:
+      return None
+    rank = int(math.ceil(percentile / 100.0 * len(history)))
+    return history[max(0, min(rank, len(history)) - 1)]
+
   def UpdatePerfData(self, test):
-    """Updates the persisted value in the store with test.duration."""
+    """Adds test.duration to the observed durations for |test|."""
     testkey = self.GetKey(test)
     self.RawUpdatePerfData(testkey, test.duration)
 
   def RawUpdatePerfData(self, testkey, duration):
     with self.lock:
-      if testkey in self.database:
-        entry = self.database[testkey]
+      self.pending.setdefault(testkey, []).append(float(duration))
+
+  def Flush(self):
+    """Writes the pending updates, in one write of the whole store."""
+    with self.lock:
+      if not self.pending:
+        return
+      directory = os.path.dirname(self.filename)
+      if not os.path.exists(directory):
+        os.makedirs(directory)
+      with open(self.filename + ".lock", "a") as lock_file:
+        _LockFile(lock_file)
+        # Another runner may have replaced the file since we opened it.
+        self._Open()
+        entries = self._Merge()
+        (fd, temp) = tempfile.mkstemp(dir=directory)
+        try:
+          with os.fdopen(fd, "wb") as f:
+            WritePerfDataFile(f, entries)
+          self._Unmap()
+          if sys.platform == "win32" and os.path.exists(self.filename):
+            os.unlink(self.filename)
+          os.rename(temp, self.filename)
+        except:
+          os.unlink(temp)
+          raise
+        self.pending = {}
+        self._Open()
+
+  def _Merge(self):
+    """Returns the entries of the store file with the pending updates added,
+    sorted by key. Records without updates are copied as they are."""
+    keys = set(self.pending)
+    if self.data is not None:
+      old_keys = [ self.data.Key(i) for i in xrange(len(self.data)) ]
+      keys.update(old_keys)
+      old_index = dict((key, i) for (i, key) in enumerate(old_keys))
+    else:
+      old_index = {}
+    entries = []
+    for key in sorted(keys):
+      index = old_index.get(key)
+      if key in self.pending:
+        samples = []
+        if index is not None:
+          samples = self.data.Samples(index)
+        record = PackSamples(samples + self.pending[key])
+      elif self.data.history_length == HISTORY_LENGTH:
+        record = self.data.Record(index)
       else:
-        entry = PerfDataEntry()
-      entry.AddResult(duration)
-      self.database[testkey] = entry
+        record = PackSamples(self.data.Samples(index))
+      entries.append((key,) + record)
+    return entries
+
+
+def _LockFile(f):
+  """Blocks until this process holds the lock on |f|, until |f| is closed."""
+  if fcntl is not None:
+    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+  else:
+    f.seek(0)
+    msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
 
 
 class PerfDataManager(object):
@@ -110,6 +319,12 @@ class PerfDataManager(object):
         store.close()
     self.closed = True
 
+  def Flush(self):
+    with self.lock:
+      for modes in self.stores.values():
+        for store in modes.values():
+          store.Flush()
+
   def GetStore(self, arch, mode):
     with self.lock:
       if not arch in self.stores:
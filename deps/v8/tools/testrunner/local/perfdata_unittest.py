@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+# Copyright 2014 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import multiprocessing
+import os
+import shutil
+import tempfile
+import unittest
+
+import perfdata
+
+class FakeTest(object):
+  def __init__(self, path, duration=None):
+    self.path = path
+    self.flags = []
+    self.duration = duration
+
+  def suitename(self):
+    return "suite"
+
+def WriteDurations(datadir, name, durations):
+  manager = perfdata.PerfDataManager(datadir)
+  store = manager.GetStore("x64", "release")
+  for duration in durations:
+    store.UpdatePerfData(FakeTest(name, duration))
+  manager.close()
+
+class PerfDataTest(unittest.TestCase):
+  def setUp(self):
+    self.datadir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.datadir)
+
+  def GetStore(self):
+    return perfdata.PerfDataStore(self.datadir, "x64", "release")
+
+  def testRoundTrip(self):
+    WriteDurations(self.datadir, "a", [1.0, 2.0, 3.0, 10.0])
+    WriteDurations(self.datadir, "b", [0.5])
+    store = self.GetStore()
+    self.assertEquals([1.0, 2.0, 3.0, 10.0], store.FetchHistory(FakeTest("a")))
+    self.assertEquals(4.0, store.FetchPerfData(FakeTest("a")))
+    self.assertEquals(2.0, store.FetchPercentile(FakeTest("a"), 50))
+    self.assertEquals(10.0, store.FetchPercentile(FakeTest("a"), 100))
+    self.assertEquals(0.5, store.FetchPerfData(FakeTest("b")))
+    self.assertEquals(None, store.FetchPerfData(FakeTest("c")))
+
+  def testPendingUpdatesAreVisible(self):
+    store = self.GetStore()
+    store.UpdatePerfData(FakeTest("a", 1.0))
+    self.assertEquals(1.0, store.FetchPerfData(FakeTest("a")))
+    self.assertFalse(os.path.exists(store.filename))
+    store.close()
+    self.assertTrue(os.path.exists(store.filename))
+
+  def testHistoryLength(self):
+    durations = [ float(i) for i in range(perfdata.HISTORY_LENGTH + 10) ]
+    WriteDurations(self.datadir, "a", durations[:15])
+    WriteDurations(self.datadir, "a", durations[15:])
+    self.assertEquals(durations[-perfdata.HISTORY_LENGTH:],
+                      self.GetStore().FetchHistory(FakeTest("a")))
+
+  def testConcurrentWriters(self):
+    # Both stores read the file before either writes it.
+    store1 = self.GetStore()
+    store2 = self.GetStore()
+    store1.UpdatePerfData(FakeTest("a", 1.0))
+    store1.UpdatePerfData(FakeTest("b", 2.0))
+    store2.UpdatePerfData(FakeTest("a", 3.0))
+    store1.close()
+    store2.close()
+    store = self.GetStore()
+    self.assertEquals([1.0, 3.0], store.FetchHistory(FakeTest("a")))
+    self.assertEquals([2.0], store.FetchHistory(FakeTest("b")))
+
+  def testConcurrentProcesses(self):
+    processes = [
+        multiprocessing.Process(target=WriteDurations,
+                                args=(self.datadir, "t%d" % i, [float(i)] * 5))
+        for i in range(8) ]
+    for process in processes:
+      process.start()
+    for process in processes:
+      process.join()
+    store = self.GetStore()
+    for i in range(8):
+      self.assertEquals([float(i)] * 5,
+                        store.FetchHistory(FakeTest("t%d" % i)))
+
+  def testCorruptFile(self):
+    WriteDurations(self.datadir, "a", [1.0])
+    store = self.GetStore()
+    with open(store.filename, "r+b") as f:
+      f.seek(-1, os.SEEK_END)
+      f.write("X")
+    other = os.path.join(self.datadir, "other")
+    open(other, "w").close()
+    store = self.GetStore()
+    self.assertEquals(None, store.FetchPerfData(FakeTest("a")))
+    store.UpdatePerfData(FakeTest("b", 2.0))
+    store.close()
+    self.assertEquals(2.0, self.GetStore().FetchPerfData(FakeTest("b")))
+    self.assertTrue(os.path.exists(other))
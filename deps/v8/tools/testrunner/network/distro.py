@@ -25,6 +25,8 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import threading
+
 
 class Shell(object):
   def __init__(self, shell):
@@ -34,57 +36,96 @@ class Shell(object):
 
   def AddSuite(self, suite):
     self.tests += suite.tests
-    self.total_duration += suite.total_duration
+    self.total_duration += suite.CalculateTotalDuration()
 
   def SortTests(self):
-    self.tests.sort(cmp=lambda x, y: cmp(x.duration, y.duration))
-
-
-def Assign(suites, peers):
-  total_work = 0.0
-  for s in suites:
-    total_work += s.CalculateTotalDuration()
-
-  total_power = 0.0
-  for p in peers:
-    p.assigned_work = 0.0
-    total_power += p.jobs * p.relative_performance
-  for p in peers:
-    p.needed_work = total_work * p.jobs * p.relative_performance / total_power
-
-  shells = {}
-  for s in suites:
-    shell = s.shell()
-    if not shell in shells:
-      shells[shell] = Shell(shell)
-    shells[shell].AddSuite(s)
-  # Convert |shells| to list and sort it, shortest total_duration first.
-  shells = [ shells[s] for s in shells ]
-  shells.sort(cmp=lambda x, y: cmp(x.total_duration, y.total_duration))
-  # Sort tests within each shell, longest duration last (so it's
-  # pop()'ed first).
-  for s in shells: s.SortTests()
-  # Sort peers, least needed_work first.
-  peers.sort(cmp=lambda x, y: cmp(x.needed_work, y.needed_work))
-  index = 0
-  for shell in shells:
-    while len(shell.tests) > 0:
-      while peers[index].needed_work <= 0:
-        index += 1
-        if index == len(peers):
-          print("BIG FAT WARNING: Assigning tests to peers failed. "
-                "Remaining tests: %d. Going to slow mode." % len(shell.tests))
-          # Pick the least-busy peer. Sorting the list for each test
-          # is terribly slow, but this is just an emergency fallback anyway.
-          peers.sort(cmp=lambda x, y: cmp(x.needed_work, y.needed_work))
-          peers[0].ForceAddOneTest(shell.tests.pop(), shell)
-      # If the peer already has a shell assigned and would need this one
-      # and then yet another, try to avoid it.
-      peer = peers[index]
-      if (shell.total_duration < peer.needed_work and
-          len(peer.shells) > 0 and
-          index < len(peers) - 1 and
-          shell.total_duration <= peers[index + 1].needed_work):
-        peers[index + 1].AddTests(shell)
-      else:
-        peer.AddTests(shell)
+    self.tests.sort(key=lambda t: t.duration)
+
+  def PopTest(self):
+    t = self.tests.pop()
+    self.total_duration -= t.duration
+    return t
+
+
+class WorkQueue(object):
+  """Hands out tests to peers in batches, on request.
+
+  Peers pull a new batch whenever they are done with the last one, so a
+  peer that runs slower than expected simply pulls fewer batches. A batch
+  is worth half of the peer's share of the remaining work, by the tests'
+  expected durations (test.duration) and the peers' jobs and
+  relative_performance, so batches shrink as the run nears its end and
+  the peers finish at about the same time. Within each shell, the longest
+  tests are handed out first."""
+
+  # A batch keeps each of the peer's jobs busy for at least this many
+  # seconds, to make up for the round trip.
+  MIN_BATCH_DURATION = 1.0
+
+  def __init__(self, suites, peers):
+    shells = {}
+    for s in suites:
+      shell = s.shell()
+      if not shell in shells:
+        shells[shell] = Shell(shell)
+      shells[shell].AddSuite(s)
+    self.shells = shells.values()
+    for s in self.shells: s.SortTests()
+    self.total_power = 0.0
+    for p in peers:
+      p.assigned_work = 0.0
+      self.total_power += p.jobs * p.relative_performance
+    self.lock = threading.Lock()
+
+  def RemainingWork(self):
+    return sum(s.total_duration for s in self.shells)
+
+  def _PickShell(self, peer):
+    """Prefers the shells that the peer already has, to avoid sending it
+    more binaries; among those, the one with the most work left."""
+    candidates = [ s for s in self.shells if s.tests ]
+    if not candidates:
+      return None
+    known = [ s for s in candidates if s.shell in peer.shells ]
+    return max(known or candidates, key=lambda s: s.total_duration)
+
+  def NextBatch(self, peer):
+    """Returns the next tests for |peer| to run, all for the same shell, or
+    an empty list when there are none left. Adds the shell to peer.shells."""
+    with self.lock:
+      shell = self._PickShell(peer)
+      if shell is None:
+        return []
+      power = peer.jobs * peer.relative_performance
+      share = self.RemainingWork() * power / self.total_power
+      target = max(share / 2.0, self.MIN_BATCH_DURATION * peer.jobs)
+      batch = []
+      work = 0.0
+      while shell.tests and (work < target or len(batch) < peer.jobs):
+        t = shell.PopTest()
+        batch.append(t)
+        work += t.duration
+      peer.shells.add(shell.shell)
+      peer.assigned_work += work
+      return batch
+
+  def Requeue(self, peer, tests):
+    """Gives back the tests of a batch that |peer| did not finish."""
+    with self.lock:
+      shells = dict((s.shell, s) for s in self.shells)
+      for t in tests:
+        peer.assigned_work -= t.duration
+        shell = shells[t.suite.shell()]
+        shell.tests.append(t)
+        shell.total_duration += t.duration
+      for s in self.shells: s.SortTests()
+
+  def Drain(self):
+    """Removes and returns all remaining tests."""
+    with self.lock:
+      tests = []
+      for s in self.shells:
+        tests += s.tests
+        s.tests = []
+        s.total_duration = 0.0
+      return tests
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# Copyright 2014 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+import heapq
+import random
+import unittest
+
+from distro import WorkQueue
+
+class FakePeer(object):
+  def __init__(self, address, jobs, relative_performance, speed=None):
+    self.address = address
+    self.jobs = jobs
+    self.relative_performance = relative_performance
+    # How fast the peer really is.
+    self.speed = speed or relative_performance
+    self.shells = set()
+    self.assigned_work = 0
+
+class FakeSuite(object):
+  def __init__(self, shell, durations):
+    self._shell = shell
+    self.tests = [ FakeTest(self, d) for d in durations ]
+
+  def shell(self):
+    return self._shell
+
+  def CalculateTotalDuration(self):
+    return sum(t.duration for t in self.tests)
+
+class FakeTest(object):
+  def __init__(self, suite, duration):
+    self.suite = suite
+    self.duration = duration
+
+def MakeSuites(seed, count=2000):
+  rnd = random.Random(seed)
+  durations = [ rnd.expovariate(1.0) for _ in range(count) ]
+  # A few slow tests, as in every real suite.
+  durations[:10] = [ 30.0 ] * 10
+  return [ FakeSuite("d8", durations[:count / 2]),
+           FakeSuite("cctest", durations[count / 2:]) ]
+
+def BatchTime(peer, batch):
+  """The time |peer| takes to run |batch| on its jobs, longest first."""
+  slots = [ 0.0 ] * peer.jobs
+  for d in sorted([ t.duration for t in batch ], reverse=True):
+    heapq.heappush(slots, heapq.heappop(slots) + d / peer.speed)
+  return max(slots)
+
+def Simulate(queue, peers, round_trip=0.05):
+  """Lets |peers| pull batches until the queue is empty, and returns the time
+  at which the last one finishes and all batches handed out."""
+  events = [ (0.0, i) for i in range(len(peers)) ]
+  batches = []
+  end = 0.0
+  while events:
+    (now, i) = heapq.heappop(events)
+    batch = queue.NextBatch(peers[i])
+    if not batch:
+      end = max(end, now)
+      continue
+    batches.append((peers[i], batch))
+    heapq.heappush(events, (now + round_trip + BatchTime(peers[i], batch), i))
+  return end, batches
+
+class WorkQueueTest(unittest.TestCase):
+  def testEachTestOnce(self):
+    suites = MakeSuites(1)
+    peers = [ FakePeer("a", 4, 1.0), FakePeer("b", 8, 2.0) ]
+    _, batches = Simulate(WorkQueue(suites, peers), peers)
+    handed_out = [ t for (_, batch) in batches for t in batch ]
+    self.assertEquals(sum(len(s.tests) for s in suites), len(handed_out))
+    self.assertEquals(len(handed_out), len(set(map(id, handed_out))))
+    for (_, batch) in batches:
+      self.assertEquals(1, len(set(t.suite.shell() for t in batch)))
+
+  def testBatchesShrink(self):
+    peers = [ FakePeer("a", 4, 1.0), FakePeer("b", 4, 1.0) ]
+    _, batches = Simulate(WorkQueue(MakeSuites(2), peers), peers)
+    works = [ sum(t.duration for t in batch)
+              for (peer, batch) in batches if peer.address == "a" ]
+    self.assertTrue(works[0] > 10 * works[-1])
+
+  def testSlowPeerDoesNotGateRun(self):
+    suites = MakeSuites(3)
+    total_work = sum(s.CalculateTotalDuration() for s in suites)
+    # Peer "c" claims to be as fast as the others but is four times slower.
+    peers = [ FakePeer("a", 4, 1.0), FakePeer("b", 4, 1.0),
+              FakePeer("c", 4, 1.0, speed=0.25) ]
+    end, _ = Simulate(WorkQueue(suites, peers), peers)
+    ideal = total_work / sum(p.jobs * p.speed for p in peers)
+    # A static split by relative_performance would leave "c" with a third
+    # of the work.
+    static = (total_work / 3) / (4 * 0.25)
+    # At worst, "c" is still running one of the slowest tests at the end.
+    self.assertTrue(end < 1.1 * ideal + 30.0 / 0.25, (end, ideal))
+    self.assertTrue(end < static / 2, (end, static))
+
+  def testPrefersKnownShells(self):
+    peers = [ FakePeer("a", 4, 1.0) ]
+    queue = WorkQueue(MakeSuites(4), peers)
+    first = queue.NextBatch(peers[0])[0].suite.shell()
+    while True:
+      batch = queue.NextBatch(peers[0])
+      if batch[0].suite.shell() != first:
+        break
+    # The first shell was used up before the peer got the other one.
+    self.assertEquals(0, sum(len(s.tests) for s in queue.shells
+                             if s.shell == first))
+
+  def testRequeue(self):
+    peers = [ FakePeer("a", 4, 1.0), FakePeer("b", 4, 1.0) ]
+    queue = WorkQueue(MakeSuites(5, count=100), peers)
+    work = queue.RemainingWork()
+    batch = queue.NextBatch(peers[0])
+    self.assertTrue(peers[0].assigned_work > 0)
+    queue.Requeue(peers[0], batch)
+    self.assertAlmostEquals(0, peers[0].assigned_work)
+    self.assertAlmostEquals(work, queue.RemainingWork())
+    drained = queue.Drain()
+    self.assertEquals(100, len(drained))
+    self.assertEquals([], queue.NextBatch(peers[1]))
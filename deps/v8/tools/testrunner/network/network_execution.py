@@ -137,7 +137,7 @@ class NetworkedRunner(execution.Runner):
         self.binaries[shell] = binary
     if need_libv8:
       self.binaries["libv8.so"] = libv8
-    distro.Assign(self.suites, self.peers)
+    self.work_queue = distro.WorkQueue(self.suites, self.peers)
     # Spawn one thread for each peer.
     threads = []
     for p in self.peers:
@@ -160,8 +160,15 @@ class NetworkedRunner(execution.Runner):
       raise
     compression.Send(constants.END_OF_STREAM, self.local_socket)
     self.local_socket.close()
+    # Tests that were given back by failing peers after the others were done.
+    remaining = self.work_queue.Drain()
+    if remaining:
+      print("\nNo results for %d tests, running them locally." % len(remaining))
+      self._EnqueueLocally(remaining)
     if self.tests:
       self._RunInternal(jobs)
+    else:
+      self._RunPerfSafe(lambda: self.perf_data_manager.close())
     self.indicator.Done()
     return not self.failed
 
@@ -169,71 +176,101 @@ class NetworkedRunner(execution.Runner):
     sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     sock.settimeout(self.context.timeout + 10)
     code = sock.connect_ex((peer.address, constants.PEER_PORT))
+    test_map = {}  # The tests sent to the peer that have no results yet.
     if code == 0:
       try:
         peer.runtime = None
         start_time = time.time()
-        packet = workpacket.WorkPacket(peer=peer, context=self.context,
-                                       base_revision=self.base_svn_rev,
-                                       patch=self.patch,
-                                       pubkey=self.pubkey_fingerprint)
-        data, test_map = packet.Pack(self.binaries)
-        compression.Send(data, sock)
-        compression.Send(constants.END_OF_STREAM, sock)
-        rec = compression.Receiver(sock)
-        while not rec.IsDone() and not self.terminate:
-          data_list = rec.Current()
-          for data in data_list:
-            test_id = data[0]
-            if test_id < 0:
-              # The peer is reporting an error.
-              with self.lock:
-                print("\nPeer %s reports error: %s" % (peer.address, data[1]))
-              continue
-            test = test_map.pop(test_id)
-            test.MergeResult(data)
-            try:
-              self.perfdata.UpdatePerfData(test)
-            except Exception, e:
-              print("UpdatePerfData exception: %s" % e)
-              pass  # Just keep working.
+        rec = None
+        while not self.terminate:
+          # Pull the next batch once the peer is done with the last one.
+          known_shells = set(peer.shells)
+          batch = self.work_queue.NextBatch(peer)
+          if not batch:
+            break
+          packet = workpacket.WorkPacket(peer=peer, context=self.context,
+                                         tests=batch,
+                                         base_revision=self.base_svn_rev,
+                                         patch=self.patch,
+                                         pubkey=self.pubkey_fingerprint,
+                                         shells=peer.shells - known_shells,
+                                         batches=True)
+          try:
+            data, batch_map = packet.Pack(self.binaries)
+          except:
+            # The batch is neither in the queue nor in test_map yet.
+            self.work_queue.Requeue(peer, batch)
+            raise
+          test_map.update(batch_map)
+          compression.Send(data, sock)
+          if rec is None:
+            rec = compression.Receiver(sock)
+          else:
+            rec.Advance()
+          while (not rec.IsDone() and not self.terminate and
+                 rec.Current() != constants.END_OF_BATCH):
+            durations = []
+            for data in rec.Current():
+              self._ProcessPeerResult(peer, data, test_map, durations)
+            # One message per frame rather than SendBatch: the local server
+            # may be a daemon from an older checkout, which cannot read
+            # batched frames.
             with self.lock:
-              perf_key = self.perfdata.GetKey(test)
-              compression.Send(
-                  [constants.INFORM_DURATION, perf_key, test.duration,
-                   self.context.arch, self.context.mode],
-                  self.local_socket)
-              self.indicator.AboutToRun(test)
-              has_unexpected_output = test.suite.HasUnexpectedOutput(test)
-              if has_unexpected_output:
-                self.failed.append(test)
-                if test.output.HasCrashed():
-                  self.crashed += 1
-              else:
-                self.succeeded += 1
-              self.remaining -= 1
-              self.indicator.HasRun(test, has_unexpected_output)
-          rec.Advance()
+              for message in durations:
+                compression.Send(message, self.local_socket)
+            rec.Advance()
+          if rec.IsDone():
+            break  # The peer gave up, e.g. after an error.
+        compression.Send(constants.END_OF_STREAM, sock)
         peer.runtime = time.time() - start_time
       except KeyboardInterrupt:
         sock.close()
         raise
       except Exception, e:
         print("Got exception: %s" % e)
-        pass  # Fall back to local execution.
+        pass  # Let the other peers, or local execution, take over.
     else:
       compression.Send([constants.UNRESPONSIVE_PEER, peer.address],
                        self.local_socket)
     sock.close()
     if len(test_map) > 0:
-      # Some tests have not received any results. Run them locally.
-      print("\nNo results for %d tests, running them locally." % len(test_map))
-      self._EnqueueLocally(test_map)
+      # Some tests have not received any results. Give them back.
+      self.work_queue.Requeue(peer, test_map.values())
+
+  def _ProcessPeerResult(self, peer, data, test_map, durations):
+    """Records a result from |peer|, and adds the message informing the local
+    server of the test's duration to |durations|."""
+    test_id = data[0]
+    if test_id < 0:
+      # The peer is reporting an error.
+      with self.lock:
+        print("\nPeer %s reports error: %s" % (peer.address, data[1]))
+      return
+    test = test_map.pop(test_id)
+    test.MergeResult(data)
+    try:
+      self.perfdata.UpdatePerfData(test)
+    except Exception, e:
+      print("UpdatePerfData exception: %s" % e)
+      pass  # Just keep working.
+    perf_key = self.perfdata.GetKey(test)
+    durations.append([constants.INFORM_DURATION, perf_key, test.duration,
+                      self.context.arch, self.context.mode])
+    with self.lock:
+      self.indicator.AboutToRun(test)
+      has_unexpected_output = test.suite.HasUnexpectedOutput(test)
+      if has_unexpected_output:
+        self.failed.append(test)
+        if test.output.HasCrashed():
+          self.crashed += 1
+      else:
+        self.succeeded += 1
+      self.remaining -= 1
+      self.indicator.HasRun(test, has_unexpected_output)
 
-  def _EnqueueLocally(self, test_map):
+  def _EnqueueLocally(self, tests):
     with self.tests_lock:
-      for test in test_map:
-        self.tests.append(test_map[test])
+      self.tests += tests
 
   def _AnalyzePeerRuntimes(self):
     total_runtime = 0.0
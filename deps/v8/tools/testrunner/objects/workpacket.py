@@ -31,7 +31,8 @@ from . import testcase
 
 class WorkPacket(object):
   def __init__(self, peer=None, context=None, tests=None, binaries=None,
-               base_revision=None, patch=None, pubkey=None):
+               base_revision=None, patch=None, pubkey=None, shells=None,
+               batches=False):
     self.peer = peer
     self.context = context
     self.tests = tests
@@ -39,6 +40,12 @@ class WorkPacket(object):
     self.base_revision = base_revision
     self.patch = patch
     self.pubkey_fingerprint = pubkey
+    # The shells whose binaries to send along; by default all of the peer's.
+    self.shells = shells
+    # Whether more packets may follow on the same connection. The peer
+    # then answers each packet's results with END_OF_BATCH, not
+    # END_OF_STREAM.
+    self.batches = batches
 
   def Pack(self, binaries_dict):
     """
@@ -47,7 +54,10 @@ class WorkPacket(object):
     """
     need_libv8 = False
     binaries = []
-    for shell in self.peer.shells:
+    shells = self.shells
+    if shells is None:
+      shells = self.peer.shells
+    for shell in shells:
       prefetched_binary = binaries_dict[shell]
       binaries.append({"name": shell,
                        "blob": prefetched_binary[0],
@@ -61,7 +71,7 @@ class WorkPacket(object):
                        "sign": libv8[1]})
     tests = []
     test_map = {}
-    for t in self.peer.tests:
+    for t in self.tests:
       test_map[t.id] = t
       tests.append(t.PackTask())
     result = {
@@ -70,7 +80,8 @@ class WorkPacket(object):
       "context": self.context.Pack(),
       "base_revision": self.base_revision,
       "patch": self.patch,
-      "tests": tests
+      "tests": tests,
+      "batches": self.batches
     }
     return result, test_map
 
@@ -85,6 +96,7 @@ class WorkPacket(object):
     base_revision = packed["base_revision"]
     patch = packed["patch"]
     tests = [ testcase.TestCase.UnpackTask(t) for t in packed["tests"] ]
+    batches = packed.get("batches", False)
     return WorkPacket(context=ctx, tests=tests, binaries=binaries,
                       base_revision=base_revision, patch=patch,
-                      pubkey=pubkey_fingerprint)
+                      pubkey=pubkey_fingerprint, batches=batches)
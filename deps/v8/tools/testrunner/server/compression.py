@@ -25,34 +25,66 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
-
-import cStringIO as StringIO
 try:
   import ujson as json
 except ImportError:
   import json
-import os
 import struct
 import zlib
+from collections import deque
 
 from . import constants
 
+
+# A frame is a 4-byte big-endian size followed by that many bytes of
+# zlib-compressed JSON. A negative size marks a frame of several messages,
+# written by SendBatch: its JSON is the list of them.
+
+def _Compress(obj):
+  compression_level = 2  # 1 = fastest, 9 = best compression
+  return zlib.compress(json.dumps(obj), compression_level)
+
+
 def Send(obj, sock):
   """
   Sends a JSON encodable object over the specified socket (zlib-compressed).
   """
-  obj = json.dumps(obj)
-  compression_level = 2  # 1 = fastest, 9 = best compression
-  compressed = zlib.compress(obj, compression_level)
+  compressed = _Compress(obj)
   payload = struct.pack('>i', len(compressed)) + compressed
   sock.sendall(payload)
 
 
+def SendBatch(objs, sock):
+  """
+  Sends several JSON encodable objects over the specified socket, in a
+  single compressed frame. The Receiver returns them one at a time.
+  Receivers from before SendBatch existed cannot read the frame, so only use
+  it when the other end is known to run this code.
+  """
+  if not objs: return
+  compressed = _Compress(objs)
+  payload = struct.pack('>i', -len(compressed)) + compressed
+  sock.sendall(payload)
+
+
 class Receiver(object):
+  """
+  Reads the messages sent over |sock| by Send and SendBatch.
+
+  Data is received straight into a bytearray with recv_into and framed in
+  place: a message is parsed from the buffer without copying it out, and
+  unread data is moved back to the front of the buffer only when the next
+  frame would not fit behind it.
+  """
+
+  INITIAL_BUFFER_SIZE = 64 * 1024
+
   def __init__(self, sock):
     self.sock = sock
-    self.data = StringIO.StringIO()
-    self.datalength = 0
+    self.buffer = bytearray(self.INITIAL_BUFFER_SIZE)
+    self.start = 0  # Start of the unread data in self.buffer.
+    self.end = 0  # End of the unread data.
+    self.batch = deque()  # Messages of the current frame not yet returned.
     self._next = self._GetNext()
 
   def IsDone(self):
@@ -62,50 +94,44 @@ class Receiver(object):
     return self._next
 
   def Advance(self):
-    try:
-      self._next = self._GetNext()
-    except:
-      raise
+    self._next = self._GetNext()
 
   def _GetNext(self):
-    try:
-      while self.datalength < constants.SIZE_T:
-        try:
-          chunk = self.sock.recv(8192)
-        except:
-          raise
-        if not chunk: return None
-        self._AppendData(chunk)
-      size = self._PopData(constants.SIZE_T)
-      size = struct.unpack(">i", size)[0]
-      while self.datalength < size:
-        try:
-          chunk = self.sock.recv(8192)
-        except:
-          raise
-        if not chunk: return None
-        self._AppendData(chunk)
-      result = self._PopData(size)
-      result = zlib.decompress(result)
-      result = json.loads(result)
-      if result == constants.END_OF_STREAM:
-        return None
-      return result
-    except:
-      raise
-
-  def _AppendData(self, new):
-    self.data.seek(0, os.SEEK_END)
-    self.data.write(new)
-    self.datalength += len(new)
-
-  def _PopData(self, length):
-    self.data.seek(0)
-    chunk = self.data.read(length)
-    remaining = self.data.read()
-    self.data.close()
-    self.data = StringIO.StringIO()
-    self.data.write(remaining)
-    assert self.datalength - length == len(remaining)
-    self.datalength = len(remaining)
-    return chunk
+    while not self.batch:
+      if not self._Fill(constants.SIZE_T): return None
+      size = struct.unpack_from(">i", self.buffer, self.start)[0]
+      self.start += constants.SIZE_T
+      if not self._Fill(abs(size)): return None
+      result = json.loads(zlib.decompress(
+          buffer(self.buffer, self.start, abs(size))))
+      self.start += abs(size)
+      if size < 0:
+        self.batch.extend(result)
+      else:
+        self.batch.append(result)
+    result = self.batch.popleft()
+    if result == constants.END_OF_STREAM:
+      self.batch.clear()
+      return None
+    return result
+
+  def _Fill(self, length):
+    """
+    Receives until at least |length| bytes are unread. Returns False if the
+    connection is closed first.
+    """
+    while self.end - self.start < length:
+      if self.start + length > len(self.buffer):
+        unread = self.end - self.start
+        if length > len(self.buffer):
+          new_buffer = bytearray(max(length, 2 * len(self.buffer)))
+          new_buffer[:unread] = self.buffer[self.start:self.end]
+          self.buffer = new_buffer
+        else:
+          self.buffer[:unread] = self.buffer[self.start:self.end]
+        self.start = 0
+        self.end = unread
+      received = self.sock.recv_into(memoryview(self.buffer)[self.end:])
+      if not received: return False
+      self.end += received
+    return True
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+# Copyright 2014 the V8 project authors. All rights reserved.
+# Use of this source code is governed by a BSD-style license that can be
+# found in the LICENSE file.
+
+"""
+Measures how many messages per second compression.Send (or SendBatch) and
+compression.Receiver pass between two local processes. The messages look
+like packed test results.
+
+Run from tools/:
+  python -m testrunner.server.compression_benchmark [--messages=N] ...
+"""
+
+import multiprocessing
+import optparse
+import socket
+import sys
+import time
+
+from . import compression
+from . import constants
+
+
+def MakeResult(test_id, payload):
+  # Like TestCase.PackResult: [id, [exit code, timed out, stdout, stderr],
+  # duration].
+  return [test_id, [0, False, payload, ""], 0.01]
+
+
+def SendMessages(sock, count, batch, payload_size):
+  payload = "x" * payload_size
+  if batch <= 1:
+    for i in xrange(count):
+      compression.Send(MakeResult(i, payload), sock)
+  else:
+    for first in xrange(0, count, batch):
+      last = min(first + batch, count)
+      compression.SendBatch(
+          [ MakeResult(i, payload) for i in xrange(first, last) ], sock)
+  compression.Send(constants.END_OF_STREAM, sock)
+  sock.close()
+
+
+def Run(count, batch, payload_size):
+  """Returns the number of messages per second received."""
+  (receiving, sending) = socket.socketpair()
+  sender = multiprocessing.Process(target=SendMessages,
+                                   args=(sending, count, batch, payload_size))
+  sender.start()
+  sending.close()
+  start_time = time.time()
+  received = 0
+  rec = compression.Receiver(receiving)
+  while not rec.IsDone():
+    received += 1
+    rec.Advance()
+  elapsed = time.time() - start_time
+  sender.join()
+  receiving.close()
+  assert received == count, "received %d of %d" % (received, count)
+  return received / elapsed
+
+
+def BuildOptions():
+  result = optparse.OptionParser()
+  result.add_option("--messages", help="Number of messages to send",
+                    default=100000, type="int")
+  result.add_option("--payload", help="Size of each message's stdout",
+                    default=100, type="int")
+  result.add_option("--batch",
+                    help="Messages per frame, comma-separated (1: Send)",
+                    default="1,10,100")
+  return result
+
+
+def Main():
+  (options, args) = BuildOptions().parse_args()
+  print("%d messages, %d byte payload" % (options.messages, options.payload))
+  for batch in [ int(b) for b in options.batch.split(",") ]:
+    rate = Run(options.messages, batch, options.payload)
+    print("%4d per frame: %10.0f messages/s" % (batch, rate))
+  return 0
+
+
+if __name__ == "__main__":
+  sys.exit(Main())
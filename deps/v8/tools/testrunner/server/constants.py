@@ -32,6 +32,7 @@ PRESENCE_PORT = 9993  # Port for presence daemon.
 STATUS_PORT = 9994  # Port for network requests not related to workpackets.
 
 END_OF_STREAM = "end of dtest stream"  # Marker for end of network requests.
+END_OF_BATCH = "end of dtest batch"  # Marker for end of a work packet's results.
 SIZE_T = 4  # Number of bytes used for network request size header.
 
 # Messages understood by the local request handler.
@@ -39,7 +39,7 @@ from . import presence_handler
 from . import signatures
 from . import status_handler
 from . import work_handler
-from ..network import perfdata
+from ..local import perfdata
 
 
 class Server(daemon.Daemon):
@@ -124,6 +124,7 @@ class Server(daemon.Daemon):
   def Shutdown(self):
     with open(self.relative_perf_filename, "w") as f:
       f.write("%s" % self.relative_perf)
+    self.perf_data_manager.close()
     self.presence_daemon.shutdown()
     self.presence_daemon.server_close()
     self.local_handler.shutdown()
@@ -145,6 +146,8 @@ class Server(daemon.Daemon):
         for p2 in self.peers:
           if not p2.trusted: continue
           status_handler.TryTransitiveTrust(p2, p.pubkey, self)
+    # Save the test durations that clients reported since the last time.
+    self.perf_data_manager.Flush()
     # TODO: Ping for more peers waiting to be discovered.
     # TODO: Update the checkout (if currently idle).
 
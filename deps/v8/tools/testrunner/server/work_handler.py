@@ -42,14 +42,20 @@ from ..objects import workpacket
 class WorkHandler(SocketServer.BaseRequestHandler):
 
   def handle(self):
-    rec = compression.Receiver(self.request)
-    while not rec.IsDone():
-      data = rec.Current()
-      with self.server.job_lock:
-        self._WorkOnWorkPacket(data)
-      rec.Advance()
+    # The checkout and binaries belong to one client at a time, so the lock
+    # is held for all the packets of a connection.
+    with self.server.job_lock:
+      self.checkout = None  # (base_revision, patch) of the current checkout
+      rec = compression.Receiver(self.request)
+      while not rec.IsDone():
+        data = rec.Current()
+        if not self._WorkOnWorkPacket(data):
+          break
+        rec.Advance()
 
   def _WorkOnWorkPacket(self, data):
+    """Runs the tests of one packet. Returns False after an error, when no
+    more packets are accepted."""
     server_root = self.server.daemon.root
     v8_root = os.path.join(server_root, "v8")
     os.chdir(v8_root)
@@ -61,17 +67,28 @@ class WorkHandler(SocketServer.BaseRequestHandler):
       os.makedirs(self.ctx.shell_dir)
     for binary in packet.binaries:
       if not self._UnpackBinary(binary, packet.pubkey_fingerprint):
-        return
+        return False
 
-    if not self._CheckoutRevision(packet.base_revision):
-      return
+    # Later packets of a connection usually need the same checkout.
+    if self.checkout != (packet.base_revision, packet.patch):
+      self.checkout = None
+      if not self._CheckoutRevision(packet.base_revision):
+        return False
 
-    if not self._ApplyPatch(packet.patch):
-      return
+      if not self._ApplyPatch(packet.patch):
+        return False
+      self.checkout = (packet.base_revision, packet.patch)
 
     tests = packet.tests
     endpoint.Execute(v8_root, self.ctx, tests, self.request, self.server.daemon)
+    if packet.batches:
+      try:
+        compression.Send(constants.END_OF_BATCH, self.request)
+        return True
+      except Exception, e:
+        pass  # Peer is gone.
     self._SendResponse()
+    return False
 
   def _SendResponse(self, error_message=None):
     try:
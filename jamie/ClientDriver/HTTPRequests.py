@@ -1,18 +1,34 @@
 import requests
 import logging
 
+# Seconds to wait for the server before a request fails with requests.exceptions.Timeout (None: wait forever)
+# Set by the client driver, e.g. from its --timeout option
+TIMEOUT = 1
+
+# Returns a requests.Session with a single keep-alive connection, for one simulated client.
+# A client issues its requests one at a time, so it never needs more than one connection.
+def newSession ():
+	session = requests.Session()
+	adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=1)
+	session.mount('http://', adapter)
+	session.mount('https://', adapter)
+	return session
+
 # HTTP GET on URL
-def httpGet (url):
+# If SESSION is provided, its connection is reused
+# Raises requests.exceptions.Timeout if the server does not respond within TIMEOUT seconds
+def httpGet (url, session=None):
 	logging.info("httpGet: url %s" % (url))
-	try:
-		r = requests.get(url, timeout=1)
-		return r
-	except requests.exceptions.Timeout:
-		logging.debug("httpGet: Timed out")
-		return None
+	if (session is None):
+		session = requests
+	return session.get(url, timeout=TIMEOUT)
 
-def httpPostJSON (url, jsonData):
+# If SESSION is provided, its connection is reused
+# Raises requests.exceptions.Timeout if the server does not respond within TIMEOUT seconds
+def httpPostJSON (url, jsonData, session=None):
 	logging.info("httpPostJSON: url %s, data %s" % (url, jsonData))
+	if (session is None):
+		session = requests
 	headers = {'content-type': 'application/json'}
-	r = requests.post(url, data=jsonData, headers=headers)
+	r = session.post(url, data=jsonData, headers=headers, timeout=TIMEOUT)
 	return r.content
@@ -0,0 +1,60 @@
+import math
+import threading
+
+# Nearest-rank percentile of SORTEDSAMPLES (non-empty, ascending), 0 < P <= 100
+def percentile (sortedSamples, p):
+	assert(len(sortedSamples) and 0 < p and p <= 100)
+	rank = int(math.ceil(p / 100.0 * len(sortedSamples)))
+	return sortedSamples[max(rank, 1) - 1]
+
+# Records the latency of each completed request, by request type (e.g. 'VisitSite', 'Move').
+# Safe to share between client threads.
+class LatencyRecorder:
+	PERCENTILES = [50, 99, 99.9]
+
+	def __init__ (self):
+		self.lock = threading.Lock()
+		self.samples = {} # request type -> list of latencies in seconds
+		self.errors = {} # request type -> number of requests that raised
+
+	def Record (self, reqType, latency, failed=False):
+		with self.lock:
+			self.samples.setdefault(reqType, []).append(latency)
+			if (failed):
+				self.errors[reqType] = self.errors.get(reqType, 0) + 1
+
+	def NumRequests (self):
+		with self.lock:
+			return sum([len(s) for s in self.samples.values()])
+
+	#output: histogram -- list of (upper bound in ms, count) pairs for the latencies of REQTYPE
+	# Buckets double in width starting from 1 ms; empty buckets above the slowest request are omitted.
+	def Histogram (self, reqType):
+		with self.lock:
+			samples = list(self.samples.get(reqType, []))
+		counts = {}
+		for latency in samples:
+			ms = latency * 1000
+			bucket = 0 if (ms <= 1) else int(math.ceil(math.log(ms, 2)))
+			counts[bucket] = counts.get(bucket, 0) + 1
+		if (not counts):
+			return []
+		return [(2 ** b, counts.get(b, 0)) for b in range(0, max(counts.keys()) + 1)]
+
+	#input: elapsed -- wall-clock duration of the run in seconds
+	#output: lines -- human-readable summary: throughput, then count, errors, mean, percentiles, max per request type
+	def Report (self, elapsed):
+		with self.lock:
+			samples = dict([(k, sorted(v)) for k, v in self.samples.items()])
+			errors = dict(self.errors)
+		nRequests = sum([len(s) for s in samples.values()])
+		elapsed = max(elapsed, 1e-9)
+
+		lines = ["%i requests in %.3f s: %.1f requests/s" % (nRequests, elapsed, nRequests / elapsed)]
+		pctHeaders = " ".join(["%10s" % ("p%s(ms)" % p) for p in LatencyRecorder.PERCENTILES])
+		lines.append("%-12s %8s %8s %10s %s %10s" % ("type", "count", "errors", "mean(ms)", pctHeaders, "max(ms)"))
+		for reqType in sorted(samples.keys()):
+			s = samples[reqType]
+			pcts = " ".join(["%10.2f" % (1000 * percentile(s, p)) for p in LatencyRecorder.PERCENTILES])
+			lines.append("%-12s %8i %8i %10.2f %s %10.2f" % (reqType, len(s), errors.get(reqType, 0), 1000 * sum(s) / len(s), pcts, 1000 * s[-1]))
+		return lines
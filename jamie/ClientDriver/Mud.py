@@ -1,7 +1,7 @@
 from functools import partial
 import logging
 import random
-from HTTPRequests import httpGet
+from HTTPRequests import httpGet, newSession
 
 class MudClient:
 	DIRECTIONS = ["up", "down", "left", "right"]
@@ -9,6 +9,7 @@ class MudClient:
 	def __init__ (self, mudURL, id):
 		self.url = mudURL
 		self.userID = id
+		self.session = newSession()
 
 		self.visitedSite = False
 		self.registered = False
@@ -22,7 +23,7 @@ class MudClient:
 		for page in ['', 'style.css', 'favicon.ico']:
 			fullURL = "%s/%s" % (self.url, page)
 			logging.info("MudClient::VisitSite: %s" % (fullURL))
-			httpGet(fullURL)
+			httpGet(fullURL, session=self.session)
 		self.visitedSite = True
 
 	# Do this second
@@ -30,7 +31,7 @@ class MudClient:
 		assert (self.visitedSite)
 		fullURL = "%s/register?id=%d" % (self.url, self.userID)
 		logging.info("MudClient::Register: %s" % (fullURL))
-		httpGet(fullURL)
+		httpGet(fullURL, session=self.session)
 		self.registered = True
 
 	# After registration and before disconnect
@@ -39,21 +40,21 @@ class MudClient:
 		direction = random.choice(self.DIRECTIONS)
 		fullURL = "%s/move?id=%d&direction=%s" % (self.url, self.userID, direction)
 		logging.info("MudClient::Move: %s" % (fullURL))
-		httpGet(fullURL)
+		httpGet(fullURL, session=self.session)
 
 	# After registration and before disconnect
 	def GetBoard (self):
 		assert (self.visitedSite and self.registered and not self.disconnected)
 		fullURL = "%s/recv" % (self.url)
 		logging.info("MudClient::GetBoard: %s" % (fullURL))
-		httpGet(fullURL)
+		httpGet(fullURL, session=self.session)
 
 	# Final step
 	def Disconnect(self):
 		assert (self.visitedSite and self.registered and not self.disconnected)
 		fullURL = "%s/part?id=%d" % (self.url, self.userID)
 		logging.info("MudClient::Disconnect: %s" % (fullURL))
-		httpGet(fullURL)
+		httpGet(fullURL, session=self.session)
 		self.disconnected = True
 
 class MudClientDriver:
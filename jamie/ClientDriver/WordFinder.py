@@ -2,7 +2,7 @@ import json
 from functools import partial
 import logging
 import random
-from HTTPRequests import httpGet, httpPostJSON
+from HTTPRequests import httpGet, httpPostJSON, newSession
 
 
 class WordFinderClient:
@@ -11,6 +11,7 @@ class WordFinderClient:
 	def __init__ (self, wfURL, id):
 		self.url = wfURL
 		self.clientID = id
+		self.session = newSession()
 		logging.debug("WordFinderClient::__init__: wfURL %s id %i" % (wfURL, id))
 
 		self.visitedSite = False
@@ -23,7 +24,7 @@ class WordFinderClient:
 		for page in ['']:
 			fullURL = "%s/%s" % (self.url, page)
 			logging.info("WordFinderClient::VisitSite: client %i: %s" % (self.clientID, fullURL))
-			httpGet(fullURL)
+			httpGet(fullURL, session=self.session)
 		self.visitedSite = True
 
 	# Look up a word
@@ -32,7 +33,7 @@ class WordFinderClient:
 		logging.info("WordFinderClient::Lookup: client %i" % (self.clientID))
 		fullURL = "%s/%s" % (self.url, 'search')
 		jsonData = json.dumps({ 'pattern' : random.choice(WordFinderClient.PATTERNS) })
-		httpPostJSON(fullURL, jsonData)
+		httpPostJSON(fullURL, jsonData, session=self.session)
 
 class WordFinderClientDriver:
 	N_META_REQUESTS = 1
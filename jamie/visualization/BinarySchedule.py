@@ -0,0 +1,278 @@
+# Author: Jamie Davis (davisjam@vt.edu)
+# Description: Compact columnar binary format for libuv callback schedules
+# Defines the following public classes:
+# 	BinaryScheduleFile
+# Defines the following public functions:
+# 	isBinaryScheduleFile
+# 	writeBinarySchedule
+# 	formatCallbackString
+# Python version: 2.7.6
+#
+# File layout (all integers little-endian):
+#   header                '<8sIII': MAGIC, VERSION, nNodes, nStrings
+#   integer columns       one per INT_KEYS entry, nNodes int64 each (times in ns)
+#   string columns        one per STRING_KEYS entry, nNodes uint32 each (indices into the string table)
+#   string table offsets  nStrings+1 uint64, relative to the start of the string table data
+#   string table data     the distinct strings, concatenated
+#
+# Each distinct string (names, contexts, cb types, ...) is stored once.
+# Nodes are stored in the order they were written, which for files converted from text is the text file's order.
+
+import itertools
+import logging
+import mmap
+import os
+import struct
+
+import Callback as CB
+
+MAGIC = "UVSCHEDB"
+VERSION = 1
+_HEADER = struct.Struct('<8sIII')
+
+INT_KEYS = CB.CallbackNode.INT_KEYS + CB.CallbackNode.TIME_KEYS
+STRING_KEYS = [k for k in CB.CallbackNode.REQUIRED_KEYS if k not in INT_KEYS]
+_INT_KEY_SET = set(INT_KEYS)
+_INTERNED_KEY_SET = set(CB.CallbackNode.INTERNED_KEYS)
+
+_INT = struct.Struct('<q')
+_STRING_REF = struct.Struct('<I')
+_STRING_OFFSET = struct.Struct('<Q')
+
+# input: (fileName)
+# output: (isBinary) True if fileName begins with the binary schedule MAGIC
+# Throws any errors it encounters during file IO
+def isBinaryScheduleFile(fileName):
+	with open(fileName, 'rb') as f:
+		return (f.read(len(MAGIC)) == MAGIC)
+
+# input: (fields)
+#   fields     dict from CallbackNode.REQUIRED_KEYS to values; times in ns
+# output: (callbackString) in the format written by scheduler_emit
+def formatCallbackString(fields):
+	kvStrings = []
+	for key in CB.CallbackNode.REQUIRED_KEYS:
+		value = fields[key]
+		if key in CB.CallbackNode.TIME_KEYS:
+			nsPerS = long(1e9)
+			kvStrings.append("<{}> <{:d}s {:d}ns>".format(key, long(value)/nsPerS, long(value) % nsPerS))
+		else:
+			kvStrings.append("<{}> <{}>".format(key, value))
+	return " | ".join(kvStrings)
+
+# input: (fieldsIter, outFile)
+#   fieldsIter   iterable of dicts as produced by Callback._parseStandardCallbackString
+#   outFile      where to write the binary schedule
+# output: (nNodes) number of nodes written
+#
+# The columns are accumulated in packed form before writing, since their sizes are only known at the end.
+# May raise IOError
+def writeBinarySchedule(fieldsIter, outFile):
+	intColumns = dict([(k, bytearray()) for k in INT_KEYS])
+	stringColumns = dict([(k, bytearray()) for k in STRING_KEYS])
+	stringToIx = {}
+	strings = []
+
+	nNodes = 0
+	for fields in fieldsIter:
+		for k in INT_KEYS:
+			intColumns[k].extend(_INT.pack(long(fields[k])))
+		for k in STRING_KEYS:
+			s = fields[k]
+			ix = stringToIx.get(s)
+			if ix is None:
+				ix = len(strings)
+				stringToIx[s] = ix
+				strings.append(s)
+			stringColumns[k].extend(_STRING_REF.pack(ix))
+		nNodes += 1
+
+	logging.debug("Writing {} nodes and {} distinct strings to {}".format(nNodes, len(strings), outFile))
+	with open(outFile, 'wb') as f:
+		f.write(_HEADER.pack(MAGIC, VERSION, nNodes, len(strings)))
+		for k in INT_KEYS:
+			f.write(intColumns[k])
+		for k in STRING_KEYS:
+			f.write(stringColumns[k])
+		offset = 0
+		offsets = [0]
+		for s in strings:
+			offset += len(s)
+			offsets.append(offset)
+		f.write(struct.pack('<{}Q'.format(len(offsets)), *offsets))
+		for s in strings:
+			f.write(s)
+	return nNodes
+
+#############################
+# BinaryScheduleFile
+#############################
+
+# A memory-mapped binary schedule.
+# Fields are read from the mapping on demand, and CallbackNodes are only materialized when requested.
+# Each node is materialized at most once; repeated requests return the same CallbackNode.
+#
+# Random access (getField, getNode) reads single entries. The sequential generators (callbackValues and those built on it)
+# instead decode the string table once and the columns ROWS_PER_CHUNK rows at a time, with one unpack per column,
+# and build the nodes from the decoded rows.
+class BinaryScheduleFile(object):
+	# Rows decoded at a time by the sequential generators. Bounds the memory taken by decoded columns.
+	ROWS_PER_CHUNK = 16*1024
+
+	# input: (fileName)
+	# May raise IOError, or ValueError if fileName is not a binary schedule
+	def __init__(self, fileName):
+		self.fileName = fileName
+		self._file = open(fileName, 'rb')
+		size = os.fstat(self._file.fileno()).st_size
+		if size < _HEADER.size:
+			self._file.close()
+			raise ValueError("{} is too small to be a binary schedule".format(fileName))
+		self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+		magic, version, self.nNodes, self.nStrings = _HEADER.unpack_from(self._mm, 0)
+		if magic != MAGIC or version != VERSION:
+			self.close()
+			raise ValueError("{} is not a version {} binary schedule".format(fileName, VERSION))
+
+		# Compute the offset of each column
+		offset = _HEADER.size
+		self._columnOffsets = {}
+		for k in INT_KEYS:
+			self._columnOffsets[k] = offset
+			offset += _INT.size * self.nNodes
+		for k in STRING_KEYS:
+			self._columnOffsets[k] = offset
+			offset += _STRING_REF.size * self.nNodes
+		self._stringOffsetsOffset = offset
+		self._stringDataOffset = offset + _STRING_OFFSET.size * (self.nStrings + 1)
+
+		self._strings = {} # string table ix -> string, filled on demand
+		self._nodes = [None] * self.nNodes # node ix -> CallbackNode, filled on demand
+		self._stringTable = None # list of all the strings, once decoded; see _decodeStringTable
+		self._internedIxs = set() # string table ixs whose _stringTable entry is interned
+
+	def __len__(self):
+		return self.nNodes
+
+	def close(self):
+		self._mm.close()
+		self._file.close()
+
+	# input: (ix, key)
+	# output: (value) the value of field key for node ix, without materializing the node.
+	#   Integer fields are returned as ints/longs, string fields as strings.
+	def getField(self, ix, key):
+		assert(0 <= ix < self.nNodes)
+		if key in _INT_KEY_SET:
+			return _INT.unpack_from(self._mm, self._columnOffsets[key] + _INT.size*ix)[0]
+		stringIx = _STRING_REF.unpack_from(self._mm, self._columnOffsets[key] + _STRING_REF.size*ix)[0]
+		return self._getString(stringIx)
+
+	# input: (key)
+	# output: (buf) read-only buffer over the column for key, sharing memory with the mapping
+	#   INT_KEYS columns hold nNodes little-endian int64s, STRING_KEYS columns nNodes little-endian uint32 string table indices.
+	#   buf must not be used after close().
+	def getColumnBuffer(self, key):
+		size = (_INT.size if key in _INT_KEY_SET else _STRING_REF.size) * self.nNodes
+		return buffer(self._mm, self._columnOffsets[key], size)
+
+	# input: (stringIx)
+	# output: (s) entry stringIx of the string table, as referenced by the STRING_KEYS columns
+	def getString(self, stringIx):
+		assert(0 <= stringIx < self.nStrings)
+		return self._getString(stringIx)
+
+	# input: (ix)
+	# output: (fields) dict of all fields of node ix, in the form accepted by CB.CallbackNode(fields=...)
+	def getFields(self, ix):
+		fields = {}
+		for k in CB.CallbackNode.REQUIRED_KEYS:
+			fields[k] = self.getField(ix, k)
+		return fields
+
+	# input: (ix)
+	# output: (node) the CallbackNode for node ix
+	def getNode(self, ix):
+		node = self._nodes[ix]
+		if node is None:
+			node = CB.CallbackNode(fields=self.getFields(ix))
+			self._nodes[ix] = node
+		return node
+
+	def __getitem__(self, ix):
+		if ix < 0:
+			ix += self.nNodes
+		if not (0 <= ix < self.nNodes):
+			raise IndexError("BinaryScheduleFile index out of range")
+		return self.getNode(ix)
+
+	# input: ()
+	# output: generator of the CallbackNodes in file order
+	def callbackNodes(self):
+		nodes = self._nodes
+		for ix, values in enumerate(self.callbackValues()):
+			node = nodes[ix]
+			if node is None:
+				node = nodes[ix] = CB.CallbackNode.fromValues(values)
+			yield node
+
+	# input: ()
+	# output: generator of field dicts, as from getFields, in file order.
+	# Does not materialize any CallbackNodes.
+	def callbackFields(self):
+		for values in self.callbackValues():
+			yield dict(zip(CB.CallbackNode.REQUIRED_KEYS, values))
+
+	# input: ()
+	# output: generator of the nodes as text CallbackStrings, in file order.
+	# Does not materialize any CallbackNodes.
+	def callbackStrings(self):
+		for fields in self.callbackFields():
+			yield formatCallbackString(fields)
+
+	# input: ()
+	# output: generator of tuples of the values of CB.CallbackNode.REQUIRED_KEYS, in that order, one per node in file order.
+	#   Integer fields are ints/longs, string fields the strings themselves. Strings of INTERNED_KEYS are interned.
+	#   Suitable for CB.CallbackNode.fromValues. Does not materialize any CallbackNodes.
+	def callbackValues(self):
+		strings = self._decodeStringTable()
+		for begin in xrange(0, self.nNodes, self.ROWS_PER_CHUNK):
+			nRows = min(self.ROWS_PER_CHUNK, self.nNodes - begin)
+			columns = []
+			for k in CB.CallbackNode.REQUIRED_KEYS:
+				if k in _INT_KEY_SET:
+					columns.append(struct.unpack_from('<{}q'.format(nRows), self._mm, self._columnOffsets[k] + _INT.size*begin))
+					continue
+				refs = struct.unpack_from('<{}I'.format(nRows), self._mm, self._columnOffsets[k] + _STRING_REF.size*begin)
+				if k in _INTERNED_KEY_SET:
+					# Intern in the table itself, so that every column referring to the entry shares the interned copy
+					for stringIx in set(refs) - self._internedIxs:
+						strings[stringIx] = intern(strings[stringIx])
+						self._internedIxs.add(stringIx)
+				columns.append(map(strings.__getitem__, refs))
+			for values in itertools.izip(*columns):
+				yield values
+
+	# input: ()
+	# output: (strings) list of all nStrings entries of the string table
+	# The table is decoded with one unpack and one read on the first call.
+	def _decodeStringTable(self):
+		if self._stringTable is None:
+			offsets = struct.unpack_from('<{}Q'.format(self.nStrings + 1), self._mm, self._stringOffsetsOffset)
+			data = self._mm[self._stringDataOffset : self._stringDataOffset + offsets[-1]]
+			self._stringTable = [data[begin:end] for begin, end in itertools.izip(offsets, offsets[1:])]
+			# Share the strings already read by getField
+			for stringIx, string in self._strings.iteritems():
+				self._stringTable[stringIx] = string
+		return self._stringTable
+
+	def _getString(self, stringIx):
+		if self._stringTable is not None:
+			return self._stringTable[stringIx]
+		s = self._strings.get(stringIx)
+		if s is None:
+			begin, end = struct.unpack_from('<QQ', self._mm, self._stringOffsetsOffset + _STRING_OFFSET.size*stringIx)
+			s = self._mm[self._stringDataOffset + begin : self._stringDataOffset + end]
+			self._strings[stringIx] = s
+		return s
@@ -3,10 +3,15 @@
 # Defines the following public classes: 
 # 	Callback
 #  	CallbackTree
+#  	HappensBeforeIndex
+#  	ScheduleReader
 # Python version: 2.7.6
 
 import re
 import logging
+import bisect
+import mmap
+import os
 
 #############################
 # CallbackNodeGroups
@@ -71,6 +76,151 @@ class CallbackNodeGroups(object):
 		assert(foundGroup)
 		return nodeGroups
 
+#############################
+# ScheduleReader
+#############################
+
+# Streams the lines of a schedule file produced by scheduler_emit.
+# Lines are read one at a time (optionally through an mmap of the file) rather than with readlines(),
+# so large schedules are not held in memory twice.
+# Binary schedules (see BinarySchedule.py) are detected automatically and need no parsing.
+class ScheduleReader(object):
+	# input: (inputFile, [useMmap])
+	#   inputFile    schedule file
+	#   useMmap      read the file through mmap instead of buffered file IO
+	def __init__(self, inputFile, useMmap=False):
+		self.inputFile = inputFile
+		self.useMmap = useMmap
+
+	# input: ()
+	# output: (isBinary) True if self.inputFile is a binary schedule
+	# Throws any errors it encounters during file IO
+	def isBinary(self):
+		import BinarySchedule # Not at module level: BinarySchedule imports this module
+		return BinarySchedule.isBinaryScheduleFile(self.inputFile)
+
+	# input: ()
+	# output: generator of the non-blank lines in self.inputFile
+	#   For a binary schedule, the equivalent text lines.
+	# Throws any errors it encounters during file IO
+	def lines(self):
+		if self.isBinary():
+			import BinarySchedule
+			binFile = BinarySchedule.BinaryScheduleFile(self.inputFile)
+			try:
+				for line in binFile.callbackStrings():
+					yield line
+			finally:
+				binFile.close()
+			return
+
+		with open(self.inputFile, 'rb') as f:
+			if self.useMmap:
+				if os.fstat(f.fileno()).st_size == 0:
+					return
+				mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+				try:
+					for line in iter(mm.readline, ""):
+						if not line.isspace():
+							yield line
+				finally:
+					mm.close()
+			else:
+				for line in f:
+					if not line.isspace():
+						yield line
+
+	# input: ()
+	# output: generator of CallbackNodes, one per line of self.inputFile
+	def callbackNodes(self):
+		if self.isBinary():
+			import BinarySchedule
+			binFile = BinarySchedule.BinaryScheduleFile(self.inputFile)
+			try:
+				# Not binFile.callbackNodes(), which keeps every node it materializes
+				for values in binFile.callbackValues():
+					yield CallbackNode.fromValues(values)
+			finally:
+				binFile.close()
+			return
+
+		for line in self.lines():
+			yield CallbackNode(line)
+
+	# input: ()
+	# output: generator of field dicts (see CallbackNode.__init__), one per line of self.inputFile
+	def callbackFields(self):
+		if self.isBinary():
+			import BinarySchedule
+			binFile = BinarySchedule.BinaryScheduleFile(self.inputFile)
+			try:
+				for fields in binFile.callbackFields():
+					yield fields
+			finally:
+				binFile.close()
+			return
+
+		for line in self.lines():
+			fields = _parseStandardCallbackString(line)
+			if fields is None:
+				fields = _parseGenericCallbackString(line)
+			yield fields
+
+#############################
+# CallbackString parsing
+#############################
+
+# A CallbackString in the layout written by scheduler_emit: the CallbackNode.REQUIRED_KEYS in order.
+# Matched with a single precompiled pattern, which also splits the time fields.
+def _genStandardLinePattern(keys, timeKeys):
+	kvPatterns = []
+	for key in keys:
+		if key in timeKeys:
+			kvPatterns.append("<{0}>\s+<(?P<{0}_s>\d+)s\s+(?P<{0}_ns>\d+)ns>".format(key))
+		else:
+			kvPatterns.append("<{0}>\s+<(?P<{0}>[^|]*)>".format(key))
+	return re.compile("\s*" + "\s*\|\s*".join(kvPatterns) + "\s*$")
+
+_KV_PATTERN = re.compile('<(?P<key>.*?)>\s+<(?P<value>.*)>')
+_TIME_PATTERN = re.compile('(?P<sec>\d+)s\s+(?P<nsec>\d+)ns')
+
+# input: (sec, nsec) strings
+# output: (ns) the time in ns
+def _toNS(sec, nsec):
+	#TODO Is all of this long()'ing necessary? I'm guessing we only need it for long(1e9)
+	return long(long(sec)*long(1e9) + long(nsec))
+
+# input: (callbackString)
+# output: (fields) dict from key to value, or None if callbackString is not in the standard layout.
+#   Time fields are converted to ns; everything else is a string.
+def _parseStandardCallbackString(callbackString):
+	match = CallbackNode.STANDARD_LINE_PATTERN.match(callbackString)
+	if not match:
+		return None
+	fields = dict(zip(CallbackNode.NON_TIME_KEYS, match.group(*CallbackNode.NON_TIME_KEYS)))
+	for timeKey in CallbackNode.TIME_KEYS:
+		fields[timeKey] = _toNS(match.group(timeKey + "_s"), match.group(timeKey + "_ns"))
+	return fields
+
+# input: (callbackString)
+# output: (fields) dict from key to value for every '<key> <value>' pair in callbackString.
+#   Time fields are converted to ns; everything else is a string.
+#
+# Accepts keys in any order, but is several times slower than _parseStandardCallbackString.
+def _parseGenericCallbackString(callbackString):
+	fields = {}
+	for kv in callbackString.split("|"):
+		match = _KV_PATTERN.search(kv)
+		if (match):
+			fields[match.group('key')] = match.group('value')
+	for timeKey in CallbackNode.TIME_KEYS:
+		timeStr = fields.get(timeKey, None)
+		assert(timeStr is not None)
+		match = _TIME_PATTERN.search(timeStr)
+		assert(match)
+		fields[timeKey] = _toNS(match.group('sec'), match.group('nsec'))
+	return fields
+
 #############################
 # CallbackNode
 #############################
@@ -78,9 +228,19 @@ class CallbackNodeGroups(object):
 # Representation of a Callback Node from libuv
 # self.REQUIRED_KEYS describes the members set in the constructor
 # Other members that can be set via methods:	children, parent
-# NB All fields returned by getX are strings
+# While a CallbackNode is part of a CallbackNodeTree, self.tree refers to that tree and
+# changes to its children or IDs are reported to the tree so that the tree's indices stay current.
+# NB The fields in INT_KEYS are ints, converted once at parse time. Times are in ns. All other fields returned by getX are strings.
+#
+# CallbackNodes use __slots__: schedules can have millions of nodes, and a per-node __dict__ costs more than the fields themselves.
+# Callers that want to associate extra data with a node should keep it in their own dict.
 class CallbackNode (object):
 	REQUIRED_KEYS = ["name", "context", "context_type", "cb_type", "cb_behavior", "tree_number", "tree_level", "level_entry", "exec_id", "reg_id", "callback_info", "registrar", "tree_parent", "registration_time", "start_time", "end_time", "executing_thread", "active", "finished", "extra_info", "dependencies"]
+	INT_KEYS = ["tree_number", "tree_level", "level_entry", "exec_id", "reg_id", "executing_thread", "active", "finished"]
+	# Drawn from a small vocabulary, so each node shares a single copy of the string
+	INTERNED_KEYS = ["context_type", "cb_type", "cb_behavior", "extra_info"]
+
+	__slots__ = REQUIRED_KEYS + ["callbackString", "children", "dependents", "parent", "tree", "_treeSerial", "_execOrderKey", "_tourIn", "_tourOut"]
 
 	TP_WORK_INITIAL_TYPES = ["UV_WORK_CB"]
 	TP_WORK_NESTED_TYPES = ["UV_FS_WORK_CB", "UV_GETADDRINFO_WORK_CB", "UV_GETNAMEINFO_WORK_CB"]
@@ -106,34 +266,57 @@ class CallbackNode (object):
 	ASYNC_TYPES = TP_TYPES + MISC_ASYNC_TYPES
 
 	TIME_KEYS = ["registration_time", "start_time", "end_time"]
+	NON_TIME_KEYS = [k for k in REQUIRED_KEYS if k not in TIME_KEYS]
+	STANDARD_LINE_PATTERN = _genStandardLinePattern(REQUIRED_KEYS, TIME_KEYS)
 	
 	EXIT_TYPE = "EXIT"
 	
+	# Provide one of:
 	# CallbackString (a string of fields formatted as: 'Callback X: | <key> <value> | <key> <value> | .... |'
 	#   A CallbackString must a key-value pair for all of the members of self.REQUIRED_KEYS
 	#     'start', 'end' must have value of the form '<Xs Yns>' 
-	def __init__(self, callbackString=""):
-		assert(0 < len(callbackString))
+	# fields (a dict from each of self.REQUIRED_KEYS to its value: times in ns, INT_KEYS as ints or strings, everything else a string)
+	#   e.g. from a BinarySchedule.BinaryScheduleFile. self.callbackString is None in this case.
+	# Keys other than self.REQUIRED_KEYS are ignored.
+	def __init__(self, callbackString="", fields=None):
+		if fields is None:
+			assert(0 < len(callbackString))
+			# Lines from scheduler_emit take the fast path; anything else falls back to the generic parser.
+			fields = _parseStandardCallbackString(callbackString)
+			if fields is None:
+				fields = _parseGenericCallbackString(callbackString)
+		else:
+			callbackString = None
 		self.callbackString = callbackString
-		kvs = callbackString.split("|")
-		for kv in kvs:
-			match = re.search('<(?P<key>.*?)>\s+<(?P<value>.*)>', kv)
-			if (match):
-				setattr(self, match.group('key'), match.group('value'))
 		for key in self.REQUIRED_KEYS:
 			#logging.debug("Verifying that required field '{}' is defined".format(key))
-			value = getattr(self, key, None)
+			value = fields.get(key, None)
 			assert(value is not None)
 			#logging.debug("'%s' -> '%s'" %(key, value)) 					
-						
-		# Convert times in s,ns to ns
-		for timeKey in CallbackNode.TIME_KEYS:
-			timeStr = getattr(self, timeKey, None)
-			match = re.search('(?P<sec>\d+)s\s+(?P<nsec>\d+)ns', timeStr)
-			assert(match)
-			#TODO Is all of this long()'ing necessary? I'm guessing we only need it for long(1e9)
-			ns = long(long(match.group('sec'))*long(1e9) + long(match.group('nsec')))
-			setattr(self, timeKey, ns)
+			setattr(self, key, value)
+		for key in self.INT_KEYS:
+			setattr(self, key, int(getattr(self, key)))
+		for key in self.INTERNED_KEYS:
+			setattr(self, key, intern(getattr(self, key)))
+		self._initLinks()
+
+	# input: (values) the values of REQUIRED_KEYS, in order, already converted:
+	#   INT_KEYS as ints, times in ns, INTERNED_KEYS interned, and dependencies as a space-separated string.
+	# output: (node) a CallbackNode whose callbackString is None, as with fields=
+	# Skips the per-key lookups and conversions of __init__. Used to build nodes in bulk from a BinarySchedule.BinaryScheduleFile.
+	@staticmethod
+	def fromValues(values):
+		node = CallbackNode.__new__(CallbackNode)
+		node.callbackString = None
+		# One tuple assignment is several times faster than a setattr per key. Must list REQUIRED_KEYS in order.
+		(node.name, node.context, node.context_type, node.cb_type, node.cb_behavior, node.tree_number, node.tree_level,
+		 node.level_entry, node.exec_id, node.reg_id, node.callback_info, node.registrar, node.tree_parent, node.registration_time,
+		 node.start_time, node.end_time, node.executing_thread, node.active, node.finished, node.extra_info, node.dependencies) = values
+		node._initLinks()
+		return node
+
+	# Checks the time fields and initializes the members other than REQUIRED_KEYS
+	def _initLinks(self):
 		# Time should go forward
 		if (self.executed()):
 			assert(self.registration_time <= self.start_time)
@@ -151,11 +334,13 @@ class CallbackNode (object):
 		self.dependents = []
 		self.parent = None
 
-		#Used to eliminate duplicate computation in self.getDescendants
-		self._knowAllDescendantsWithDependents = False
-		self._allDescendantsWithDependents = []
-		self._knowAllDescendantsWithoutDependents = False
-		self._allDescendantsWithoutDependents = []
+		# The CallbackNodeTree that has indexed this node, if any. Maintained by CallbackNodeTree.
+		self.tree = None
+		self._treeSerial = None
+		self._execOrderKey = None
+		# Position in the tree's Euler tour; see CallbackNodeTree._refreshTour
+		self._tourIn = None
+		self._tourOut = None
 
 		#logging.debug("{}".format(self))
 
@@ -201,7 +386,7 @@ class CallbackNode (object):
 		
 		newTreeLevel = None
 		if parent:
-			newTreeLevel = 1 + int(parent.getTreeLevel())
+			newTreeLevel = 1 + parent.getTreeLevel()
 		else:
 			newTreeLevel = 0
 		self.setTreeLevel(newTreeLevel)
@@ -215,10 +400,17 @@ class CallbackNode (object):
 	#Adds CHILD to self's list of children
 	def addChild (self, child):
 		self.children.append(child)
-		child.setTreeLevel(1 + int(self.getTreeLevel()))
+		child.setTreeLevel(1 + self.getTreeLevel())
+		if self.tree is not None:
+			self.tree._indexSubtree(child)
+			self.tree._noteModified(self)
+			self.tree._noteModified(child)
+			self.tree._noteStructureChanged()
 
 	def addDependent(self, dependent):
 		self.dependents.append(dependent)
+		if self.tree is not None:
+			self.tree._noteStructureChanged()
 
   # input: ()
   # output: CBN's dependents
@@ -234,6 +426,10 @@ class CallbackNode (object):
 	def removeChild (self, maybeChild):
 		origLen = len(self.children)
 		self.children = [c for c in self.children if c is not maybeChild]
+		if self.tree is not None and origLen != len(self.children):
+			self.tree._unindexSubtree(maybeChild)
+			self.tree._noteModified(self)
+			self.tree._noteStructureChanged()
 		return (origLen == len(self.children))
 	
 	# input: (keepFilter_func)
@@ -272,7 +468,22 @@ class CallbackNode (object):
 		return self.dependencies
 
 	def setChildren(self, children):
+		oldChildren = self.children
 		self.children = children
+		if self.tree is not None:
+			# Only nodes that actually joined or left the list need re-indexing; a reordering is free.
+			oldIDs = set([id(c) for c in oldChildren])
+			newIDs = set([id(c) for c in children])
+			for c in oldChildren:
+				if id(c) not in newIDs:
+					self.tree._unindexSubtree(c)
+			for c in children:
+				if id(c) not in oldIDs:
+					self.tree._indexSubtree(c)
+					self.tree._noteModified(c)
+			if oldIDs != newIDs:
+				self.tree._noteModified(self)
+				self.tree._noteStructureChanged()
 
 	#getTreeRoot()
 	#Returns the CallbackNode at the root of the tree
@@ -289,56 +500,43 @@ class CallbackNode (object):
 	# includeDependents: Flag -- check only parent-child (registration) relationships, or also include program order (dependency) relationships?
 	# output (True/False)
 	#True if potentialDescendant is a descendant (child, grand-child, etc.) of self, else False
+	#
+	# If self is in a CallbackNodeTree, the tree answers from its cached reachability structures (see CallbackNodeTree.isAncestor).
 	def isAncestorOf (self, potentialDescendant, includeDependents=False):
 		assert(isinstance(potentialDescendant, CallbackNode))
-
-		nodesToCheck = self.children
-		if includeDependents:
-			nodesToCheck += self.dependents
-		assert(self not in nodesToCheck)
-
-		for node in nodesToCheck:
-			if (node.getRegID() == potentialDescendant.getRegID()):
-				return True
-			if (node.isAncestorOf(potentialDescendant, includeDependents)):
-				return True
-		return False
+		if self.tree is not None and potentialDescendant.tree is self.tree:
+			return self.tree.isAncestor(self, potentialDescendant, includeDependents)
+		return (potentialDescendant in self._findDescendants(includeDependents))
 
 	# input: (includeDependents)
 	# includeDependents: Flag -- include only parent-child (registration) relationships, or also include program order (dependency) relationships?
-	# output: (descendants) list of CallbackNodes
+	# output: (descendants) frozenset of CallbackNodes
 	# Returns the Set of all nodes (children, grand-children, etc.) descended from this node
+	#
+	# If self is in a CallbackNodeTree, the answer is cached by the tree until the tree's structure changes.
 	def getDescendants(self, includeDependents):
-		# Short-circuit if we know the answer already
-		if includeDependents and self._knowAllDescendantsWithDependents:
-			return self._allDescendantsWithDependents
-		elif not includeDependents and self._knowAllDescendantsWithoutDependents:
-			return self._allDescendantsWithoutDependents
-
-		directDescendants = self.children
-		if includeDependents:
-			directDescendants += self.dependents
-		directDescendants = set(directDescendants) # No sense in visiting a child more than once
-		assert (self not in directDescendants)  # Sanity check: avoid infinite recursion
-		logging.info("node {} calculating dependents of my {} children ({})".format(self.getID(), len(directDescendants), [n.getID() for n in directDescendants]))
-
-		indirectDescendants = []
-		for d in directDescendants:
-			logging.info("node {} calculating dependents of {}".format(self.getID(), d.getID()))
-			indirectDescendants += d.getDescendants(includeDependents)
-			logging.info("node {} descendant {}: includeDependents {}, directDescendants {}, {} indirectDescendants: {}".format(self.getID(), d.getID(), includeDependents, [n.getID() for n in directDescendants], len(indirectDescendants), [n.getID() for n in indirectDescendants]))
-		allDescendants = directDescendants | set(indirectDescendants) # There may be duplicates
-		logging.info("node {}, allDescendants {}".format(self.getID(), [n.getID() for n in allDescendants]))
-
-		# Save state so we don't have to recurse
-		if includeDependents:
-			self._knowAllDescendantsWithDependents = True
-			self._allDescendantsWithDependents = allDescendants
-		else:
-			self._knowAllDescendantsWithoutDependents = True
-			self._allDescendantsWithoutDependents = allDescendants
+		if self.tree is not None:
+			return self.tree.getDescendants(self, includeDependents)
+		return frozenset(self._findDescendants(includeDependents))
 
-		return allDescendants
+	# input: (includeDependents)
+	# output: (descendants) set of the CallbackNodes reachable from self, not including self
+	#
+	# Uncached; walks the children (and dependents) iteratively.
+	def _findDescendants(self, includeDependents):
+		descendants = set()
+		toVisit = [self]
+		while toVisit:
+			node = toVisit.pop()
+			relatives = node.getChildren()
+			if includeDependents:
+				relatives = relatives + node.getDependents()
+			for r in relatives:
+				if r not in descendants:
+					descendants.add(r)
+					toVisit.append(r)
+		assert(self not in descendants) # Sanity check: children and dependents must not form a cycle
+		return descendants
 
 	# == and != based on name
 	def __eq__ (self, other):
@@ -351,7 +549,7 @@ class CallbackNode (object):
 	
 	#returns true if this node was executed or being executed, else false
 	def executed (self):
-		return (int(self.active) != 0 or int(self.finished) != 0)
+		return (self.active != 0 or self.finished != 0)
 		
 	def getExecutingThread (self):
 		return self.executing_thread
@@ -372,19 +570,28 @@ class CallbackNode (object):
 		return self.name
 
 	def setName(self, name):
+		oldName = self.name
 		self.name = name
+		if self.tree is not None:
+			self.tree._updateNameIndex(self, oldName)
 	
 	def getExecID (self):
 		return self.exec_id
 
 	def setExecID(self, newID):
-		self.exec_id = str(newID)
+		oldID = self.exec_id
+		self.exec_id = int(newID)
+		if self.tree is not None:
+			self.tree._updateExecIDIndex(self, oldID)
 	
 	def getRegID (self):
 		return self.reg_id
 	
 	def setRegID (self, newID):
-		self.reg_id = str(newID)
+		oldID = self.reg_id
+		self.reg_id = int(newID)
+		if self.tree is not None:
+			self.tree._updateRegIDIndex(self, oldID)
 
 	# This is an "external" ID suitable for identifying events in a Schedule
 	def getID (self):
@@ -397,7 +604,7 @@ class CallbackNode (object):
 		return self.cb_type
 	
 	def setCBType (self, type):
-		self.cb_type = type
+		self.cb_type = intern(type)
 	
 	def getContext (self):
 		return self.context_type
@@ -409,20 +616,20 @@ class CallbackNode (object):
 		return self.tree_level
 	
 	def setTreeLevel (self, treeLevel):
-		self.tree_level = treeLevel		
+		treeLevel = int(treeLevel)
+		if self.tree is not None and treeLevel != self.tree_level:
+			self.tree._noteModified(self)
+		self.tree_level = treeLevel
 		
 	def getLevelEntry (self):
 		return self.level_entry
 	
 	# This is the same as the CBN's child number in its parent. 
 	def setLevelEntry (self, levelEntry):
-		self.level_entry = levelEntry
+		self.level_entry = int(levelEntry)
 
 	def isMarkerNode (self):
-		if (re.search('^MARKER_.*', self.getCBType())):
-			return True
-		else:
-			return False
+		return self.getCBType().startswith("MARKER_")
 
 	# Returns True if this CBN was executed by a threadpool thread.
 	def isThreadpoolCB (self):		
@@ -497,10 +704,11 @@ class CallbackNode (object):
 	# Returns the nearest reschedulable (async) node, ancestrally speaking, possibly including self
 	# Returns None if no such node was found
 	def findNearestReschedulable(self):
-		if self.isAsync():
-			return self.getCBType() not in CallbackNode.TP_WORK_NESTED_TYPES and self.getCBType() not in CallbackNode.TP_DONE_NESTED_TYPES
-		elif self.getParent() is not None:
-			return self.getParent().findNearestReschedulable()
+		node = self
+		while node is not None:
+			if node.isAsync():
+				return node.getCBType() not in CallbackNode.TP_WORK_NESTED_TYPES and node.getCBType() not in CallbackNode.TP_DONE_NESTED_TYPES
+			node = node.getParent()
 		logging.debug("Sorry, ran out of parents. This node is not reschedulable at all.")
 		return None
 
@@ -510,16 +718,24 @@ class CallbackNode (object):
 
 #Representation of a tree of CallbackNodes from libuv
 #Members:   root    root node of the tree
+#
+#The tree maintains indices over the nodes reachable from root: by name, by reg_id, by exec_id, and in exec order.
+#They are updated incrementally by the CallbackNode mutators (addChild, removeChild, setChildren, setName, setExecID, setRegID),
+#so lookups do not need to walk the tree.
+#The same mutators record which nodes have changed structurally, so that validity can be re-checked incrementally (see isValid),
+#and bump a structure version that invalidates the cached reachability structures (see isAncestor and getDescendants).
 class CallbackNodeTree (object):
+	# If more than this many nodes have changed position in the exec order since the last query,
+	# re-sort the exec order instead of repairing it one node at a time.
+	EXEC_ORDER_REBUILD_THRESHOLD = 64
+
 	#inputFile must contain lines matching the requirements of the constructor for CallbackNode, one CallbackNode per line
-	def __init__ (self, inputFile):
+	#useMmap: read inputFile through mmap (see ScheduleReader)
+	def __init__ (self, inputFile, useMmap=False):
 		callbackNodes = []
 		try:
-			with open(inputFile) as f:
-				lines = f.readlines()
-				for l in lines:
-					node = CallbackNode(l)
-					callbackNodes.append(node)
+			for node in ScheduleReader(inputFile, useMmap).callbackNodes():
+				callbackNodes.append(node)
 		except IOError:
 			logging.error("Error, processing inputFile {} gave me an IOError".format(inputFile))
 			raise
@@ -529,10 +745,10 @@ class CallbackNodeTree (object):
 		# Set the parent-child relationship for each node
 		self.root = None
 		for node in callbackNodes:
-			logging.debug("Setting parent-child relationship for node {}".format(node))
+			logging.debug("Setting parent-child relationship for node %s", node)
 			if (node.registrar in callbackNodeDict):
 				parent = callbackNodeDict[node.registrar]
-				logging.debug("node {} has registrar {}; adding node as child of parent {}".format(node, node.registrar, parent))
+				logging.debug("node %s has registrar %s; adding node as child of parent %s", node, node.registrar, parent)
 				parent.addChild(node)
 				node.setParent(parent)
 			else:
@@ -540,13 +756,35 @@ class CallbackNodeTree (object):
 				assert(not self.root)
 				self.root = node
 
+		# Index the nodes reachable from the root
+		self._nameToNode = {}
+		self._regIDToNodes = {}
+		self._execIDToNodes = {}
+		self._execOrder = [] # Indexed nodes sorted by (exec_id, serial)
+		self._execOrderKeys = [] # Parallel to self._execOrder, for bisect
+		self._execOrderPending = {} # id(node) -> node whose position in self._execOrder may be stale
+		self._nextSerial = 0
+		self._modifiedNodes = {} # id(node) -> node whose children or tree_level changed since the last takeModifiedNodes()
+		# Reachability caches. Each is valid while its version matches self._structureVersion.
+		self._structureVersion = 0 # Incremented whenever a child or dependent edge is added or removed
+		self._tour = [] # Nodes reachable from self._tourRoot in DFS preorder
+		self._tourRoot = None
+		self._tourVersion = None
+		self._descendantCache = {} # (id(node), includeDependents) -> frozenset of descendants
+		self._descendantCacheVersion = None
+		self._hbIndex = None # HappensBeforeIndex
+		self._hbIndexVersion = None
+		if self.root:
+			self._indexSubtree(self.root)
+
 		# Convert dependencies (strings) to dependencies (CallbackNodes)
 		self._updateDependencies()
 
 		# Tree must be valid
 		assert(self.root)		
+		# Every node must be reachable from the root, i.e. indexed
 		for node in callbackNodes:
-			assert(node.getTreeRoot() == self.root)
+			assert(node.tree is self)
 		assert(self.isValid())
 
 	# input: (tpDoneAsyncCB)
@@ -587,15 +825,15 @@ class CallbackNodeTree (object):
 	#
 	# Recalculate the tree_level of the nodes in this CallbackTree after the addition or removal of nodes using CallbackNode APIs.
 	def recalculateTreeLevels(self):
-		assert(int(self.root.getTreeLevel()) == 0)
+		assert(self.root.getTreeLevel() == 0)
 		logging.debug("Repairing tree levels")
 
-		def walkFunc(node, _):
+		# Pre-order: each parent's level is repaired before its children's
+		for node in self.iterPreOrder():
 			if node.getParent():
-				node.setTreeLevel(1 + int(node.getParent().getTreeLevel()))
+				node.setTreeLevel(1 + node.getParent().getTreeLevel())
 			else:
 				assert(node == self.root)
-		self.walk(walkFunc, None)
 
 	# input: ()
 	# output: ()
@@ -605,14 +843,10 @@ class CallbackNodeTree (object):
 	def recalculateChildNumbers(self):
 		logging.debug("Repairing level entries")
 		
-		def walkFunc(node, _):
-			if node.getParent():
-				parentsChildren = node.getParent().getChildren()
-				assert(node in parentsChildren)
-				node.setLevelEntry(parentsChildren.index(node))
-			else:
-				assert(node == self.root)
-		self.walk(walkFunc, None)
+		for node in self.iterPreOrder():
+			for childNum, child in enumerate(node.getChildren()):
+				assert(child.getParent() is node)
+				child.setLevelEntry(childNum)
 
 	# input: ()
 	# output: ()
@@ -635,8 +869,8 @@ class CallbackNodeTree (object):
 				
 				# Verify that child's regID seems valid.
 				if child.getParent() is not None:
-					parentRegID = int(child.getParent().getRegID())
-					childRegID = int(child.getRegID())
+					parentRegID = child.getParent().getRegID()
+					childRegID = child.getRegID()
 					assert(parentRegID < childRegID)
 				else:
 					assert(childRegID == 0)
@@ -656,14 +890,126 @@ class CallbackNodeTree (object):
 	# output: (callbackNodeDict)
 	#   callbackNodeDict     maps CallbackNode.name to CallbackNode for all nodes in this CallbackNodeTree
 	#
-	# Walks the tree starting at the root to generate this dictionary.
+	# Returns a copy of the name index.
 	# Use this function to obtain the latest version of all nodes in the tree.
 	def _genCallbackNodeDict(self):
-		callbackNodeDict = {}
-		def walkFunc (node, dict):
-			dict[node.name] = node
-		self.walk(walkFunc, callbackNodeDict)
-		return callbackNodeDict		
+		return dict(self._nameToNode)
+
+	# input: (node)
+	# output: ()
+	#
+	# Add node and all of its descendants to the indices, and mark them as belonging to this tree.
+	# Nodes that are already indexed are skipped along with their subtrees (which must already be indexed).
+	def _indexSubtree(self, node):
+		toVisit = [node]
+		while toVisit:
+			n = toVisit.pop()
+			if n.tree is self:
+				continue
+			n.tree = self
+			n._treeSerial = self._nextSerial
+			self._nextSerial += 1
+
+			self._nameToNode[n.getName()] = n
+			self._regIDToNodes.setdefault(n.getRegID(), {})[id(n)] = n
+			self._execIDToNodes.setdefault(n.getExecID(), {})[id(n)] = n
+			self._execOrderPending[id(n)] = n
+			toVisit.extend(n.getChildren())
+
+	# input: (node)
+	# output: ()
+	#
+	# Remove node and all of its descendants from the indices.
+	def _unindexSubtree(self, node):
+		toVisit = [node]
+		while toVisit:
+			n = toVisit.pop()
+			if n.tree is not self:
+				continue
+			n.tree = None
+
+			if self._nameToNode.get(n.getName()) is n:
+				del self._nameToNode[n.getName()]
+			self._removeFromIDIndex(self._regIDToNodes, n.getRegID(), n)
+			self._removeFromIDIndex(self._execIDToNodes, n.getExecID(), n)
+			self._execOrderPending[id(n)] = n
+			toVisit.extend(n.getChildren())
+
+	# input: (index, id, node)
+	# output: ()
+	#
+	# Helper for the ID indices, which map an ID to the nodes with that ID (as a dict keyed by id(node)).
+	# IDs are not unique: unexecuted nodes share exec_id -1, and IDs are briefly duplicated while being recalculated.
+	def _removeFromIDIndex(self, index, nodeID, node):
+		nodes = index.get(nodeID)
+		if nodes is None:
+			return
+		nodes.pop(id(node), None)
+		if not nodes:
+			del index[nodeID]
+
+	# Hooks invoked by CallbackNode when an indexed node changes.
+	def _updateNameIndex(self, node, oldName):
+		if self._nameToNode.get(oldName) is node:
+			del self._nameToNode[oldName]
+		self._nameToNode[node.getName()] = node
+
+	def _updateRegIDIndex(self, node, oldID):
+		self._removeFromIDIndex(self._regIDToNodes, oldID, node)
+		self._regIDToNodes.setdefault(node.getRegID(), {})[id(node)] = node
+
+	def _updateExecIDIndex(self, node, oldID):
+		self._removeFromIDIndex(self._execIDToNodes, oldID, node)
+		self._execIDToNodes.setdefault(node.getExecID(), {})[id(node)] = node
+		self._execOrderPending[id(node)] = node
+
+	def _noteModified(self, node):
+		self._modifiedNodes[id(node)] = node
+
+	def _noteStructureChanged(self):
+		self._structureVersion += 1
+
+	# input: ()
+	# output: (modifiedNodes) list of the indexed nodes whose children or tree_level have changed since the last call
+	#
+	# Changes to exec IDs are not included; see isValid.
+	def takeModifiedNodes(self):
+		modifiedNodes = [n for n in self._modifiedNodes.values() if n.tree is self]
+		self._modifiedNodes = {}
+		return modifiedNodes
+
+	# input: ()
+	# output: ()
+	#
+	# Bring self._execOrder up to date with the nodes changed since the last call.
+	# A few changes are repaired in place using bisect; many changes (e.g. after renumbering the schedule) trigger a re-sort.
+	def _refreshExecOrder(self):
+		if not self._execOrderPending:
+			return
+
+		if CallbackNodeTree.EXEC_ORDER_REBUILD_THRESHOLD < len(self._execOrderPending):
+			for n in self._execOrder:
+				n._execOrderKey = None
+			nodes = [n for n in self._nameToNode.values()]
+			for n in nodes:
+				n._execOrderKey = (n.getExecID(), n._treeSerial)
+			nodes.sort(key=lambda n: n._execOrderKey)
+			self._execOrder = nodes
+			self._execOrderKeys = [n._execOrderKey for n in nodes]
+		else:
+			for n in self._execOrderPending.values():
+				if n._execOrderKey is not None:
+					ix = bisect.bisect_left(self._execOrderKeys, n._execOrderKey)
+					assert(self._execOrder[ix] is n)
+					del self._execOrder[ix]
+					del self._execOrderKeys[ix]
+					n._execOrderKey = None
+				if n.tree is self:
+					n._execOrderKey = (n.getExecID(), n._treeSerial)
+					ix = bisect.bisect_left(self._execOrderKeys, n._execOrderKey)
+					self._execOrder.insert(ix, n)
+					self._execOrderKeys.insert(ix, n._execOrderKey)
+		self._execOrderPending = {}
 	
 	# Replace the self.dependencies array of string node names in each Node with an array of the corresponding CallbackNodes (update node.dependencies).
 	# Inform each antecedent about its dependent (append to each dependency's node.dependents).
@@ -673,127 +1019,273 @@ class CallbackNodeTree (object):
 			# dependencies must be strings at this point
 			for d in node.dependencies:
 				assert(type(d) is str)
-				logging.debug("dependency {}".format(d))
+				logging.debug("dependency %s", d)
 			# Turn node.dependencies from a list of strings to a list of CBNs.
 			node.dependencies = [callbackNodeDict[n] for n in node.dependencies]
 			for antecedent in node.dependencies:
 				antecedent.addDependent(node)
-			logging.debug("Node {}'s dependencies: {}".format(node.getName(), node.dependencies))
+			logging.debug("Node %s's dependencies: %s", node.getName(), node.dependencies)
 		
 	#input: (regID)
 	#output: (node) node with specified regID, or None
 	def getNodeByRegID(self, regID):
-		for node in self._genCallbackNodeDict().values():
-			if (node.getRegID() == str(regID)):
-				return node
+		nodes = self._regIDToNodes.get(int(regID))
+		if nodes:
+			return next(nodes.itervalues())
 		return None
 	
 	#input: (execID)
 	#output: (node) node with specified execID, or None
 	def getNodeByExecID(self, execID):
-		for node in self._genCallbackNodeDict().values():
-			if (node.getExecID() == str(execID)):
-				return node
+		nodes = self._execIDToNodes.get(int(execID))
+		if nodes:
+			return next(nodes.itervalues())
 		return None
+
+	#input: (name)
+	#output: (node) node with specified name, or None
+	def getNodeByName(self, name):
+		return self._nameToNode.get(name)
 		
+	# input: ([node])
+	#   node    subtree to traverse; defaults to the tree root
+	# output: generator of the nodes of the subtree in DFS pre-order (a node before its children, children in order)
+	#
+	# Iterative, so the depth of the tree is not limited by the interpreter stack.
+	# A node's children are read when the traversal moves past it, so the caller may
+	# restructure the node it was just given (e.g. detach it) without disturbing the traversal.
+	def iterPreOrder(self, node=None):
+		if node is None:
+			node = self.root
+		if node is None:
+			return
+		toVisit = [node]
+		while toVisit:
+			node = toVisit.pop()
+			yield node
+			toVisit.extend(reversed(node.children))
+
+	# input: ([node])
+	#   node    subtree to traverse; defaults to the tree root
+	# output: generator of the nodes of the subtree in DFS post-order (children in order, then their parent)
+	#
+	# Iterative, like iterPreOrder. The children of each node are read before any of them is yielded.
+	def iterPostOrder(self, node=None):
+		if node is None:
+			node = self.root
+		if node is None:
+			return
+		toVisit = [(node, False)]
+		while toVisit:
+			node, childrenVisited = toVisit.pop()
+			if childrenVisited:
+				yield node
+				continue
+			toVisit.append((node, True))
+			for child in reversed(node.children):
+				toVisit.append((child, False))
+
+	# input: ()
+	# output: generator of the tree nodes in execution order, as in getExecOrder
+	#
+	# Iterates over a snapshot, so the caller may modify the tree as it goes.
+	def iterExecOrder(self):
+		for node in self.getExecOrder():
+			yield node
+
 	#walk(node, func, funcArg)
 	#apply FUNC to each member of the tree, starting at NODE (defaults to tree root)
 	#FUNC will be invoked as FUNC(callbackNode, FUNCARG)
-	#A DFS walk is used.	
+	#A DFS pre-order walk is used; see iterPreOrder.
 	def walk (self, func, funcArg, node=None):
-		if (not node):
-			node = self.root
-		func(node, funcArg)
-		for child in node.children:			
-			self.walk(func, funcArg, node=child)
+		for n in self.iterPreOrder(node):
+			func(n, funcArg)
 			
 	#removeNodes(func)
 	#remove all nodes from this tree for which FUNC evaluates to True 
 	def removeNodes (self, func):		
-		#Wrapper for self.walk 
-		def remove_walk (node, arg):
+		for node in self.iterPreOrder():
 			if (func(node)):
-				logging.debug("removing node: {}".format(node))
+				logging.debug("removing node: %s", node)
 				if (node.parent):
 					node.parent.removeChild(node)
 					node.parent = None
-		self.walk(remove_walk, None)
 
-	# input: ()
+	# input: ([nodes])
+	#   nodes         if provided, only check the relationships that involve these nodes (their children, dependents, parents and dependencies)
 	# output: (isValid)
 	#   isValid       True or False
 	#
 	# Assess this tree for validity
 	#    - Nodes have an exec ID preceding their children and dependents
 	#    - Each node's tree_level is one higher than its parent's
-	def isValid(self):
-
+	#
+	# The incremental form is only as good as nodes: it must include every node whose children, tree_level, or
+	# relative exec order may have changed since the tree was last known to be valid.
+	# takeModifiedNodes() supplies the first two; the caller must supply the nodes it moved in the exec order.
+	def isValid(self, nodes=None):
 		invalidNodes = []
 		# invalidNodes: list of nodes for which something is not correct
-		def valid_walkFunc (node, invalidNodes):
-			#logging.debug("Assessing node {} (type {}) for validity".format(node, node.getCBType()))
-			isInvalid = False
-			childrenAndDependents = [n for n in node.getChildren() + node.getDependents()]
-			treeLevel = int(node.getTreeLevel())
-			for child in childrenAndDependents:
-				# This is imprecise, but nested nodes have the same tree level.
-				possibleTreeLevels = [treeLevel, treeLevel+1]
-				if int(child.getTreeLevel()) not in possibleTreeLevels:
-					logging.debug("I have tree_level {} type {}, and my child or dependent has tree_level {} type {}. Valid child tree levels are {}. My child cannot precede me structurally.".format(node.getTreeLevel(), node.getCBType(), child.getTreeLevel(), child.getCBType(), possibleTreeLevels))
-					isInvalid = True
-					break
-				if child.executed() and int(child.getExecID()) < int(node.getExecID()):
-					logging.debug("I have execID {} type {}, and my child or dependent has execID {} type {}. My child cannot precede me in execution.".format(node.getExecID(), node.getCBType(), child.getExecID(), child.getCBType()))
-					isInvalid = True
-					break
-
-			if isInvalid:
-				invalidNodes.append(node)
-
-		self.walk(valid_walkFunc, invalidNodes)
+		if nodes is None:
+			invalidNodes = [n for n in self.iterPreOrder() if not self._isValidNode(n)]
+		else:
+			toCheck = {}
+			for node in nodes:
+				if node.tree is not self:
+					continue
+				toCheck[id(node)] = node
+				if node.getParent() is not None:
+					toCheck[id(node.getParent())] = node.getParent()
+				for antecedent in node.getDependencies():
+					toCheck[id(antecedent)] = antecedent
+			logging.debug("Checking {} of the {} nodes in the tree".format(len(toCheck), len(self._nameToNode)))
+			invalidNodes = [n for n in toCheck.values() if not self._isValidNode(n)]
+
 		if invalidNodes:
-			logging.debug("Found {} invalid nodes in tree of size {}".format(len(invalidNodes), len(self._genCallbackNodeDict().keys())))
+			logging.debug("Found {} invalid nodes in tree of size {}".format(len(invalidNodes), len(self._nameToNode)))
 			return False
 
 		return True
 
+	# input: (node)
+	# output: (isValid) True if node's relationships with its children and dependents are valid, else False
+	def _isValidNode(self, node):
+		#logging.debug("Assessing node {} (type {}) for validity".format(node, node.getCBType()))
+		childrenAndDependents = node.getChildren() + node.getDependents()
+		treeLevel = node.getTreeLevel()
+		for child in childrenAndDependents:
+			# This is imprecise, but nested nodes have the same tree level.
+			possibleTreeLevels = [treeLevel, treeLevel+1]
+			if child.getTreeLevel() not in possibleTreeLevels:
+				logging.debug("I have tree_level {} type {}, and my child or dependent has tree_level {} type {}. Valid child tree levels are {}. My child cannot precede me structurally.".format(node.getTreeLevel(), node.getCBType(), child.getTreeLevel(), child.getCBType(), possibleTreeLevels))
+				return False
+			if child.executed() and child.getExecID() < node.getExecID():
+				logging.debug("I have execID {} type {}, and my child or dependent has execID {} type {}. My child cannot precede me in execution.".format(node.getExecID(), node.getCBType(), child.getExecID(), child.getCBType()))
+				return False
+		return True
+
+	# input: (ancestor, potentialDescendant, includeDependents)
+	#   ancestor, potentialDescendant   nodes in this tree
+	#   includeDependents               as in CallbackNode.isAncestorOf
+	# output: (True/False) True if potentialDescendant is a descendant of ancestor
+	#
+	# Parent-child relationships are answered in O(1) from the Euler tour.
+	# With includeDependents, the HappensBeforeIndex answers the rest.
+	def isAncestor(self, ancestor, potentialDescendant, includeDependents):
+		self._refreshTour()
+		if ancestor._tourIn is not None and potentialDescendant._tourIn is not None:
+			if ancestor._tourIn < potentialDescendant._tourIn < ancestor._tourOut:
+				return True
+			if not includeDependents:
+				return False
+			return self.getHappensBeforeIndex().happensBefore(ancestor, potentialDescendant)
+		return (potentialDescendant in self.getDescendants(ancestor, includeDependents))
+
+	# input: (a, b)
+	#   a, b    nodes in this tree
+	# output: (isOrdered) True if a happens before b or b happens before a, through parent-child or dependency edges
+	def isOrdered(self, a, b):
+		return (self.isAncestor(a, b, True) or self.isAncestor(b, a, True))
+
+	# input: ()
+	# output: (hbIndex) the HappensBeforeIndex of this tree
+	#
+	# The index is built on first use and rebuilt when the structure of the tree changes.
+	def getHappensBeforeIndex(self):
+		self._refreshTour()
+		if self._hbIndexVersion != self._structureVersion or self._hbIndex is None:
+			self._hbIndex = HappensBeforeIndex(self._tour)
+			self._hbIndexVersion = self._structureVersion
+		return self._hbIndex
+
+	# input: (node, includeDependents)
+	#   node                a node in this tree
+	#   includeDependents   as in CallbackNode.getDescendants
+	# output: (descendants) frozenset of the descendants of node
+	#
+	# The answer is cached until the structure of the tree changes.
+	def getDescendants(self, node, includeDependents):
+		if self._descendantCacheVersion != self._structureVersion:
+			self._descendantCache = {}
+			self._descendantCacheVersion = self._structureVersion
+
+		key = (id(node), includeDependents)
+		descendants = self._descendantCache.get(key)
+		if descendants is None:
+			self._refreshTour()
+			if not includeDependents and node._tourIn is not None:
+				# A node's descendants immediately follow it in the tour
+				descendants = frozenset(self._tour[node._tourIn + 1 : node._tourOut])
+			elif node._tourIn is not None:
+				intervals = self.getHappensBeforeIndex().descendantIntervals(node)
+				descendants = frozenset([n for (begin, end) in intervals for n in self._tour[begin:end] if n is not node])
+			else:
+				descendants = frozenset(node._findDescendants(includeDependents))
+			self._descendantCache[key] = descendants
+		return descendants
+
+	# input: ()
+	# output: ()
+	#
+	# Bring the Euler tour up to date with the structure of the tree.
+	# Each node reachable from self.root gets the interval [node._tourIn, node._tourOut) of self._tour,
+	# which contains exactly node and its descendants.
+	def _refreshTour(self):
+		if self._tourVersion == self._structureVersion and self._tourRoot is self.root:
+			return
+
+		for n in self._tour:
+			n._tourIn, n._tourOut = None, None
+		tour = []
+		if self.root is not None:
+			toVisit = [(self.root, False)]
+			while toVisit:
+				node, done = toVisit.pop()
+				if done:
+					node._tourOut = len(tour)
+					continue
+				node._tourIn = len(tour)
+				tour.append(node)
+				toVisit.append((node, True))
+				for child in reversed(node.getChildren()):
+					toVisit.append((child, False))
+
+		self._tour = tour
+		self._tourRoot = self.root
+		self._tourVersion = self._structureVersion
+
 	# Return the tree nodes
 	def getTreeNodes (self):
-		return self._genCallbackNodeDict().values()
+		return self._nameToNode.values()
 
 	# input: (node)
 	# output: (nodeIsInThisTree) True or False
 	#
-	# Determines whether or not node is in the tree by climbing
-	# until we get to the root of this tree, or None
+	# Determines whether or not node is in the tree by consulting the index
 	def contains (self, node):
-		while node:
-			if (node.getName() == self.root.getName()):
-				return True
-			node = node.getParent()
-		return False
+		return (node.tree is self)
 
 	# Return the tree nodes in execution order
 	# The returned list begins with any unexecuted nodes, whose execID is -1 
 	def getExecOrder (self):
-		return sorted(self.getTreeNodes(), key=lambda node: int(node.getExecID()))
+		self._refreshExecOrder()
+		return list(self._execOrder)
 
 	# Return the tree nodes in registration order
 	def getRegOrder(self):
-		return sorted(self.getTreeNodes(), key=lambda node: int(node.getRegID()))
+		return sorted(self.getTreeNodes(), key=lambda node: node.getRegID())
 
 	# Return the node preceding NODE in the tree execution order
 	def getNodeExecPredecessor (self, node):
-		execOrder = self.getExecOrder()
-		if (int(node.getExecID()) <= 0):
+		if (node.getExecID() <= 0):
 			return None
-		
-		pred = execOrder[0]
-		for curr in execOrder:
-			if (curr.getExecID() == node.getExecID()):
-				assert(pred != curr)
-				return pred
-			pred = curr
+
+		self._refreshExecOrder()
+		# Find the first node with this execID; its predecessor is the node before it.
+		ix = bisect.bisect_left(self._execOrderKeys, (node.getExecID(), -1))
+		if ix < len(self._execOrder) and self._execOrder[ix].getExecID() == node.getExecID():
+			assert(0 < ix)
+			return self._execOrder[ix - 1]
 		assert(not "CallbackNodeTree::getNodeExecPredecessor: Error, did not find node with execID {} in tree".format(node.getExecID()))
 
 	# #Transform the tree into an intermediate format for more convenient schedule re-arrangement.
@@ -816,3 +1308,95 @@ class CallbackNodeTree (object):
 	# 		assert(pred.getCBType() == 'UV_AFTER_WORK_CB')
 	# 		assert(async.getCBType() == 'UV_ASYNC_CB')
 	# 		logging.debug("LOOKS OK")
+
+#############################
+# HappensBeforeIndex
+#############################
+
+# Reachability labels for the happens-before DAG of a CallbackNodeTree: its parent -> child and antecedent -> dependent edges.
+#
+# Each node is labeled with the intervals of the tree's Euler tour (see CallbackNodeTree._refreshTour) that hold its descendants:
+# its own subtree, plus the "extra" intervals of the subtrees it reaches through dependency edges.
+# The tour intervals of subtrees are nested or disjoint, so the extra intervals of a node merge into a short sorted list.
+# "Does a happen before b?" is then a lookup of b's tour position in a's intervals:
+# O(1) for nodes with no dependency edges below them, O(log k) for a node with k extra intervals.
+#
+# The index is a snapshot: the tree rebuilds it when its structure changes (see CallbackNodeTree.getHappensBeforeIndex).
+class HappensBeforeIndex(object):
+	# input: (tour)
+	#   tour    CallbackNodeTree._tour; every node in it has up-to-date _tourIn and _tourOut
+	def __init__(self, tour):
+		self._tour = tour
+		self._extraStarts = {} # tourIn -> sorted starts of the node's extra intervals, for nodes that have any
+		self._extraEnds = {} # tourIn -> the corresponding ends
+		self._build()
+
+	# input: ()
+	# output: ()
+	#
+	# Labels the nodes in reverse topological order, so each node's successors are labeled first.
+	def _build(self):
+		successors = [self._successors(node) for node in self._tour]
+		inDegree = [0] * len(self._tour)
+		for succs in successors:
+			for s in succs:
+				inDegree[s._tourIn] += 1
+
+		topoOrder = [ix for ix in xrange(len(self._tour)) if inDegree[ix] == 0]
+		for ix in topoOrder: # topoOrder grows as we go
+			for s in successors[ix]:
+				inDegree[s._tourIn] -= 1
+				if inDegree[s._tourIn] == 0:
+					topoOrder.append(s._tourIn)
+		assert(len(topoOrder) == len(self._tour)) # Children and dependents must not form a cycle
+
+		for ix in reversed(topoOrder):
+			node = self._tour[ix]
+			intervals = []
+			for s in successors[ix]:
+				if s.getParent() is not node:
+					intervals.append((s._tourIn, s._tourOut))
+				if s._tourIn in self._extraStarts:
+					intervals.extend(zip(self._extraStarts[s._tourIn], self._extraEnds[s._tourIn]))
+			# Keep what lies outside node's own subtree, merging nested and adjacent intervals
+			intervals = [i for i in intervals if not (node._tourIn <= i[0] and i[1] <= node._tourOut)]
+			if not intervals:
+				continue
+			intervals.sort(key=lambda i: (i[0], -i[1]))
+			starts, ends = [intervals[0][0]], [intervals[0][1]]
+			for begin, end in intervals[1:]:
+				if begin <= ends[-1]:
+					ends[-1] = max(ends[-1], end)
+				else:
+					starts.append(begin)
+					ends.append(end)
+			self._extraStarts[ix] = starts
+			self._extraEnds[ix] = ends
+		logging.debug("Labeled {} nodes; {} have extra intervals".format(len(self._tour), len(self._extraStarts)))
+
+	# input: (node)
+	# output: (successors) the children and dependents of node that are in the tour
+	def _successors(self, node):
+		return [s for s in node.getChildren() + node.getDependents() if s._tourIn is not None]
+
+	# input: (a, b)
+	#   a, b    nodes in the tour
+	# output: (True/False) True if b is reachable from a through parent-child and dependency edges (a != b)
+	def happensBefore(self, a, b):
+		aIx, bIx = a._tourIn, b._tourIn
+		if aIx < bIx < a._tourOut:
+			return True
+		starts = self._extraStarts.get(aIx)
+		if starts is None:
+			return False
+		k = bisect.bisect_right(starts, bIx) - 1
+		return (0 <= k and bIx < self._extraEnds[aIx][k])
+
+	# input: (node)
+	#   node    a node in the tour
+	# output: (intervals) list of [begin, end) tour intervals covering node and all the nodes that node happens before
+	def descendantIntervals(self, node):
+		intervals = [(node._tourIn, node._tourOut)]
+		if node._tourIn in self._extraStarts:
+			intervals.extend(zip(self._extraStarts[node._tourIn], self._extraEnds[node._tourIn]))
+		return intervals
@@ -0,0 +1,51 @@
+#Author: Jamie Davis (davisjam@vt.edu)
+#Description: Streaming writer for graphs in the graphviz DOT language
+# Defines the following public classes:
+#  DotWriter
+# Python version: 2.7.6
+#
+# Nodes and edges are written as they are added, so the graph is never held in memory.
+# DOT allows an edge to name a node before (or without) the node's own statement.
+
+#############################
+# DotWriter
+#############################
+
+# input: (s)
+# output: (quoted) s as a DOT quoted string
+# Backslashes are not escaped, so DOT escapes like "\n" in labels pass through.
+def quote(s):
+	return '"{}"'.format(str(s).replace('"', '\\"').replace('\n', '\\n'))
+
+# input: (attrs) dict
+# output: (attrStr) attrs as a DOT attribute list, or "" if there are none
+def _attrList(attrs):
+	if not attrs:
+		return ""
+	return " [{}]".format(", ".join(["{}={}".format(k, quote(attrs[k])) for k in sorted(attrs.keys())]))
+
+# A directed graph written to a file one statement at a time
+class DotWriter:
+	# input: (f, [graphName])
+	#   f    file-like object to write to
+	def __init__(self, f, graphName="G"):
+		self.f = f
+		self.nNodes = 0
+		self.nEdges = 0
+		self.f.write("digraph {} {{\n".format(quote(graphName)))
+
+	# input: (nodeID, [attrs])
+	#   attrs    dict of DOT node attributes
+	def addNode(self, nodeID, attrs=None):
+		self.f.write("\t{}{};\n".format(quote(nodeID), _attrList(attrs)))
+		self.nNodes += 1
+
+	# input: (srcID, dstID, [attrs])
+	#   attrs    dict of DOT edge attributes
+	def addEdge(self, srcID, dstID, attrs=None):
+		self.f.write("\t{} -> {}{};\n".format(quote(srcID), quote(dstID), _attrList(attrs)))
+		self.nEdges += 1
+
+	# Finish the graph. The caller remains responsible for closing f.
+	def close(self):
+		self.f.write("}\n")
@@ -0,0 +1,74 @@
+# Author: Jamie Davis (davisjam@vt.edu)
+# Description: Enumerates the races in a Schedule that Schedule.reschedule can flip,
+#   so that rescheduler can explore a schedule without a hand-written race file.
+# Defines the following public functions:
+# 	iterRacePairs
+# 	findRacePairs
+# Python version: 2.7.6
+#
+# A race is a pair of executed async events (CallbackNode.ASYNC_TYPES) neither of which happens before the other,
+# i.e. neither is an ancestor of the other through registration or dependency edges.
+#
+# Many races yield the same schedule, and only one of each such set is reported:
+#  - Nested threadpool events (TP_WORK_NESTED_TYPES, TP_DONE_NESTED_TYPES) are relocated along with the initial event of
+#    their family, so only the initial event represents the family.
+#  - Schedule.reschedule leaves the earlier event (the pivot) in place and moves the later event into a new UV_RUN loop
+#    immediately before the loop containing the pivot. The resulting schedule depends only on the later event and the
+#    pivot's loop, so for each later event only one pivot per loop is reported.
+
+import logging
+
+import Callback as CB
+import Schedule
+
+# input: (cb)
+# output: (isRepresentative) True if cb can be the pivot or the moved event of a reported race
+def _isRaceRepresentative(cb):
+	return (cb.executed() and cb.isAsync() and
+	        cb.getCBType() not in CB.CallbackNode.TP_WORK_NESTED_TYPES and
+	        cb.getCBType() not in CB.CallbackNode.TP_DONE_NESTED_TYPES)
+
+# input: (schedule)
+#   schedule    a Schedule.Schedule; it is not modified
+# output: generator of races [earlierExecID, laterExecID], suitable for schedule.reschedule
+#
+# Races are produced in order of the later event, and for each later event from the nearest loop back to the first,
+# so a caller that stops early has the most local races.
+def iterRacePairs(schedule):
+	# Find the loop of each representative event.
+	# normalize() moves threadpool events that precede the first UV_RUN loop into it, so those count as loop 1.
+	candidatesByLoop = [[]] # loop -> representative events in that loop, in exec order
+	loop = 0
+	for event in schedule.execSchedule:
+		cb = event.getCB()
+		if cb.getCBType() == Schedule.Schedule.runBegin:
+			loop += 1
+			candidatesByLoop.append([])
+		elif _isRaceRepresentative(cb):
+			candidatesByLoop[max(loop, 1)].append(cb)
+	logging.info("{} candidate events in {} loops".format(sum([len(c) for c in candidatesByLoop]), loop))
+
+	for laterLoop in range(1, len(candidatesByLoop)):
+		for laterIx, later in enumerate(candidatesByLoop[laterLoop]):
+			for pivotLoop in range(laterLoop, 0, -1):
+				if pivotLoop == laterLoop:
+					pivotCandidates = candidatesByLoop[pivotLoop][:laterIx]
+				else:
+					pivotCandidates = candidatesByLoop[pivotLoop]
+				for pivot in pivotCandidates:
+					if not pivot.isAncestorOf(later, includeDependents=True):
+						yield [pivot.getID(), later.getID()]
+						break
+
+# input: (schedule, [maxPairs])
+#   schedule    a Schedule.Schedule; it is not modified
+#   maxPairs    stop after this many races
+# output: (races) list of races [earlierExecID, laterExecID], in the order of iterRacePairs
+def findRacePairs(schedule, maxPairs=None):
+	races = []
+	for race in iterRacePairs(schedule):
+		races.append(race)
+		if maxPairs is not None and maxPairs <= len(races):
+			logging.info("Stopping after {} races".format(maxPairs))
+			break
+	return races
@@ -2,6 +2,8 @@
 # Description: Python description of libuv callback schedule
 # Defines the following public classes: 
 # Schedule
+# ScheduleEvent
+# ExecSchedule
 # Defines the following exceptions:
 # ScheduleException
 # Python version: 2.7.6
@@ -9,6 +11,7 @@
 import re
 import logging
 import copy
+import bisect
 
 import Callback as CB
 
@@ -41,6 +44,7 @@ class RelocationClass:
 # The constructor and public functions always return leaving the Schedule with self.isValid() == True.
 # Private functions (self._*) might not.
 #   In private functions, use self.execSchedule.index() rather than cb.getExecID() to determine the location of a ScheduleEvent in the execSchedule.
+#   self.execSchedule is an ExecSchedule, so index() is cheap.
 # Method calls may throw a ScheduleException.
 class Schedule (object):
 	# CBs of these types are asynchronous, and can be moved from one loop to another provided that they do not violate
@@ -79,11 +83,17 @@ class Schedule (object):
 
 	LIBUV_THREADPOOL_DONE_BEGINNING_TYPE = "UV_ASYNC_CB"
 
-	def __init__ (self, scheduleFile):
+	# Debugging aid: if True, isValid always checks the entire schedule and cross-checks the result of the incremental check.
+	FULL_VALIDATION = False
+
+	# input: (scheduleFile, [useMmap])
+	#   scheduleFile    schedule file produced by scheduler_emit
+	#   useMmap         read scheduleFile through mmap (see CB.ScheduleReader)
+	def __init__ (self, scheduleFile, useMmap=False):
 		logging.debug("scheduleFile {}".format(scheduleFile))
 		self.scheduleFile = scheduleFile
-		self.cbTree = CB.CallbackNodeTree(self.scheduleFile)
-		self.execSchedule = self._genExecSchedule(self.cbTree) # List of annotated ScheduleEvents
+		self.cbTree = CB.CallbackNodeTree(self.scheduleFile, useMmap=useMmap)
+		self.execSchedule = self._genExecSchedule(self.cbTree) # ExecSchedule of annotated ScheduleEvents
 		self.normalized = False
 		
 		logging.debug("Dumping initial execSchedule")
@@ -99,8 +109,11 @@ class Schedule (object):
 		logging.debug("tpDoneAsyncRoot {}".format(self.tpDoneAsyncRoot))
 		
 		# nextNewEventID and all larger numbers are unique registration IDs for new nodes
-		self.nextNewEventID = max([int(cb.getRegID()) for cb in self.cbTree.getTreeNodes()]) + 1
+		self.nextNewEventID = max([cb.getRegID() for cb in self.cbTree.getTreeNodes()]) + 1
 		
+		# Entry state of each UV_RUN loop as of the last validity check, for incremental checks. See isValid.
+		# None means that the next check must be a full one.
+		self._loopEntryStages = None
 		if not self.isValid():
 			raise ScheduleException("The input schedule was not valid")
 		logging.debug("Processed an exec schedule with {} executed nodes (tree contains {} registered nodes)".format(len(self.execSchedule), len(self._regList())))
@@ -110,13 +123,11 @@ class Schedule (object):
 	# output: (ix, se)
 	#   ix    index of the corresponding ScheduleEvent, or None
 	#   se    the corresponding ScheduleEvent, or None
-	#
-	# If the performance is cruddy, add a field to CB.CallbackNode for a fast lookup.
 	def _cbToScheduleEvent(self, cb):
-		for ix, se in enumerate(self.execSchedule):
-			if se.getCB() == cb:
-				return ix, se
-		return None, None
+		se = self.execSchedule.eventForCB(cb)
+		if se is None:
+			return None, None
+		return self.execSchedule.index(se), se
 
 	# input: ()
 	# output: (tpDoneAsyncRoot)
@@ -169,11 +180,11 @@ class Schedule (object):
 		return newID
 
 	# input: (cbTree)
-	# output: (execSchedule) List of ScheduleEvents
+	# output: (execSchedule) ExecSchedule of ScheduleEvents
 	def _genExecSchedule (self, cbTree):
 		# ScheduleEvents in the order of execution
 		execSchedule = [ScheduleEvent(cb) for cb in cbTree.getTreeNodes() if cb.executed()]
-		execSchedule.sort(key=lambda n: int(n.getCB().getExecID()))
+		execSchedule.sort(key=lambda n: n.getCB().getExecID())
 
 		libuvLoopCount = -1
 		libuvLoopStage = None
@@ -212,7 +223,7 @@ class Schedule (object):
 				event.setLibuvLoopCount(libuvLoopCount)
 				event.setLibuvLoopStage(libuvLoopStage)
 
-		return execSchedule
+		return ExecSchedule(execSchedule)
 
 	# input: ()
 	# output: (regList) returns list of CallbackNodes in increasing registration order
@@ -221,8 +232,9 @@ class Schedule (object):
 	def _regList(self):
 		return self.cbTree.getRegOrder()
 
-	# input: ([checkCBTree])
+	# input: ([checkCBTree], [full])
 	#    checkCBTree        Check validity of self.cbTree? Default is True
+	#    full               Check the entire schedule, not just what was modified since the last check? Default is False
 	# output: (isValid) True if this schedule "looks valid" (i.e. like a legal libuv schedule)
 	#
 	# Goes through each event and verifies that it occurs in a legal place in the schedule
@@ -233,18 +245,82 @@ class Schedule (object):
 	#   - TP 'done' events (UV_AFTER_WORK_CB and children) are always preceded by another TP 'done' event or a UV_ASYNC_CB in the TP's async chain
 	#   - that self.cbTree.isValid()
 	# self.isValid() should hold at the beginning and end of each public Schedule method.
-	def isValid(self, checkCBTree=True):
-
+	#
+	# Checks are incremental. self.execSchedule and self.cbTree record what was modified since the last check, and only
+	# the UV_RUN loops containing modified events and the relationships of modified nodes are re-checked.
+	# Events outside the re-checked loops are assumed to have the right execIDs; self._updateExecIDs renumbers the entire schedule.
+	# After a failed check, or with Schedule.FULL_VALIDATION set, the entire schedule is checked.
+	def isValid(self, checkCBTree=True, full=False):
+		modifiedEvents = self.execSchedule.takeModifiedEvents()
+		modifiedNodes = None
+		if checkCBTree:
+			modifiedNodes = self.cbTree.takeModifiedNodes()
+
+		haveLoopEntryStages = (self._loopEntryStages is not None)
+		if Schedule.FULL_VALIDATION and haveLoopEntryStages:
+			incrementalIsValid = self._isValid(checkCBTree, modifiedEvents, modifiedNodes)
+			isValid = self._isValid(checkCBTree, None, None)
+			if incrementalIsValid != isValid:
+				logging.error("isValid: Error, incremental validation said {} but full validation said {}".format(incrementalIsValid, isValid))
+			assert(incrementalIsValid == isValid)
+		elif full or not haveLoopEntryStages:
+			isValid = self._isValid(checkCBTree, None, None)
+		else:
+			isValid = self._isValid(checkCBTree, modifiedEvents, modifiedNodes)
+
+		if not isValid:
+			# The remembered loop entry states may be wrong now
+			self._loopEntryStages = None
+		return isValid
+
+	# input: (checkCBTree, modifiedEvents, modifiedNodes)
+	#    checkCBTree        Check validity of self.cbTree?
+	#    modifiedEvents     the events of self.execSchedule modified since the last check, or None to check all of them
+	#    modifiedNodes      the nodes of self.cbTree modified since the last check, or None to check all of them
+	# output: (isValid)
+	#
+	# Helper for self.isValid.
+	def _isValid(self, checkCBTree, modifiedEvents, modifiedNodes):
 		if checkCBTree:
 			logging.debug("Checking cbTree")
-			if not self.cbTree.isValid():
+			nodesToCheck = None
+			if modifiedNodes is not None:
+				# Events that moved may now precede their ancestors or follow their descendants
+				nodesToCheck = modifiedNodes + [e.getCB() for e in modifiedEvents]
+			if not self.cbTree.isValid(nodesToCheck):
 				logging.debug("cbTree is not valid")
 				return False
 			# This will fail if self.execSchedule and self.cbTree have gotten significantly out of sync.
 			# There may be unexecuted registered events.
-			logging.debug("execSchedule contains {} executed nodes (tree contains {} registered nodes)".format(len(self.execSchedule), len(self._regList())))
-			assert(len(self.execSchedule) <= len(self._regList()))
+			nRegistered = len(self.cbTree.getTreeNodes())
+			logging.debug("execSchedule contains {} executed nodes (tree contains {} registered nodes)".format(len(self.execSchedule), nRegistered))
+			assert(len(self.execSchedule) <= nRegistered)
+
+		if modifiedEvents is None:
+			self._loopEntryStages = {}
+			return self._scanExecSchedule(0, None)
 
+		modifiedIxs = [self.execSchedule.index(e) for e in modifiedEvents if e in self.execSchedule]
+		if not modifiedIxs:
+			return True
+		firstModifiedIx, lastModifiedIx = min(modifiedIxs), max(modifiedIxs)
+
+		# Resume at the closest loop before the modifications whose entry state we know
+		startIx = 0
+		for ix, event in self.execSchedule.iterRange(firstModifiedIx - 1, -1, 'earlier'):
+			if event in self._loopEntryStages:
+				startIx = ix
+				break
+		logging.debug("Modified events span {}-{}; checking from {}".format(firstModifiedIx, lastModifiedIx, startIx))
+		return self._scanExecSchedule(startIx, lastModifiedIx)
+
+	# input: (startIx, lastModifiedIx)
+	#    startIx            where to start. Either 0 or the beginning of a UV_RUN loop in self._loopEntryStages
+	#    lastModifiedIx     the index of the last modified event, or None to scan to the end of self.execSchedule
+	# output: (isValid)
+	#
+	# Helper for self.isValid: walks self.execSchedule, tracking the libuv stage, and updates self._loopEntryStages.
+	def _scanExecSchedule(self, startIx, lastModifiedIx):
 		# Stack of the current libuv run stage.
 		# Each element is in LIBUV_RUN_ALL_STAGES.
 		# A stage is append()'d when its BEGIN is encountered, and pop()'d when its END is encountered
@@ -252,12 +328,14 @@ class Schedule (object):
 		# The UV_RUN loop inner stage we most recently ended
 		# Starts set to the final inner stage so that we don't need special cases for "first time through the loop"
 		lastEndedInnerStage = Schedule.LIBUV_RUN_INNER_STAGES[-1]
+		if startIx:
+			lastEndedInnerStage = self._loopEntryStages[self.execSchedule[startIx]]
 		# If we've encountered the EXIT event
 		exiting = False
 		# The previous looper event (i.e. not prevLooperEvent.isThreadpoolCB()) we encountered
 		prevLooperEvent = None
 		
-		for actualExecID, event in enumerate(self.execSchedule):
+		for actualExecID, event in self.execSchedule.iterRange(startIx, len(self.execSchedule), 'later'):
 			# Extract some details about this event for convenience			
 			eventCB = event.getCB()			
 			eventCBType = eventCB.getCBType()
@@ -268,9 +346,17 @@ class Schedule (object):
 			logging.debug("actualExecID {} eventCBType {} eventLoopStage {} inAnyStage {} lastEndedInnerStage {} exiting {}".format(actualExecID, eventCBType, eventLoopStage, inAnyStage, lastEndedInnerStage, exiting))			
 
 			# Event execID must be correct (execIDs must go 0, 1, 2, ...)			
-			if int(eventCB.getExecID()) != actualExecID:
-				logging.debug("Not valid: node {}: expectedExecID {} but have execID {}".format(eventCB, actualExecID, int(eventCB.getExecID())))
+			if eventCB.getExecID() != actualExecID:
+				logging.debug("Not valid: node {}: expectedExecID {} but have execID {}".format(eventCB, actualExecID, eventCB.getExecID()))
 				return False
+
+			# Remember the state on entry to each UV_RUN loop.
+			# Once we are past the modified events, a loop whose entry state matches what we remembered begins an unmodified, valid suffix.
+			if eventCBType == Schedule.runBegin and not inAnyStage and not exiting:
+				if lastModifiedIx is not None and lastModifiedIx < actualExecID and self._loopEntryStages.get(event) == lastEndedInnerStage:
+					logging.debug("Reached loop at {} with its previous entry state; the rest of the schedule is unchanged".format(actualExecID))
+					return True
+				self._loopEntryStages[event] = lastEndedInnerStage
 			
 			# Event must be in the correct point of the schedule										
 			if eventCB.isThreadpoolCB():
@@ -454,7 +540,7 @@ class Schedule (object):
 	#
 	# Raises a ScheduleException on invalid or insupportable request
 	def _validateRescheduleIDs(self, racyNodeIDs):
-		events = [e for e in self.execSchedule if int(e.getCB().getID()) in racyNodeIDs]
+		events = [e for e in self.execSchedule if e.getCB().getID() in racyNodeIDs]
 
 		# Validate the events
 		for event in events:
@@ -475,7 +561,7 @@ class Schedule (object):
 						'Error, one of the nodes to flip is an ancestor of another of the nodes to flip:\n  {}\n  {}'.format(cb,
 																																																								 other.getCB()))
 
-		origRacyExecOrder = sorted(events, key=lambda e: int(e.getCB().getExecID()))
+		origRacyExecOrder = sorted(events, key=lambda e: e.getCB().getExecID())
 
 		# We can only reschedule async events at the moment
 		# In the future we could climb until we find a node we cannot flip (network input?) or an async node (can flip, and then trickle down the effect)
@@ -886,10 +972,11 @@ class Schedule (object):
 	#   executedDescendants    list of all executed descendants of event, NOT including event itself
 	def _getExecutedDescendants(self, event, includeDependents=True):
 		# Identify all events that need to be relocated: event and its descendants and dependents, now referred to as descendants
-		executedEventDescendants_CBs = [cb for cb in event.getCB().getDescendants(includeDependents=True) if
+		executedEventDescendants_CBs = [cb for cb in event.getCB().getDescendants(includeDependents=includeDependents) if
 																		cb.executed()]
 		# Some CBs might be registered (i.e. in self.cbTree) but not executed (i.e. in self.execSchedule)
-		matchingEvents = [e for e in self.execSchedule if e.getCB() in executedEventDescendants_CBs]
+		matchingEvents = [self._cbToScheduleEvent(cb)[1] for cb in executedEventDescendants_CBs]
+		matchingEvents = sorted([e for e in matchingEvents if e is not None], key=lambda e: self.execSchedule.index(e))
 		assert(len(matchingEvents) <= len(executedEventDescendants_CBs))
 		return matchingEvents
 
@@ -908,8 +995,7 @@ class Schedule (object):
 	# output: ()
 	# Set the execID of each event in self.execSchedule to its index in self.execSchedule
 	def _updateExecIDs(self, startingIx=0):
-		for ix, event in enumerate(self.execSchedule[startingIx:]):
-			newExecID = startingIx + ix
+		for newExecID, event in self.execSchedule.iterRange(startingIx, len(self.execSchedule), 'later'):
 			event.getCB().setExecID(newExecID)
 
 	# input: (startIx)
@@ -917,28 +1003,54 @@ class Schedule (object):
 	# Finds the first "looper" ScheduleEvent in self.execSchedule at or after startIx
 	# See _findMatchingScheduleEvent for details.
 	def _findNextLooperScheduleEvent(self, startIx):
-		return self._findMatchingScheduleEvent(lambda se: not se.getCB().isThreadpoolCB(), "later", startIx)
+		return self._findScheduleEventOfKind(False, "later", startIx)
 
 	# input: (startIx)
 	# output: (eventIx, event)
 	# Finds the first "looper" ScheduleEvent in self.execSchedule at or before startIx
 	# See _findMatchingScheduleEvent for details.
 	def _findPrevLooperScheduleEvent(self, startIx):
-		return self._findMatchingScheduleEvent(lambda se: not se.getCB().isThreadpoolCB(), "earlier", startIx)
+		return self._findScheduleEventOfKind(False, "earlier", startIx)
 
 	# input: (startIx)
 	# output: (eventIx, event)
 	# Finds the first threadpool ScheduleEvent in self.execSchedule at or after startIx
 	# See _findMatchingScheduleEvent for details.
 	def _findNextTPScheduleEvent(self, startIx):
-		return self._findMatchingScheduleEvent(lambda se: se.getCB().isThreadpoolCB(), "later", startIx)
+		return self._findScheduleEventOfKind(True, "later", startIx)
 
 	# input: (startIx)
 	# output: (eventIx, event)
 	# Finds the first threadpool ScheduleEvent in self.execSchedule at or before startIx
 	# See _findMatchingScheduleEvent for details.
 	def _findPrevTPScheduleEvent(self, startIx):
-		return self._findMatchingScheduleEvent(lambda se: se.getCB().isThreadpoolCB(), "earlier", startIx)
+		return self._findScheduleEventOfKind(True, "earlier", startIx)
+
+	# input: (wantTP, direction, startIx)
+	#   wantTP: True to find a threadpool ScheduleEvent, False to find a looper ScheduleEvent
+	# output: (eventIx, event)
+	# Equivalent to self._findMatchingScheduleEvent with a searchFunc testing isThreadpoolCB(),
+	# but uses ExecSchedule's per-block counts to skip stretches that cannot match.
+	def _findScheduleEventOfKind(self, wantTP, direction, startIx):
+		startIx, lastIx = self._clampSearchRange(direction, startIx)
+		return self.execSchedule.findNextOfKind(startIx, lastIx, direction, wantTP)
+
+	# input: (direction, startIx)
+	# output: (startIx, lastIx)
+	#   The range searched by self._findMatchingScheduleEvent: from startIx (clamped into self.execSchedule) up to lastIx, exclusive.
+	def _clampSearchRange(self, direction, startIx):
+		minIx = 0
+		maxIx = len(self.execSchedule) - 1
+		if startIx < minIx:
+			startIx = minIx
+		if maxIx < startIx:
+			startIx = maxIx
+
+		if direction == 'earlier':
+			lastIx = minIx
+		else:
+			lastIx = maxIx
+		return startIx, lastIx
 
 	# input: (searchFunc, direction, startIx)
 	#   searchFunc: when invoked on a ScheduleEvent, returns True if match, else False
@@ -953,25 +1065,11 @@ class Schedule (object):
 		assert(direction in ['earlier', 'later'])
 		assert(startIx is not None)
 
-		minIx = 0
-		maxIx = len(self.execSchedule) - 1		
-		if startIx < minIx:
-			startIx = minIx			
-		if maxIx < startIx:
-			startIx = maxIx
-
-		if direction == 'earlier':
-			lastIx = minIx			
-			sliceStride = -1			
-		else:
-			lastIx = maxIx
-			sliceStride = 1
-
-		for i, scheduleEvent in enumerate(self.execSchedule[startIx:lastIx:sliceStride]):
+		startIx, lastIx = self._clampSearchRange(direction, startIx)
+		for matchIx, scheduleEvent in self.execSchedule.iterRange(startIx, lastIx, direction):
 			if searchFunc(scheduleEvent):
-				matchIx = startIx + i*sliceStride
 				#logging.debug("Match! (matchIx {} startIx {} direction {})".format(matchIx, startIx, direction))
-				return matchIx, self.execSchedule[matchIx]
+				return matchIx, scheduleEvent
 
 		#logging.debug("Found no matching scheduleEvent (startIx {} direction {})".format(startIx, direction))
 		return None, None
@@ -1001,7 +1099,7 @@ class Schedule (object):
 
 		# Insert the new stages into self.execSchedule.
 		_, templateSE = self._findMatchingScheduleEvent(lambda se: se.getCB().isMarkerNode(), "later", 0)
-		dummyCallbackString = templateSE.getCB().callbackString
+		dummyCallbackString = str(templateSE.getCB())
 		for i, markerType in enumerate(markersToInsert):
 			insertIx = newLoopIx + i
 			# Create a marker CallbackNode.
@@ -1092,7 +1190,7 @@ class Schedule (object):
 
 		# Insert a new Schedule.LIBUV_THREADPOOL_DONE_BEGINNING_TYPE event into self.execSchedule.
 		templateSE = self.tpDoneAsyncRoot
-		dummyCallbackString = templateSE.getCB().callbackString
+		dummyCallbackString = str(templateSE.getCB())
 		cbType = Schedule.LIBUV_THREADPOOL_DONE_BEGINNING_TYPE
 		# Create a CallbackNode.
 		asyncCB = CB.CallbackNode(dummyCallbackString)
@@ -1226,13 +1324,18 @@ class Schedule (object):
 		assert(initialStackIx is not None and initialStackEvent)
 		assert(initialStackEvent == self.initialStackEvent)
 
+		markerEvents = [e for e in self.execSchedule if e.getCB().getCBType() in Schedule.LIBUV_LOOP_STAGE_MARKER_ORDER]
+
+		# Detach the existing marker line before rebuilding it.
+		# Detaching it all at once means self.cbTree re-indexes each marker only once.
+		filterOutMarker_func = lambda cbn: cbn.getCBType() not in Schedule.LIBUV_LOOP_STAGE_MARKER_ORDER
+		initialStackEvent.getCB().filterChildren(filterOutMarker_func)
+		for markerEvent in markerEvents:
+			markerEvent.getCB().filterChildren(filterOutMarker_func)
+
 		# markerParent is the ScheduleEvent corresponding to the parent of the next marker.
 		# At the beginning of each loop iteration, it has no markers in its list of children.
 		markerParent = initialStackEvent
-		filterOutMarker_func = lambda cbn: cbn.getCBType() not in Schedule.LIBUV_LOOP_STAGE_MARKER_ORDER
-		markerParent.getCB().filterChildren(filterOutMarker_func)
-
-		markerEvents = [e for e in self.execSchedule if e.getCB().getCBType() in Schedule.LIBUV_LOOP_STAGE_MARKER_ORDER]
 		for markerEvent in markerEvents:
 			# Update the markerParent <-> markerEvent relationship
 			mpCB = markerParent.getCB()
@@ -1242,7 +1345,6 @@ class Schedule (object):
 			meCB.setParent(mpCB)
 
 			markerParent = markerEvent
-			markerParent.getCB().filterChildren(filterOutMarker_func)
 
 	# input: ()
 	# output: ()
@@ -1373,10 +1475,13 @@ class Schedule (object):
 
 # Represents events in a schedule
 class ScheduleEvent(object):
+	__slots__ = ["cb", "libuvLoopCount", "libuvLoopStage", "_execBlock"]
+
 	def __init__(self, cb):
 		self.cb = cb
 		self.libuvLoopCount = -1
 		self.libuvLoopStage = None
+		self._execBlock = None # The _ExecScheduleBlock holding this event, if any. Maintained by ExecSchedule.
 
 	def getCB(self):
 		return self.cb
@@ -1393,3 +1498,271 @@ class ScheduleEvent(object):
 
 	def getLibuvLoopStage(self):
 		return self.libuvLoopStage
+
+#############################
+# ExecSchedule
+#############################
+
+# The sequence of ScheduleEvents in a Schedule, in execution order.
+# Supports the list operations Schedule uses (len, iteration, [ix], slices, index, insert, remove, pop, append).
+#
+# Events are stored in a list of blocks of roughly BLOCK_SIZE events each.
+# Each ScheduleEvent points back to the block that holds it, so index() and remove() only scan one block
+# plus a prefix of block offsets that is recomputed lazily after modifications.
+# Each block counts its threadpool events, so findNextTP and findNextLooper can skip whole blocks.
+# The events affected by insertions and removals are recorded for incremental validation (see takeModifiedEvents).
+# An event may be in at most one ExecSchedule at a time.
+class ExecSchedule(object):
+	BLOCK_SIZE = 256
+
+	def __init__(self, events=[]):
+		self._blocks = []
+		self._blockStarts = [] # self._blockStarts[i] is the index of the first event in self._blocks[i]
+		self._nValidStarts = 0 # self._blockStarts[:self._nValidStarts] are up to date
+		self._len = 0
+		self._cbNameToEvent = {}
+		self._modifiedEvents = {} # id(event) -> event inserted, removed, or next to a removed event since the last takeModifiedEvents()
+
+		for i in range(0, len(events), ExecSchedule.BLOCK_SIZE):
+			self._blocks.append(_ExecScheduleBlock(self, events[i:i + ExecSchedule.BLOCK_SIZE]))
+		if not self._blocks:
+			self._blocks.append(_ExecScheduleBlock(self, []))
+		self._renumberBlocks(0)
+
+		for e in events:
+			self._cbNameToEvent[e.getCB().getName()] = e
+		self._len = len(events)
+
+	def __len__(self):
+		return self._len
+
+	def __iter__(self):
+		for block in self._blocks:
+			for e in block.events:
+				yield e
+
+	def __contains__(self, event):
+		return (event._execBlock is not None and event._execBlock.owner is self)
+
+	def __getitem__(self, ix):
+		if isinstance(ix, slice):
+			return [self[i] for i in range(*ix.indices(self._len))]
+		block, offset = self._locate(ix)
+		return block.events[offset]
+
+	# input: (event)
+	# output: (ix) index of event. Raises a ValueError if event is not in self.
+	def index(self, event):
+		block = event._execBlock
+		if block is None or block.owner is not self:
+			raise ValueError("ExecSchedule.index: event is not in the schedule")
+		self._updateBlockStarts(block.ix + 1)
+		return self._blockStarts[block.ix] + block.events.index(event)
+
+	# input: (cb)
+	# output: (event) the ScheduleEvent in self whose CallbackNode has the same name as cb, or None
+	def eventForCB(self, cb):
+		return self._cbNameToEvent.get(cb.getName())
+
+	def insert(self, ix, event):
+		assert(event._execBlock is None)
+		if ix < 0:
+			ix = max(0, self._len + ix)
+		if self._len <= ix:
+			block, offset = self._blocks[-1], len(self._blocks[-1].events)
+		else:
+			block, offset = self._locate(ix)
+
+		block.events.insert(offset, event)
+		block.noteAdded(event)
+		self._noteAdded(event, block)
+		self._modifiedEvents[id(event)] = event
+
+		if 2*ExecSchedule.BLOCK_SIZE < len(block.events):
+			self._splitBlock(block)
+
+	def append(self, event):
+		self.insert(self._len, event)
+
+	def remove(self, event):
+		ix = self.index(event)
+		self.pop(ix)
+
+	def pop(self, ix=-1):
+		if ix < 0:
+			ix += self._len
+		block, offset = self._locate(ix)
+		event = block.events.pop(offset)
+		block.noteRemoved(event)
+		self._noteRemoved(event, block)
+
+		if not block.events and 1 < len(self._blocks):
+			del self._blocks[block.ix]
+			del self._blockStarts[block.ix]
+			self._renumberBlocks(block.ix)
+
+		# The events on either side of the gap are now adjacent
+		self._modifiedEvents[id(event)] = event
+		for neighborIx in [ix - 1, ix]:
+			if 0 <= neighborIx < self._len:
+				neighbor = self[neighborIx]
+				self._modifiedEvents[id(neighbor)] = neighbor
+		return event
+
+	# input: ()
+	# output: (modifiedEvents) the events inserted, removed, or next to a removed event since the last call.
+	#   Events that have since been removed are included; use 'in' to tell them apart.
+	def takeModifiedEvents(self):
+		modifiedEvents = self._modifiedEvents.values()
+		self._modifiedEvents = {}
+		return modifiedEvents
+
+	# input: (startIx, stopIx, direction, wantTP)
+	#   startIx     first index to consider
+	#   stopIx      searching stops before reaching this index
+	#   direction   'earlier' or 'later'
+	#   wantTP      True to find a threadpool event, False to find a looper event
+	# output: (eventIx, event)
+	#   The first matching event in [startIx, stopIx) (or (stopIx, startIx] for 'earlier'), or (None, None)
+	def findNextOfKind(self, startIx, stopIx, direction, wantTP):
+		assert(direction in ['earlier', 'later'])
+		if direction == 'later' and stopIx <= startIx:
+			return None, None
+		if direction == 'earlier' and startIx <= stopIx:
+			return None, None
+
+		block, offset = self._locate(startIx)
+		step = 1 if direction == 'later' else -1
+		ix = startIx
+		while True:
+			if block.hasKind(wantTP):
+				events = block.events
+				while 0 <= offset < len(events):
+					if ix == stopIx:
+						return None, None
+					if events[offset].getCB().isThreadpoolCB() == wantTP:
+						return ix, events[offset]
+					offset += step
+					ix += step
+			else:
+				# Nothing of interest here; skip the rest of the block.
+				if step == 1:
+					ix += len(block.events) - offset
+				else:
+					ix -= offset + 1
+				if (step == 1 and stopIx <= ix) or (step == -1 and ix <= stopIx):
+					return None, None
+
+			nextBlockIx = block.ix + step
+			if not (0 <= nextBlockIx < len(self._blocks)):
+				return None, None
+			block = self._blocks[nextBlockIx]
+			offset = 0 if step == 1 else len(block.events) - 1
+
+	# input: (startIx, stopIx, direction)
+	# output: generator of (ix, event) from startIx towards stopIx (exclusive), in direction 'earlier' or 'later'
+	def iterRange(self, startIx, stopIx, direction):
+		assert(direction in ['earlier', 'later'])
+		step = 1 if direction == 'later' else -1
+		if (step == 1 and stopIx <= startIx) or (step == -1 and startIx <= stopIx):
+			return
+
+		block, offset = self._locate(startIx)
+		ix = startIx
+		while True:
+			events = block.events
+			while 0 <= offset < len(events):
+				if ix == stopIx:
+					return
+				yield ix, events[offset]
+				offset += step
+				ix += step
+			nextBlockIx = block.ix + step
+			if not (0 <= nextBlockIx < len(self._blocks)):
+				return
+			block = self._blocks[nextBlockIx]
+			offset = 0 if step == 1 else len(block.events) - 1
+
+	# input: (ix)
+	# output: (block, offset) location of the event at index ix. Raises an IndexError if out of range.
+	def _locate(self, ix):
+		if ix < 0:
+			ix += self._len
+		if not (0 <= ix < self._len):
+			raise IndexError("ExecSchedule index out of range")
+		self._updateBlockStarts(len(self._blocks))
+		blockIx = bisect.bisect_right(self._blockStarts, ix) - 1
+		return self._blocks[blockIx], ix - self._blockStarts[blockIx]
+
+	# input: (nStarts)
+	# output: ()
+	# Ensure that self._blockStarts[:nStarts] are up to date.
+	def _updateBlockStarts(self, nStarts):
+		if nStarts <= self._nValidStarts:
+			return
+		ix = self._nValidStarts
+		start = 0
+		if ix:
+			start = self._blockStarts[ix-1] + len(self._blocks[ix-1].events)
+		while ix < nStarts:
+			self._blockStarts[ix] = start
+			start += len(self._blocks[ix].events)
+			ix += 1
+		self._nValidStarts = nStarts
+
+	# input: (firstBlockIx)
+	# output: ()
+	# Blocks from firstBlockIx onward have moved within self._blocks. Update their ix and invalidate their starts.
+	def _renumberBlocks(self, firstBlockIx):
+		for ix in range(firstBlockIx, len(self._blocks)):
+			self._blocks[ix].ix = ix
+		if len(self._blockStarts) < len(self._blocks):
+			self._blockStarts.extend([0] * (len(self._blocks) - len(self._blockStarts)))
+		self._nValidStarts = min(self._nValidStarts, firstBlockIx)
+
+	def _splitBlock(self, block):
+		half = len(block.events) // 2
+		newBlock = _ExecScheduleBlock(self, block.events[half:])
+		for e in newBlock.events:
+			block.noteRemoved(e)
+		block.events = block.events[:half]
+		self._blocks.insert(block.ix + 1, newBlock)
+		self._blockStarts.insert(block.ix + 1, 0)
+		self._renumberBlocks(block.ix + 1)
+
+	def _noteAdded(self, event, block):
+		self._len += 1
+		self._cbNameToEvent[event.getCB().getName()] = event
+		self._nValidStarts = min(self._nValidStarts, block.ix + 1)
+
+	def _noteRemoved(self, event, block):
+		self._len -= 1
+		event._execBlock = None
+		if self._cbNameToEvent.get(event.getCB().getName()) is event:
+			del self._cbNameToEvent[event.getCB().getName()]
+		self._nValidStarts = min(self._nValidStarts, block.ix + 1)
+
+# A run of adjacent ScheduleEvents in an ExecSchedule
+class _ExecScheduleBlock(object):
+	def __init__(self, owner, events):
+		self.owner = owner
+		self.events = events
+		self.ix = None
+		self.nTP = 0
+		for e in events:
+			self.noteAdded(e)
+
+	def noteAdded(self, event):
+		event._execBlock = self
+		if event.getCB().isThreadpoolCB():
+			self.nTP += 1
+
+	def noteRemoved(self, event):
+		if event.getCB().isThreadpoolCB():
+			self.nTP -= 1
+
+	# Might this block contain an event of the specified kind?
+	def hasKind(self, wantTP):
+		if wantTP:
+			return (0 < self.nTP)
+		return (self.nTP < len(self.events))
@@ -0,0 +1,205 @@
+# Author: Jamie Davis (davisjam@vt.edu)
+# Description: Compares two libuv callback schedules, e.g. a recorded schedule and the '<file>-replay' schedule
+#   that scheduler_emit writes for a REPLAY of it, to find where the replay diverged.
+# Defines the following public classes:
+# 	ScheduleDiff
+# Defines the following public functions:
+# 	semanticPath
+# Python version: 2.7.6
+#
+# Callbacks are aligned the way the libuv REPLAYer matches them (cf. lcbn_semantic_equals in deps/uv/src/logical-callback-node.c):
+# two callbacks correspond if they have the same cb_type and child number, and their parents correspond.
+# Each callback's position in the registration tree is interned as a small integer in a single pre-order walk of each tree,
+# so aligning two schedules is linear in their size.
+# The reordered callbacks are the complement of a longest increasing subsequence of the exec order, found in O(n log n).
+
+import bisect
+import logging
+
+# input: (node)
+# output: (path) string describing the position of node in its registration tree: the cb_type and child number of each
+#   of its ancestors and of node, starting from the root
+def semanticPath(node):
+	steps = []
+	while node is not None:
+		parent = node.getParent()
+		childNum = parent.getChildren().index(node) if parent is not None else 0
+		steps.append("{}[{}]".format(node.getCBType(), childNum))
+		node = parent
+	return " > ".join(reversed(steps))
+
+# input: (node)
+# output: (description) short string identifying node within its schedule
+def _describe(node):
+	return "{} (exec_id {}, reg_id {}, name {})".format(node.getCBType(), node.getExecID(), node.getRegID(), node.getName())
+
+#############################
+# ScheduleDiff
+#############################
+
+# The differences between a recorded schedule and a replay of it.
+# Members:
+#   recorded, replay          CallbackNodeTrees
+#   onlyRecorded              nodes registered in the recorded schedule with no counterpart in the replay, in registration order
+#   onlyReplay                likewise for the replay
+#   executedOnlyRecorded      nodes executed in the recorded schedule whose counterpart in the replay did not execute
+#   executedOnlyReplay        likewise for the replay
+#   firstDivergence           None if the executed callbacks of the two schedules correspond one-to-one in exec order.
+#                             Else (ix, recordedNode, replayNode): ix is the first position in the two exec orders
+#                             (executed nodes only) whose nodes do not correspond. One node is None if that schedule ended at ix.
+#   reordered                 list of (recordedNode, replayNode) pairs, in recorded exec order: a smallest set of callbacks
+#                             executed in both schedules whose removal leaves the two exec orders consistent
+#   drift                     list of (recordedNode, replayNode, startDrift, durationDelta), in recorded exec order,
+#                             one per callback executed in both schedules. Times in ns.
+#                             startDrift is the change in the callback's start time relative to the start of its schedule (the root);
+#                             durationDelta is the change in its duration.
+class ScheduleDiff(object):
+	# input: (recorded, replay)
+	#   recorded, replay    CallbackNodeTrees; they are not modified
+	def __init__(self, recorded, replay):
+		self.recorded = recorded
+		self.replay = replay
+
+		keyToID = {} # (parentKeyID, cb_type, childNum) -> key ID; shared, so that corresponding nodes get the same ID
+		recordedKeys, recordedByKey = self._internKeys(recorded, keyToID)
+		replayKeys, replayByKey = self._internKeys(replay, keyToID)
+
+		# counterpart[id(recordedNode)] = replayNode
+		counterpart = {}
+		self.onlyRecorded = []
+		for node in recorded.getRegOrder():
+			other = replayByKey.get(recordedKeys[id(node)], None)
+			if other is None:
+				self.onlyRecorded.append(node)
+			else:
+				counterpart[id(node)] = other
+		self.onlyReplay = [node for node in replay.getRegOrder() if replayKeys[id(node)] not in recordedByKey]
+
+		recordedExec = [node for node in recorded.iterExecOrder() if node.executed()]
+		replayExec = [node for node in replay.iterExecOrder() if node.executed()]
+		self.firstDivergence = self._findFirstDivergence(recordedExec, replayExec, counterpart)
+
+		# Callbacks executed in both schedules, in recorded exec order
+		replayExecIx = dict([(id(node), ix) for ix, node in enumerate(replayExec)])
+		bothExecuted = [(node, counterpart[id(node)]) for node in recordedExec
+		                if id(node) in counterpart and id(counterpart[id(node)]) in replayExecIx]
+		self.executedOnlyRecorded = [node for node in recordedExec if id(node) in counterpart and id(counterpart[id(node)]) not in replayExecIx]
+		self.executedOnlyReplay = [node for node in replayExec
+		                           if replayKeys[id(node)] in recordedByKey and not recordedByKey[replayKeys[id(node)]].executed()]
+
+		inOrder = self._longestIncreasingSubsequence([replayExecIx[id(other)] for _, other in bothExecuted])
+		self.reordered = [pair for ix, pair in enumerate(bothExecuted) if ix not in inOrder]
+
+		self.drift = []
+		recordedBase, replayBase = recorded.root.getStartTime(), replay.root.getStartTime()
+		for node, other in bothExecuted:
+			startDrift = (other.getStartTime() - replayBase) - (node.getStartTime() - recordedBase)
+			durationDelta = (other.getEndTime() - other.getStartTime()) - (node.getEndTime() - node.getStartTime())
+			self.drift.append((node, other, startDrift, durationDelta))
+
+		logging.info("{} recorded nodes, {} replay nodes: {} only recorded, {} only replay, {} executed in both, {} reordered".format(
+			len(recordedKeys), len(replayKeys), len(self.onlyRecorded), len(self.onlyReplay), len(bothExecuted), len(self.reordered)))
+
+	# input: (tree, keyToID)
+	#   keyToID    dict (parentKeyID, cb_type, childNum) -> key ID, extended with the keys of tree
+	# output: (nodeToKeyID, keyIDToNode) for every node of tree
+	#   nodeToKeyID    dict id(node) -> key ID
+	#   keyIDToNode    the inverse
+	#
+	# The child number of a node is its index in its parent's children, which is the order the REPLAYer uses.
+	# Siblings have distinct child numbers, so the nodes of one tree have distinct keys.
+	def _internKeys(self, tree, keyToID):
+		rootKeyID = keyToID.setdefault((None, tree.root.getCBType(), 0), len(keyToID))
+		nodeToKeyID = { id(tree.root): rootKeyID }
+		keyIDToNode = { rootKeyID: tree.root }
+		toVisit = [(tree.root, rootKeyID)]
+		while toVisit:
+			node, parentKeyID = toVisit.pop()
+			for childNum, child in enumerate(node.getChildren()):
+				keyID = keyToID.setdefault((parentKeyID, child.getCBType(), childNum), len(keyToID))
+				nodeToKeyID[id(child)] = keyID
+				keyIDToNode[keyID] = child
+				toVisit.append((child, keyID))
+		return nodeToKeyID, keyIDToNode
+
+	# input: (recordedExec, replayExec, counterpart)
+	#   recordedExec, replayExec    the executed nodes of each schedule, in exec order
+	#   counterpart                 dict id(recordedNode) -> replayNode
+	# output: (firstDivergence) see the class comment
+	def _findFirstDivergence(self, recordedExec, replayExec, counterpart):
+		for ix in xrange(max(len(recordedExec), len(replayExec))):
+			node = recordedExec[ix] if ix < len(recordedExec) else None
+			other = replayExec[ix] if ix < len(replayExec) else None
+			if node is None or other is None or counterpart.get(id(node), None) is not other:
+				return (ix, node, other)
+		return None
+
+	# input: (seq) list of distinct ints
+	# output: (ixs) set of the indices into seq of one of its longest increasing subsequences
+	#
+	# Patience sorting: tails[k] is the index of the smallest element that ends an increasing subsequence of length k+1.
+	def _longestIncreasingSubsequence(self, seq):
+		tails = []
+		tailValues = [] # Parallel to tails, for bisect
+		prev = [None] * len(seq) # prev[i] = index of the element preceding seq[i] in the subsequence ending at seq[i]
+		for i, value in enumerate(seq):
+			k = bisect.bisect_left(tailValues, value)
+			if 0 < k:
+				prev[i] = tails[k - 1]
+			if k == len(tails):
+				tails.append(i)
+				tailValues.append(value)
+			else:
+				tails[k] = i
+				tailValues[k] = value
+
+		ixs = set()
+		i = tails[-1] if tails else None
+		while i is not None:
+			ixs.add(i)
+			i = prev[i]
+		return ixs
+
+	# input: ()
+	# output: (identical) True if the two schedules registered and executed corresponding callbacks in the same order
+	def identical(self):
+		return (self.firstDivergence is None and not self.onlyRecorded and not self.onlyReplay)
+
+	# input: ([maxItems])
+	#   maxItems    list at most this many entries in each section
+	# output: (lines) human-readable report
+	def report(self, maxItems=10):
+		lines = []
+		if self.firstDivergence is None:
+			lines.append("The exec orders match ({} executed callbacks)".format(len(self.drift)))
+		else:
+			ix, node, other = self.firstDivergence
+			lines.append("First divergence at position {} of the exec order:".format(ix))
+			for label, n in [("recorded", node), ("replay", other)]:
+				if n is None:
+					lines.append("  {:8}  <end of schedule>".format(label))
+				else:
+					lines.append("  {:8}  {}".format(label, _describe(n)))
+					lines.append("  {:8}  {}".format("", semanticPath(n)))
+
+		for title, nodes in [("Registered only in the recorded schedule", self.onlyRecorded),
+		                     ("Registered only in the replay", self.onlyReplay),
+		                     ("Executed only in the recorded schedule", self.executedOnlyRecorded),
+		                     ("Executed only in the replay", self.executedOnlyReplay)]:
+			lines.append("{}: {}".format(title, len(nodes)))
+			for node in nodes[:maxItems]:
+				lines.append("  {}".format(_describe(node)))
+
+		lines.append("Reordered callbacks: {}".format(len(self.reordered)))
+		for node, other in self.reordered[:maxItems]:
+			lines.append("  {}: exec_id {} -> {}".format(node.getCBType(), node.getExecID(), other.getExecID()))
+
+		if self.drift:
+			absDrifts = sorted([abs(d[2]) for d in self.drift])
+			lines.append("Start time drift (ns, relative to the start of each schedule): mean {:.1f} median {} max {}".format(
+				sum(absDrifts) / float(len(absDrifts)), absDrifts[(len(absDrifts) - 1) / 2], absDrifts[-1]))
+			drifted = [d for d in self.drift if d[2] or d[3]]
+			lines.append("Largest drifts ({} callbacks drifted):".format(len(drifted)))
+			for node, other, startDrift, durationDelta in sorted(drifted, key=lambda d: -abs(d[2]))[:maxItems]:
+				lines.append("  {:+d} ns (duration {:+d} ns)  {}".format(startDrift, durationDelta, _describe(node)))
+		return lines
@@ -0,0 +1,211 @@
+# Author: Jamie Davis (davisjam@vt.edu)
+# Description: Callback timing profile of a libuv callback schedule, in the style of a sampling profiler:
+#   the time spent in each callback is attributed to its position in the registration tree, and emitted as
+#   folded stacks (one 'INITIAL_STACK;UV_TIMER_CB;UV_FS_CB <ns>' line per stack) for flame graph tools.
+# Defines the following public classes:
+# 	CallbackProfile
+# Python version: 2.7.6
+#
+# A callback's stack is the cb_types of its registration-tree ancestors, root first. Marker callbacks are not frames.
+# The weight of a stack is the self time of its callbacks: each callback's duration less that of the callbacks that
+# ran nested inside it on the same thread (e.g. a UV_FS_CB inside its UV_AFTER_WORK_CB).
+#
+# Registration chains can be as deep as the schedule is long (e.g. a repeating timer), so by default
+# consecutive frames of the same cb_type are folded into one, and stacks are truncated at MAX_DEPTH frames.
+
+import logging
+
+# Frame that replaces the middle of a truncated stack
+TRUNCATED_FRAME = "..."
+
+# input: (ns)
+# output: (us) ns in microseconds
+def _toUS(ns):
+	return ns / 1000.0
+
+#############################
+# CallbackProfile
+#############################
+
+# Members:
+#   tree           the CallbackNodeTree
+#   looperThread   executing_thread of the looper (the thread that ran INITIAL_STACK)
+#   callbacks      the executed non-marker nodes, in exec order
+#   selfTime       dict id(node) -> self time in ns, for each of callbacks
+#   stackIDs       dict id(node) -> stack ID, for each of callbacks; see stackString
+class CallbackProfile(object):
+	MAX_DEPTH = 64
+
+	# input: (tree, [foldRepeats], [maxDepth])
+	#   tree           CallbackNodeTree; it is not modified
+	#   foldRepeats    fold consecutive frames of the same cb_type into one
+	#   maxDepth       stacks deeper than this keep their outermost maxDepth-1 frames and their leaf
+	def __init__(self, tree, foldRepeats=True, maxDepth=MAX_DEPTH):
+		assert(2 <= maxDepth)
+		self.tree = tree
+		self.looperThread = tree.root.getExecutingThread()
+		self.callbacks = [node for node in tree.iterExecOrder() if node.executed() and not node.isMarkerNode()]
+		self.selfTime = self._computeSelfTimes(self.callbacks)
+		self._stacks = [] # stack ID -> (parent stack ID, frame); the parent of a root frame is None
+		self._stackToID = {}
+		self.stackIDs = self._assignStacks(tree, foldRepeats, maxDepth)
+		logging.info("Profiled {} callbacks: {} distinct stacks".format(len(self.callbacks), len(set(self.stackIDs.values()))))
+
+	# input: (callbacks)
+	# output: (selfTime) dict id(node) -> self time in ns
+	#
+	# Sweeps the callbacks of each thread in order of start time, keeping a stack of the callbacks still running.
+	# A callback that starts before the top of the stack ends is nested within it.
+	#
+	# Schedules are not always this tidy, so anomalies are logged rather than fatal:
+	#   - a callback that ends before it starts (e.g. with no end time in a truncated schedule) is taken to take no time
+	#   - a callback that starts inside the top of the stack but ends after it only has the overlap subtracted from it
+	def _computeSelfTimes(self, callbacks):
+		selfTime = {}
+		endTime = {} # id(node) -> end time, no earlier than the start time
+		for node in callbacks:
+			endTime[id(node)] = node.getEndTime()
+			if node.getEndTime() < node.getStartTime():
+				logging.info("Callback {} ends ({}) before it starts ({}); treating it as taking no time".format(node.getName(), node.getEndTime(), node.getStartTime()))
+				endTime[id(node)] = node.getStartTime()
+
+		running = {} # executing_thread -> stack of running nodes
+		for node in sorted(callbacks, key=lambda n: (n.getStartTime(), -endTime[id(n)])):
+			start, end = node.getStartTime(), endTime[id(node)]
+			selfTime[id(node)] = end - start
+			stack = running.setdefault(node.getExecutingThread(), [])
+			while stack and endTime[id(stack[-1])] <= start:
+				stack.pop()
+			if stack:
+				outer = stack[-1]
+				if endTime[id(outer)] < end:
+					logging.info("Callback {} ({}-{}) overlaps the end of callback {} ({}-{}) on thread {}; only the overlap counts as nested".format(node.getName(), start, end, outer.getName(), outer.getStartTime(), endTime[id(outer)], node.getExecutingThread()))
+				selfTime[id(outer)] -= min(end, endTime[id(outer)]) - start
+			stack.append(node)
+		return selfTime
+
+	# input: (parentID, frame)
+	# output: (stackID) the ID of the stack consisting of stack parentID followed by frame
+	def _internStack(self, parentID, frame):
+		key = (parentID, frame)
+		stackID = self._stackToID.get(key, None)
+		if stackID is None:
+			stackID = len(self._stacks)
+			self._stacks.append(key)
+			self._stackToID[key] = stackID
+		return stackID
+
+	# input: (tree, foldRepeats, maxDepth)
+	# output: (stackIDs) dict id(node) -> stack ID, for each of self.callbacks
+	#
+	# A single pre-order walk. Each node passes its children the state of the stack below them:
+	#   (stackID, depth, truncated). Once a stack is truncated, its descendants keep only their own frame below the "...".
+	def _assignStacks(self, tree, foldRepeats, maxDepth):
+		stackIDs = {}
+		executed = set([id(node) for node in self.callbacks])
+		toVisit = [(tree.root, (None, 0, False))]
+		while toVisit:
+			node, (parentID, depth, truncated) = toVisit.pop()
+			childState = (parentID, depth, truncated)
+			if not node.isMarkerNode():
+				frame = node.getCBType()
+				if truncated:
+					stackID = self._internStack(parentID, frame)
+				elif foldRepeats and parentID is not None and self._stacks[parentID][1] == frame:
+					stackID = parentID
+					childState = (stackID, depth, False)
+				else:
+					stackID = self._internStack(parentID, frame)
+					childState = (stackID, depth + 1, False)
+					if depth + 1 == maxDepth - 1:
+						childState = (self._internStack(stackID, TRUNCATED_FRAME), depth + 2, True)
+				if id(node) in executed:
+					stackIDs[id(node)] = stackID
+			for child in node.getChildren():
+				toVisit.append((child, childState))
+		return stackIDs
+
+	# input: (stackID)
+	# output: (stack) the frames of the stack, root first, joined by ';'
+	def stackString(self, stackID):
+		frames = []
+		while stackID is not None:
+			stackID, frame = self._stacks[stackID]
+			frames.append(frame)
+		return ";".join(reversed(frames))
+
+	# input: ()
+	# output: (stackTimes) list of (stackID, count, selfTime), one per stack with executed callbacks,
+	#   in decreasing order of self time
+	def stackTimes(self):
+		counts = {}
+		times = {}
+		for node in self.callbacks:
+			stackID = self.stackIDs[id(node)]
+			counts[stackID] = counts.get(stackID, 0) + 1
+			times[stackID] = times.get(stackID, 0) + self.selfTime[id(node)]
+		return sorted([(stackID, counts[stackID], times[stackID]) for stackID in times], key=lambda s: (-s[2], s[0]))
+
+	# input: (f)
+	# output: ()
+	# Write the folded stacks to the file-like object f, one '<stack> <self time in ns>' line per stack with positive self time.
+	def writeFolded(self, f):
+		for stackID, _, selfTime in self.stackTimes():
+			if 0 < selfTime:
+				f.write("{} {}\n".format(self.stackString(stackID), selfTime))
+
+	# input: ()
+	# output: (chains) list of lists of nodes
+	#
+	# A chain is a maximal run of looper-thread callbacks that are consecutive in the exec order, with no marker between them:
+	# the loop runs them back to back within one iteration of one stage, without polling for I/O in between.
+	# Callbacks on other threads (the threadpool) neither belong to nor break a chain.
+	def chains(self):
+		chains = []
+		current = []
+		for node in self.tree.iterExecOrder():
+			if not node.executed():
+				continue
+			if node.isMarkerNode():
+				if current:
+					chains.append(current)
+				current = []
+			elif node.getExecutingThread() == self.looperThread:
+				current.append(node)
+		if current:
+			chains.append(current)
+		return chains
+
+	# input: ([topN])
+	# output: (lines) human-readable report: the looper-thread callbacks and chains that blocked the loop longest,
+	#   and the stacks with the most self time
+	def report(self, topN=10):
+		lines = []
+		looperCallbacks = [node for node in self.callbacks if node.getExecutingThread() == self.looperThread]
+		lines.append("Looper thread {}: {} callbacks, {:.1f} us total".format(
+			self.looperThread, len(looperCallbacks), _toUS(sum([n.getEndTime() - n.getStartTime() for n in looperCallbacks]))))
+
+		lines.append("")
+		lines.append("Callbacks that blocked the event loop longest:")
+		lines.append("{:>12} {:>12} {:>8}  {}".format("total(us)", "self(us)", "exec_id", "stack"))
+		for node in sorted(looperCallbacks, key=lambda n: -(n.getEndTime() - n.getStartTime()))[:topN]:
+			lines.append("{:>12.1f} {:>12.1f} {:>8}  {}".format(_toUS(node.getEndTime() - node.getStartTime()), _toUS(self.selfTime[id(node)]),
+			                                                    node.getExecID(), self.stackString(self.stackIDs[id(node)])))
+
+		lines.append("")
+		lines.append("Callback chains that blocked the event loop longest:")
+		lines.append("{:>12} {:>8} {:>17}  {}".format("total(us)", "length", "exec_ids", "cb_types"))
+		chainTimes = [(sum([n.getEndTime() - n.getStartTime() for n in chain]), chain) for chain in self.chains()]
+		for total, chain in sorted(chainTimes, key=lambda c: -c[0])[:topN]:
+			typeCounts = {}
+			for node in chain:
+				typeCounts[node.getCBType()] = typeCounts.get(node.getCBType(), 0) + 1
+			types = ", ".join(["{} x{}".format(t, c) for t, c in sorted(typeCounts.items(), key=lambda tc: (-tc[1], tc[0]))])
+			lines.append("{:>12.1f} {:>8} {:>17}  {}".format(_toUS(total), len(chain), "{}-{}".format(chain[0].getExecID(), chain[-1].getExecID()), types))
+
+		lines.append("")
+		lines.append("Stacks with the most self time (all threads):")
+		lines.append("{:>12} {:>8}  {}".format("self(us)", "count", "stack"))
+		for stackID, count, selfTime in self.stackTimes()[:topN]:
+			lines.append("{:>12.1f} {:>8}  {}".format(_toUS(selfTime), count, self.stackString(stackID)))
+		return lines
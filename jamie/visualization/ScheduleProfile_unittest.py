@@ -0,0 +1,69 @@
+# Author: Jamie Davis (davisjam@vt.edu)
+# Description: Tests for ScheduleProfile.py. Run with: python2 -m unittest ScheduleProfile_unittest
+# Python version: 2.7.6
+
+import os
+import tempfile
+import unittest
+
+import BinarySchedule
+import Callback as CB
+import ScheduleProfile
+
+# input: (name, cbType, execID, parentName, start, end)
+#   start, end   times in ns
+# output: (callbackString) for a callback on the looper thread
+def _callbackString(name, cbType, execID, parentName, start, end):
+	fields = { "name": name, "context": "0x7f00", "context_type": "HANDLE", "cb_type": cbType, "cb_behavior": "ACTION",
+	           "tree_number": 0, "tree_level": 0 if parentName == "(nil)" else 1, "level_entry": 0, "exec_id": execID, "reg_id": execID,
+	           "callback_info": "0x1", "registrar": parentName, "tree_parent": parentName,
+	           "registration_time": 0, "start_time": start, "end_time": end,
+	           "executing_thread": 1, "active": 0, "finished": 1, "extra_info": "user", "dependencies": "" }
+	return BinarySchedule.formatCallbackString(fields)
+
+class CallbackProfileTest(unittest.TestCase):
+	# input: (callbackStrings)
+	# output: (tree) the CallbackNodeTree of a schedule file holding callbackStrings
+	def loadTree(self, callbackStrings):
+		fd, schedFile = tempfile.mkstemp()
+		try:
+			with os.fdopen(fd, 'w') as f:
+				for s in callbackStrings:
+					f.write("%s\n" % (s))
+			return CB.CallbackNodeTree(schedFile)
+		finally:
+			os.remove(schedFile)
+
+	def selfTimes(self, tree):
+		profile = ScheduleProfile.CallbackProfile(tree)
+		return dict([(node.getName(), profile.selfTime[id(node)]) for node in profile.callbacks])
+
+	def testNested(self):
+		tree = self.loadTree([
+			_callbackString("0x1", "INITIAL_STACK", 0, "(nil)", 0, 1000),
+			_callbackString("0x2", "UV_TIMER_CB", 1, "0x1", 100, 300),
+			_callbackString("0x3", "UV_TIMER_CB", 2, "0x1", 150, 250),
+		])
+		self.assertEquals({ "0x1": 800, "0x2": 100, "0x3": 100 }, self.selfTimes(tree))
+
+	def testOverlapping(self):
+		# 0x3 starts inside 0x2 but ends after it: only the overlap is subtracted from 0x2
+		tree = self.loadTree([
+			_callbackString("0x1", "INITIAL_STACK", 0, "(nil)", 0, 1000),
+			_callbackString("0x2", "UV_TIMER_CB", 1, "0x1", 100, 300),
+			_callbackString("0x3", "UV_TIMER_CB", 2, "0x1", 200, 400),
+		])
+		self.assertEquals({ "0x1": 800, "0x2": 100, "0x3": 200 }, self.selfTimes(tree))
+
+	def testUnfinished(self):
+		# An end time before the start time (e.g. missing from a truncated schedule) counts as no time
+		tree = self.loadTree([
+			_callbackString("0x1", "INITIAL_STACK", 0, "(nil)", 0, 1000),
+			_callbackString("0x2", "UV_TIMER_CB", 1, "0x1", 100, 300),
+			_callbackString("0x3", "UV_TIMER_CB", 2, "0x1", 500, 600),
+		])
+		tree.getNodeByName("0x3").end_time = 0
+		self.assertEquals({ "0x1": 800, "0x2": 200, "0x3": 0 }, self.selfTimes(tree))
+
+if __name__ == '__main__':
+	unittest.main()
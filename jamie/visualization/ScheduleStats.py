@@ -0,0 +1,185 @@
+# Author: Jamie Davis (davisjam@vt.edu)
+# Description: Vectorized statistics on libuv callback schedules
+#   A replacement for deps/uv/src/callback_stats that works on the output of scheduler_emit.
+#   The schedule is loaded as NumPy columns rather than CallbackNodes, and every aggregate is computed over whole columns.
+# Defines the following public classes:
+# 	ScheduleColumns
+# Defines the following public functions:
+# 	callbackTypeStats
+# 	stageStats
+# Python version: 2.7.6
+#
+# For binary schedules (see BinarySchedule.py) the columns are views of the mmap'd file, so loading costs almost nothing.
+# Text schedules must be parsed line by line first; convert large ones with convertSchedule.
+
+import array
+import logging
+
+import numpy as np
+
+import Callback as CB
+import BinarySchedule
+import Schedule
+
+INT_KEYS = ["exec_id", "registration_time", "start_time", "end_time", "active", "finished"]
+
+#############################
+# ScheduleColumns
+#############################
+
+# The columns of a schedule needed for statistics.
+# Members:
+#   nNodes     number of nodes in the schedule
+#   ints       dict from INT_KEYS to int64 arrays of length nNodes (times in ns)
+#   cbTypeIx   int array of length nNodes; node i has cb_type cbTypes[cbTypeIx[i]]
+#   cbTypes    list of the distinct cb_types
+class ScheduleColumns(object):
+	# input: (schedFile, [useMmap])
+	#   schedFile    schedule file, text or binary
+	#   useMmap      read a text schedFile through mmap
+	# Throws any errors it encounters during file IO
+	def __init__(self, schedFile, useMmap=False):
+		self._binFile = None
+		reader = CB.ScheduleReader(schedFile, useMmap)
+		if reader.isBinary():
+			self._loadBinary(schedFile)
+		else:
+			self._loadText(reader)
+		logging.debug("Loaded {} nodes with {} distinct cb_types from {}".format(self.nNodes, len(self.cbTypes), schedFile))
+
+	# Release the binary schedule, if any. The columns are invalid afterwards.
+	def close(self):
+		if self._binFile is not None:
+			self.ints = None
+			self.cbTypeIx = None
+			self._binFile.close()
+			self._binFile = None
+
+	def _loadBinary(self, schedFile):
+		self._binFile = BinarySchedule.BinaryScheduleFile(schedFile)
+		self.nNodes = len(self._binFile)
+		self.ints = {}
+		for key in INT_KEYS:
+			self.ints[key] = np.frombuffer(self._binFile.getColumnBuffer(key), dtype='<i8')
+		# cb_type indexes the whole string table; only keep the entries that occur
+		stringIx = np.frombuffer(self._binFile.getColumnBuffer("cb_type"), dtype='<u4')
+		usedIx, self.cbTypeIx = np.unique(stringIx, return_inverse=True)
+		self.cbTypes = [self._binFile.getString(int(i)) for i in usedIx]
+
+	def _loadText(self, reader):
+		columns = dict([(key, array.array('l')) for key in INT_KEYS])
+		cbTypeToIx = {}
+		cbTypeIx = array.array('l')
+		for fields in reader.callbackFields():
+			for key in INT_KEYS:
+				columns[key].append(int(fields[key]))
+			cbTypeIx.append(cbTypeToIx.setdefault(fields["cb_type"], len(cbTypeToIx)))
+
+		self.nNodes = len(cbTypeIx)
+		self.ints = dict([(key, np.array(columns[key], dtype=np.int64)) for key in INT_KEYS])
+		self.cbTypeIx = np.array(cbTypeIx, dtype=np.int64)
+		self.cbTypes = [None] * len(cbTypeToIx)
+		for cbType, ix in cbTypeToIx.items():
+			self.cbTypes[ix] = cbType
+
+	# input: ()
+	# output: (executed) bool array, True for the nodes that executed (cf. CallbackNode.executed)
+	def executed(self):
+		return (self.ints["active"] != 0) | (self.ints["finished"] != 0)
+
+#############################
+# Aggregates
+#############################
+
+# input: (groups, values, nGroups, percentiles)
+#   groups        int array of group indices in [0, nGroups)
+#   values        array of the same length
+#   percentiles   list of percentiles in (0, 100]
+# output: (counts, means, pcts, maxes)
+#   counts, means, maxes   arrays of length nGroups
+#   pcts                   dict from percentile to array of length nGroups
+#   Statistics of empty groups are 0.
+#
+# Sorts once by (group, value); each group is then a contiguous run, and its nearest-rank percentiles are direct lookups.
+def _groupStats(groups, values, nGroups, percentiles):
+	values = np.asarray(values, dtype=np.int64)
+	counts = np.bincount(groups, minlength=nGroups)
+	sums = np.bincount(groups, weights=values, minlength=nGroups)
+	means = sums / np.maximum(counts, 1)
+	pcts = dict([(p, np.zeros(nGroups, dtype=np.int64)) for p in percentiles])
+	maxes = np.zeros(nGroups, dtype=np.int64)
+	if not len(values):
+		return counts, means, pcts, maxes
+
+	sortedValues = values[np.lexsort((values, groups))]
+	starts = np.cumsum(counts) - counts
+	nonEmpty = counts > 0
+	for p in percentiles:
+		ranks = np.maximum(np.ceil(p / 100.0 * counts).astype(np.int64), 1)
+		pcts[p][nonEmpty] = sortedValues[(starts + ranks - 1)[nonEmpty]]
+	maxes[nonEmpty] = sortedValues[(starts + counts - 1)[nonEmpty]]
+	return counts, means, pcts, maxes
+
+# input: (cols, [percentiles])
+# output: (stats) list, one dict per cb_type (sorted by cb_type; marker nodes excluded), with keys:
+#   cbType, count, executed
+#   duration_{mean,max,pN}     start_time -> end_time of the executed callbacks, ns
+#   delay_{mean,max,pN}        registration_time -> start_time of the executed callbacks, ns
+#                              For threadpool work this is the time spent in the queue.
+def callbackTypeStats(cols, percentiles=[50, 99]):
+	nTypes = len(cols.cbTypes)
+	executed = cols.executed()
+	reg, start, end = cols.ints["registration_time"], cols.ints["start_time"], cols.ints["end_time"]
+
+	counts = np.bincount(cols.cbTypeIx, minlength=nTypes)
+	nExecuted = np.bincount(cols.cbTypeIx[executed], minlength=nTypes)
+
+	aggregates = {}
+	for name, valid, values in [("duration", executed & (start <= end), end - start),
+	                            ("delay", executed & (reg <= start), start - reg)]:
+		aggregates[name] = _groupStats(cols.cbTypeIx[valid], values[valid], nTypes, percentiles)
+
+	stats = []
+	for ix in sorted(range(nTypes), key=lambda ix: cols.cbTypes[ix]):
+		if cols.cbTypes[ix].startswith("MARKER_"):
+			continue
+		typeStats = { "cbType": cols.cbTypes[ix], "count": int(counts[ix]), "executed": int(nExecuted[ix]) }
+		for name, (_, means, pcts, maxes) in aggregates.items():
+			typeStats["{}_mean".format(name)] = float(means[ix])
+			typeStats["{}_max".format(name)] = int(maxes[ix])
+			for p in percentiles:
+				typeStats["{}_p{}".format(name, p)] = int(pcts[p][ix])
+		stats.append(typeStats)
+	return stats
+
+# input: (cols, [percentiles])
+# output: (stats) list, one dict per stage of Schedule.LIBUV_RUN_ALL_STAGES (in that order), with keys:
+#   stage, iterations, total, mean, max, pN    times in ns
+#
+# The time of one iteration of a stage runs from the start of its MARKER_<stage>_BEGIN to the start of the matching _END.
+# The i'th executed BEGIN is matched with the i'th executed END; an unmatched trailing BEGIN is ignored.
+def stageStats(cols, percentiles=[50, 99]):
+	cbTypeToIx = dict([(cbType, ix) for ix, cbType in enumerate(cols.cbTypes)])
+	executed = cols.executed()
+	execID, start = cols.ints["exec_id"], cols.ints["start_time"]
+
+	def markerStarts(cbType):
+		if cbType not in cbTypeToIx:
+			return np.zeros(0, dtype=np.int64)
+		mask = executed & (cols.cbTypeIx == cbTypeToIx[cbType])
+		return start[mask][np.argsort(execID[mask], kind='mergesort')]
+
+	stats = []
+	for stage in Schedule.Schedule.LIBUV_RUN_ALL_STAGES:
+		begins = markerStarts("MARKER_{}_BEGIN".format(stage))
+		ends = markerStarts("MARKER_{}_END".format(stage))
+		n = min(len(begins), len(ends))
+		if len(begins) != len(ends):
+			logging.debug("Stage {}: {} BEGIN markers but {} END markers".format(stage, len(begins), len(ends)))
+		times = ends[:n] - begins[:n]
+		counts, means, pcts, maxes = _groupStats(np.zeros(n, dtype=np.int64), times, 1, percentiles)
+		stageInfo = { "stage": stage, "iterations": n, "total": int(times.sum()), "mean": float(means[0]), "max": int(maxes[0]) }
+		for p in percentiles:
+			stageInfo["p{}".format(p)] = int(pcts[p][0])
+		stats.append(stageInfo)
+	return stats
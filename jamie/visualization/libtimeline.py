@@ -6,10 +6,13 @@
 # Defines the following private classes:
 #	 Category
 #  Container
+#  _EventIndex
+#  _XMLWriter
 # Python version: 2.7.6
 
 import xml.etree.ElementTree as ET
-import xml.dom.minidom as DOM
+from xml.sax.saxutils import escape
+import bisect
 import re
 import logging
 import colorsys
@@ -140,16 +143,17 @@ class Event:
 	def endsBeforeStarts (self, other):
 		return (self.end < other.start)
 
-	#return an Element representing this Event
-	#If element has a containerName, it must also have a containerID
-	def toXML (self):
+	#input: ([containerID])
+	#output: (elt) an Element representing this Event
+	#If this Event has a containerName, CONTAINERID must be the id of that Container
+	def toXML (self, containerID=None):
 		elt = ET.Element('event')
 		ET.SubElement(elt, 'start').text = str(self.start) 
 		ET.SubElement(elt, 'end').text = str(self.end)
 		#in TheTimelineProj, being in container X is indicated by embedding (X) at the beginning of the text string 
 		if (self.containerName):
-			assert(self.containerID)
-			ET.SubElement(elt, 'text').text = "(%d)%s" % (self.containerID, self.text)
+			assert(containerID)
+			ET.SubElement(elt, 'text').text = "(%d)%s" % (containerID, self.text)
 		else:
 			ET.SubElement(elt, 'text').text = self.text
 		ET.SubElement(elt, 'progress').text = '0'
@@ -324,6 +328,113 @@ class Container:
 		else:
 			return 1 
 				
+#############################
+# _EventIndex
+#############################
+
+#static index over a list of Events for overlap and successor queries
+#Members: events (sorted by start), starts
+#	_maxEnd is an implicit binary tree over events, stored as an array: the leaves are the events' ends,
+#	and each internal node holds the latest end among its leaves. This makes it an interval tree keyed on start.
+#The index is not updated when the events change; Timeline rebuilds it on demand
+class _EventIndex:
+	def __init__ (self, events):
+		self.events = sorted(events, key=lambda e: e.start)
+		self.starts = [e.start for e in self.events]
+		self._nLeaves = 1
+		while (self._nLeaves < len(self.events)):
+			self._nLeaves *= 2
+		self._maxEnd = [float('-inf')] * (2 * self._nLeaves)
+		for i, e in enumerate(self.events):
+			self._maxEnd[self._nLeaves + i] = e.end
+		for node in range(self._nLeaves - 1, 0, -1):
+			self._maxEnd[node] = max(self._maxEnd[2*node], self._maxEnd[2*node + 1])
+
+	#input: (event)
+	#output: (overlappingEvents) in order of start
+	#An event overlaps EVENT if it starts no later than EVENT ends and ends no earlier than EVENT starts (cf. Event.overlaps)
+	#Runs in O(log n) per overlapping event: subtrees that start too late or end too early are skipped
+	def overlapping (self, event):
+		nCandidates = bisect.bisect_right(self.starts, event.end)
+		overlappingEvents = []
+		stack = [(1, 0, self._nLeaves)]
+		while (stack):
+			node, lo, hi = stack.pop()
+			if (nCandidates <= lo or self._maxEnd[node] < event.start):
+				continue
+			if (self._nLeaves <= node):
+				overlappingEvents.append(self.events[lo])
+			else:
+				mid = (lo + hi) / 2
+				stack.append((2*node + 1, mid, hi))
+				stack.append((2*node, lo, mid))
+		return overlappingEvents
+
+	#input: (event)
+	#output: (subsequentEvents) the events that start after EVENT ends, in order of start
+	def subsequent (self, event):
+		return self.events[bisect.bisect_right(self.starts, event.end):]
+
+	#input: (event)
+	#output: (nextEvent) the first event that starts after EVENT ends, or None
+	def next (self, event):
+		ix = bisect.bisect_right(self.starts, event.end)
+		if (ix < len(self.events)):
+			return self.events[ix]
+		return None
+
+#############################
+# _XMLWriter
+#############################
+
+#Writes an XML document to a file one element at a time
+#The layout matches that of xml.dom.minidom's toprettyxml, without holding the document in memory
+class _XMLWriter:
+	_ENTITIES = {'"': "&quot;"}
+
+	def __init__ (self, f):
+		self.f = f
+		self._openTags = []
+		self.f.write('<?xml version="1.0" ?>\n')
+
+	#input: (tag)
+	#output: ()
+	#Begin an element; its children are written until the matching close()
+	def open (self, tag):
+		self.f.write("%s<%s>\n" % ("\t" * len(self._openTags), tag))
+		self._openTags.append(tag)
+
+	#input: ()
+	#output: ()
+	#End the most recently opened element
+	def close (self):
+		tag = self._openTags.pop()
+		self.f.write("%s</%s>\n" % ("\t" * len(self._openTags), tag))
+
+	#input: (tag, text)
+	#output: ()
+	#Write an element that has no children but (possibly empty) TEXT
+	def leaf (self, tag, text):
+		indent = "\t" * len(self._openTags)
+		if (text):
+			self.f.write("%s<%s>%s</%s>\n" % (indent, tag, escape(text, self._ENTITIES), tag))
+		else:
+			self.f.write("%s<%s/>\n" % (indent, tag))
+
+	#input: (elt)
+	#output: ()
+	#Write ELT, an Element whose children have no children of their own (e.g. from Event.toXML)
+	def element (self, elt):
+		children = list(elt)
+		if (not children):
+			self.leaf(elt.tag, elt.text)
+			return
+		self.open(elt.tag)
+		for child in children:
+			assert(not len(child))
+			self.leaf(child.tag, child.text)
+		self.close()
+
 #############################
 # Timeline
 #############################
@@ -337,6 +448,8 @@ class Container:
 #	containers: list of Container objects
 # eras: list of Era objects
 # _remainingColors: list of all colors not yet assigned to timeline objects
+# _categoriesByName, _containersByName: dicts from name to the corresponding member of categories, containers
+# _eventIndex: _EventIndex over events, or None if it must be rebuilt
 class Timeline:
 	MAX_NUM_COLORS = 256
 	
@@ -357,6 +470,9 @@ class Timeline:
 			self.containers = []
 			self.eras = []
 		
+		self._categoriesByName = dict([(c.name, c) for c in self.categories])
+		self._containersByName = dict([(c.name, c) for c in self.containers])
+		self._eventIndex = None
 		self._remainingColors = _genColors(self.MAX_NUM_COLORS)
 		self._eraColor = self._nextColor()
 
@@ -385,61 +501,74 @@ class Timeline:
 			#TODO Extract 'container' events and add them to self.containers
 			self.events.append(event)
 
-	#input: ()
-	#output: (eltTree)
-	#Describe the members of self as an eltTree
-	def _toXML (self):
-		root = ET.Element('timeline')
-		ET.SubElement(root, 'version').text = self.version
-		ET.SubElement(root, 'timetype').text = self.timetype
-
-		eras = ET.SubElement(root, 'eras')
-		for era in self.eras:
-			eras.append(era.toXML())
-
-		categories = ET.SubElement(root, 'categories')
-		for category in self.categories:
-			categories.append(category.toXML())
-		
+	#input: (writer)
+	#output: ()
+	#Describe the members of self to WRITER, an _XMLWriter
+	def _writeXML (self, writer):
+		writer.open('timeline')
+		writer.leaf('version', self.version)
+		writer.leaf('timetype', self.timetype)
+
+		if (self.eras):
+			writer.open('eras')
+			for era in self.eras:
+				writer.element(era.toXML())
+			writer.close()
+		else:
+			writer.leaf('eras', None)
+
+		if (self.categories):
+			writer.open('categories')
+			for category in self.categories:
+				writer.element(category.toXML())
+			writer.close()
+		else:
+			writer.leaf('categories', None)
+
 		#containers: create "container" events that span all member events
-		containerEvents = [] 
-		for container in self.containers:			
-			correspondingEvents = [e for e in self.events if e.containerName == container.name]
-			assert(0 < len(correspondingEvents))
-			min_start = min([e.start for e in correspondingEvents])
-			max_end   = max([e.end   for e in correspondingEvents])
-						
+		#The span of every container, and the default view, are found in a single pass over the events
+		containerSpans = {} #containerName -> [min_start, max_end]
+		min_start = None
+		max_end = None
+		for e in self.events:
+			if (e.containerName):
+				span = containerSpans.get(e.containerName, None)
+				if (span):
+					span[0] = min(span[0], e.start)
+					span[1] = max(span[1], e.end)
+				else:
+					containerSpans[e.containerName] = [e.start, e.end]
+			if (min_start is None or e.start < min_start):
+				min_start = e.start
+			#NB The displayed period ends at the latest start, not the latest end
+			if (max_end is None or max_end < e.start):
+				max_end = e.start
+
+		writer.open('events')
+		for container in self.containers:
+			assert(container.name in containerSpans)
+			span = containerSpans[container.name]
 			#container events don't belong to a category, that way they end up gray
-			containerEvent = Event(start=min_start, end=max_end, text="[%d]%s" % (container.id, container.name))
-			containerEvents.append(containerEvent)
-			#events that belong to a container must know the ID prior to Event.toXML()			
-			for e in correspondingEvents:
-				e.containerID = container.id
-
-		events = ET.SubElement(root, 'events')
-		for event in containerEvents:
-			events.append(event.toXML())
+			containerEvent = Event(start=span[0], end=span[1], text="[%d]%s" % (container.id, container.name))
+			writer.element(containerEvent.toXML())
 		for event in self.events:
-			events.append(event.toXML())
-			
-		#Now that XML has been generated, wipe containerID from the corresponding events
-		for container in self.containers:
-			correspondingEvents = [e for e in self.events if e.containerName == container.name]
-			for e in correspondingEvents:
-				del e.containerID
+			containerID = None
+			if (event.containerName):
+				containerID = self._containersByName[event.containerName].id
+			writer.element(event.toXML(containerID))
+		writer.close()
 
 		#default view: show all events
-		min_start = min([e.start for e in self.events])
-		max_end = max([e.start for e in self.events])
-		view = ET.SubElement(root, 'view')
-		displayedPeriod = ET.SubElement(view, 'displayed_period')
-		ET.SubElement(displayedPeriod, 'start').text = str(min_start*0.95)
-		ET.SubElement(displayedPeriod, 'end').text = str(max_end*1.05)
-		
+		writer.open('view')
+		writer.open('displayed_period')
+		writer.leaf('start', str(min_start*0.95))
+		writer.leaf('end', str(max_end*1.05))
+		writer.close()
 		#idk what this is, but TTP generates it
-		ET.SubElement(view, 'hidden_categories')
+		writer.leaf('hidden_categories', None)
+		writer.close()
 
-		return ET.ElementTree(root)
+		writer.close()
 	
 	#input: (gapThreshold)
 	#output: ()
@@ -448,6 +577,10 @@ class Timeline:
 	#These gaps are added to the Timeline's list of Eras, and the amount of time removed is indicated in the name of each era
 	#NOTE: This function could modify the start and end time of all events in the timeline
 	#Any existing Eras will be damaged, so no eras can be defined when it is invoked 
+	#
+	#Sweeps the events in order of start, tracking the latest end seen so far.
+	#A gap lies between that end and the start of the next event, if the next event starts later.
+	#Each event is left-shifted by the total width removed from the gaps before it, so this runs in O(n log n).
 	def collapseGaps (self, gapThreshold):
 		#This function will render any existing eras meaningless
 		assert(not self.eras)
@@ -456,68 +589,34 @@ class Timeline:
 		origEventDurations = [(e.end - e.start) for e in self.events]
 		distances = []
 		newEras = []
-		eventsBeforeEras = []
-			
-		for event in self.events:
-			#If E has an overlapping event that ends after it, then E cannot be an era lower boundary
-			max_end = max([e.end for e in self._overlappingEvents(event)])
-			if (event.end < max_end):
-			  continue
-			#If no events follow E, then E cannot be an era lower boundary
-			nextEvent = self._nextEvent(event)
-			if (not nextEvent):
-				continue
-			#If the distance from E to its nextEvent is less than gapThreshold, then E cannot be an era lower boundary 
-			distance = (nextEvent.start - event.end)
-			distances.append(distance)
-			if (distance <= gapThreshold):
-				continue
-			
-			#If E's end is the same as any event preceding an era that we've found, then E cannot be an era lower boundary
-			# (well, it could be, but we can only have one event preceding each era)
-			if ([prev for prev in eventsBeforeEras if prev.end == event.end]):
-				continue
-			
-			logging.debug("Found an event preceding an era (distance %d): %s" % (distance, event))
-			eventsBeforeEras.append(event)
-			logging.debug("Current eventsBeforeEras:\n  %s" %(',\n  '.join(map(str, eventsBeforeEras))))
-		
-		logging.debug("Final eventsBeforeEras:\n  %s" %(',\n  '.join(map(str, eventsBeforeEras))))
-		
-		#Handle eras starting with the earliest so that subsequent left-shifts don't harm earlier eras 
-		eventsBeforeEras.sort(key=lambda event: event.start)
-		for event in eventsBeforeEras:			
-			nextEvent = self._nextEvent(event)
-			assert(nextEvent)
-			distance = (nextEvent.start - event.end)
-			assert(gapThreshold < distance)
-			max_end = max([x.end for x in self._overlappingEvents(event)])
-			if (event.end != max_end):
-			  assert(event.end == max_end)			
-														
-			era = Era(name='Gap %d' % (len(self.eras) + len(newEras)), start=event.end, end=(event.end + gapThreshold), maskedDuration=distance)
-			logging.debug("Found an era (distance %d). era (%d,%d), based on event (%d,%d) with successor (%d,%d)" % (distance, era.start, era.end, event.start, event.end, nextEvent.start, nextEvent.end))
-			
-			#Left-shift all subsequent events
-			logging.debug("Events before shift:\n  " + '\n  '.join(map(lambda event: "(%d,%d)" % (event.start, event.end), self.events)))					
-			shiftAmount = (distance - gapThreshold)
-			logging.debug("distance %d gapThreshold %d (event %s) (nextEvent %s)" %(distance, gapThreshold, event, nextEvent))
-			assert(0 < shiftAmount)					
-			for affectedEvent in self._subsequentEvents(event):				
-				assert(era.end + shiftAmount <= affectedEvent.start)
-				affectedEvent.start -= shiftAmount
-				affectedEvent.end -= shiftAmount
-			
-			newEras.append(era)
-			logging.debug("Events after shift:\n  " + '\n  '.join(map(lambda event: "(%d,%d)" % (event.start, event.end), self.events)))
-														
-		for era in newEras:
+
+		totalShift = 0
+		max_end = None #latest unshifted end among the events swept so far
+		for event in self._getEventIndex().events:
+			if (max_end is not None and max_end < event.start):
+				distance = (event.start - max_end)
+				distances.append(distance)
+				if (gapThreshold < distance):
+					#Earlier eras have already been collapsed, so this one begins TOTALSHIFT earlier
+					era = Era(name='Gap %d' % (len(self.eras) + len(newEras)), start=(max_end - totalShift), end=(max_end - totalShift + gapThreshold), maskedDuration=distance)
+					logging.debug("Found an era (distance %d). era (%d,%d), based on successor (%d,%d)" % (distance, era.start, era.end, event.start, event.end))
+					shiftAmount = (distance - gapThreshold)
+					assert(0 < shiftAmount)
+					totalShift += shiftAmount
+					newEras.append(era)
+			if (max_end is None or max_end < event.end):
+				max_end = event.end
+
+			#Left-shift EVENT past the eras that precede it
+			event.start -= totalShift
+			event.end -= totalShift
 			#Sanity check: no events should be active during the new eras
-			for event in self.events:
-				logging.debug("era (%f, %f) event (%f, %f)" % (era.start, era.end, event.start, event.end))
-				assert(event.end <= era.start or era.end <= event.start)
+			assert(not newEras or newEras[-1].end <= event.start or event.end <= newEras[-1].start)
+		self._eventIndex = None
+
+		for era in newEras:
 			self.addEra(era)
-		logging.info("Max observed distance was %d, gapThreshold was %d. Added %d new eras." % (max(distances), gapThreshold, len(newEras)))		
+		logging.info("Max observed distance was %d, gapThreshold was %d. Added %d new eras." % (max(distances + [0]), gapThreshold, len(newEras)))		
 		logging.debug("Events after:\n  " + '\n  '.join(map(lambda event: "(%d,%d)" % (event.start, event.end), self.events)))
 		
 		#Verify that the duration of each event remained fixed
@@ -525,32 +624,35 @@ class Timeline:
 		for i in range(len(origEventDurations)):
 			assert(origEventDurations[i] == finalEventDurations[i])		
 		
+	#input: ()
+	#output: (eventIndex)
+	#Returns the _EventIndex over this timeline's events, building it if any events were added or moved since the last call
+	def _getEventIndex (self):
+		if (self._eventIndex is None):
+			self._eventIndex = _EventIndex(self.events)
+		return self._eventIndex
+
 	#input: (event)
 	#output: (overlappingEvents)
 	#Returns list of all events that overlap with EVENT
 	def _overlappingEvents (self, event):
-		return [e for e in self.events if event.overlaps(e)]	
+		return self._getEventIndex().overlapping(event)
 		
 	#input: (event)
 	#output: (subsequentEvents)
 	#returns list of all events that start after EVENT ends
 	def _subsequentEvents (self, event):
-		return [e for e in self.events if event.endsBeforeStarts(e)]
+		return self._getEventIndex().subsequent(event)
 		
 	#input: (event)
 	#output: (nextEvent)
 	#returns the first event in this timeline that starts after EVENT ends
 	#returns None if there are no such events 
 	def _nextEvent (self, event):
-		subseqEvents = self._subsequentEvents(event)
-		if (subseqEvents):
-			#return one of the events with the min start time. TODO This is ugly!
-			min_start = min([e.start for e in subseqEvents])
-			next = [e for e in self.events if e.start == min_start][0]
+		next = self._getEventIndex().next(event)
+		if (next):
 			assert(event.start < next.start)
-			return next
-		else:
-			return None
+		return next
 	
 	#input: ()
 	#output: ()
@@ -570,6 +672,7 @@ class Timeline:
 			#shift left and decrease proportionally
 			e.start = int((e.start - min_start) / orig_min_duration)
 			e.end   = int((e.end   - min_start) / orig_min_duration)
+		self._eventIndex = None
 		normalized_min_duration = min([(e.end - e.start) for e in self.events])
 		assert(normalized_min_duration == 1)
 		normalized_max_duration = max([(e.end - e.start) for e in self.events])
@@ -579,14 +682,11 @@ class Timeline:
 
 	#input: (fileName)
 	#output: ()
-	#Write ElementTree eltTree out to fileName as pretty XML
+	#Write this Timeline out to fileName as pretty XML
+	#The XML is streamed to the file rather than built in memory first
 	def write (self, fileName):
-		xml_string = ET.tostring(self._toXML().getroot())
-		xml = DOM.parseString(xml_string)
-		pretty_xml_as_string = xml.toprettyxml()
-	
 		with open(fileName, 'w') as f:
-			f.write(pretty_xml_as_string)
+			self._writeXML(_XMLWriter(f))
 			logging.info("Wrote timeline (%d events, %d eras, %d categories) to %s" % (len(self.events), len(self.eras), len(self.categories), fileName))
 		return
 	
@@ -610,21 +710,24 @@ class Timeline:
 	#also updates {categories, containers} based on fields of event
 	def addEvent (self, event):
 		self.events.append(event)
+		self._eventIndex = None
 		#event.text += '%d' % (len(self.events)) #DEBUGGING -- unique IDs for events		
 				
 		#new category?
-		eventCategory = Category(name=event.categoryName)
-		if (eventCategory not in self.categories):			
-			self.categories.append(Category(name=event.categoryName, color=self._nextColor()))
+		if (event.categoryName not in self._categoriesByName):
+			category = Category(name=event.categoryName, color=self._nextColor())
+			self.categories.append(category)
+			self._categoriesByName[category.name] = category
 			logging.debug("Added category '%s'" % (event.categoryName))
 		else:
 			logging.debug("Category '%s' is already present" % (event.categoryName))
 				
 		#new container?
 		if (event.containerName):
-			eventContainer = Container(name=event.containerName)
-			if (eventContainer not in self.containers):
-				self.containers.append(Container(name=event.containerName, id=len(self.containers) + 1))
+			if (event.containerName not in self._containersByName):
+				container = Container(name=event.containerName, id=len(self.containers) + 1)
+				self.containers.append(container)
+				self._containersByName[container.name] = container
 				logging.debug("Added container '%s'" % (event.containerName))
 			else:
 				logging.debug("Container '%s' is already present" % (event.containerName))
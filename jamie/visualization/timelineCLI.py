@@ -1,34 +1,55 @@
 #!/usr/bin/env python2
 
 #Author: Jamie Davis (davisjam@vt.edu)
-#Description: Provides a CLI to interact with timeline XML files 
+#Description: Provides a CLI to interact with timeline XML files
 #  for use with the TheTimelineProj timeline software.
 
 import libtimeline as LT
 import argparse
 
+#input: (fields) dict from key to value for one callback of a scheduler_emit schedule (cf. Callback.ScheduleReader.callbackFields)
+#output: (event) an LT.Event for the callback, or None if it should not appear on the timeline
+#Events are categorized by executing_thread; callbacks that did not execute, and the zero-length MARKER_ callbacks, are omitted
+def eventFromCallbackFields (fields):
+	if (int(fields['active']) == 0 and int(fields['finished']) == 0):
+		return None
+	if (fields['cb_type'].startswith('MARKER_')):
+		return None
+	thread = str(fields['executing_thread'])
+	containerName = thread if (int(thread) != -1) else ""
+	return LT.Event(start=int(fields['start_time']), end=int(fields['end_time']),
+	                text="%s: %s" % (fields['exec_id'], fields['cb_type']),
+	                categoryName=thread, containerName=containerName,
+	                description="context %s (%s) registrar %s" % (fields['context'], fields['context_type'], fields['registrar']))
+
 parser = argparse.ArgumentParser(description="Turn a file of events into a .timeline file compatible with TheTimelineProj. Could be extended with addEvent and addEra modes for an interactive mode; would need to get the fromXML methods of the libtimeline classes working")
 parser.add_argument("eventFile", help="file describing events")
 parser.add_argument("outputFile", help="file describing events")
+parser.add_argument("-s", "--schedule", help="eventFile is a libuv event schedule from scheduler_emit (text or binary), not a file of events", action="store_true")
 parser.add_argument("-n", "--normalize", help="normalize events to the duration of the shortest event, and begin at time 0", action="store_true")
 parser.add_argument("-c", "--collapseGaps", help="collapse event gaps exceeding gapThreshold", type=int, metavar='gapThreshold')
 args = parser.parse_args()
 
-with open(args.eventFile) as f:
-	eventLines = f.readlines()
-#eventLines = eventLines[0:24] #TODO TESTING	
-
 timeline = LT.Timeline()
 
-for eventLine in eventLines:
-	timeline.addEvent(LT.Event(eventString=eventLine))
-	
+if (args.schedule):
+	import Callback as CB
+	for fields in CB.ScheduleReader(args.eventFile).callbackFields():
+		event = eventFromCallbackFields(fields)
+		if (event):
+			timeline.addEvent(event)
+else:
+	with open(args.eventFile) as f:
+		for eventLine in f:
+			timeline.addEvent(LT.Event(eventString=eventLine))
+print "Read %i events" % (len(timeline.events))
+
 if (args.normalize):
 	print "Normalizing events"
 	timeline.normalizeEventTimes()
 
-if (args.collapseGaps):	
+if (args.collapseGaps):
 	print "Collapsing gaps (gapThreshold %i)" % (args.collapseGaps)
 	timeline.collapseGaps(args.collapseGaps)
 
-timeline.write(fileName=args.outputFile)
\ No newline at end of file
+timeline.write(fileName=args.outputFile)
@@ -29,11 +29,13 @@
 
 
 import imp
+import json
 import logging
 import optparse
 import os
 import platform
 import re
+import select
 import signal
 import subprocess
 import sys
@@ -47,6 +49,7 @@ import errno
 from os.path import join, dirname, abspath, basename, isdir, exists
 from datetime import datetime
 from Queue import Queue, Empty
+from collections import deque
 
 logger = logging.getLogger('testrunner')
 skip_regex = re.compile(r'# SKIP\S*\s+(.*)', re.IGNORECASE)
@@ -93,6 +96,56 @@ class ProgressIndicator(object):
     print "Path: %s" % "/".join(test.path)
 
   def Run(self, tasks):
+    if utils.IsWindows():
+      # Pipes can't be select()ed on Windows, so run each test on a thread.
+      return self.RunThreaded(tasks)
+    self.Starting()
+    # Run every test from this thread: start up to TASKS children, then sleep
+    # in CommandPoller.Wait until one of them finishes. Task slot i plays the
+    # role of thread i in RunThreaded; only slot 0 runs sequential tests.
+    poller = CommandPoller()
+    free_slots = range(tasks)
+    running = { }
+    try:
+      while True:
+        while free_slots and not self.shutdown_event.is_set():
+          slot = 0 if 0 in free_slots else free_slots[-1]
+          test = self.NextTest(slot == 0)
+          if test is None:
+            break
+          free_slots.remove(slot)
+          case = test.case
+          case.thread_id = slot
+          self.AboutToRun(case)
+          try:
+            case.start_time = datetime.now()
+            command = case.Start()
+          except IOError, e:
+            # Like a thread in RunThreaded, the slot stops taking tests.
+            continue
+          poller.Add(command)
+          running[command] = (case, slot)
+        if not running:
+          break
+        for command in poller.Wait():
+          (case, slot) = running.pop(command)
+          free_slots.append(slot)
+          output = case.Finish(command)
+          case.duration = (datetime.now() - case.start_time)
+          self.RecordOutput(output)
+    except (KeyboardInterrupt, SystemExit), e:
+      self.shutdown_event.set()
+    except Exception, e:
+      self.shutdown_event.set()
+      raise
+    finally:
+      for command in running:
+        command.Kill()
+      poller.Close()
+    self.Done()
+    return not self.failed
+
+  def RunThreaded(self, tasks):
     self.Starting()
     threads = []
     # Spawn N-1 threads and then use this thread as the last one.
@@ -119,17 +172,42 @@ class ProgressIndicator(object):
     self.Done()
     return not self.failed
 
-  def RunSingle(self, parallel, thread_id):
-    while not self.shutdown_event.is_set():
+  # Returns the next test to run, or None. Only one task may run sequential
+  # tests, and it runs them first, while the other tasks work through the
+  # parallel tests; once they are done it joins in on the parallel tests.
+  # Within each queue, tests run in the order they were given (see
+  # TestDurations.Sort).
+  def NextTest(self, sequential_allowed):
+    if sequential_allowed:
       try:
-        test = self.parallel_queue.get_nowait()
+        return self.sequential_queue.get_nowait()
       except Empty:
-        if parallel:
-          return
-        try:
-          test = self.sequential_queue.get_nowait()
-        except Empty:
-          return
+        pass
+    try:
+      return self.parallel_queue.get_nowait()
+    except Empty:
+      return None
+
+  def RecordOutput(self, output):
+    if output.UnexpectedOutput():
+      if FLAKY in output.test.outcomes and self.flaky_tests_mode == DONTCARE:
+        self.flaky_failed.append(output)
+        if output.HasCrashed():
+          self.flaky_crashed += 1
+      else:
+        self.failed.append(output)
+        if output.HasCrashed():
+          self.crashed += 1
+    else:
+      self.succeeded += 1
+    self.remaining -= 1
+    self.HasRun(output)
+
+  def RunSingle(self, parallel, thread_id):
+    while not self.shutdown_event.is_set():
+      test = self.NextTest(not parallel)
+      if test is None:
+        return
       case = test.case
       case.thread_id = thread_id
       self.lock.acquire()
@@ -144,19 +222,7 @@ class ProgressIndicator(object):
       if self.shutdown_event.is_set():
         return
       self.lock.acquire()
-      if output.UnexpectedOutput():
-        if FLAKY in output.test.outcomes and self.flaky_tests_mode == DONTCARE:
-          self.flaky_failed.append(output)
-          if output.HasCrashed():
-            self.flaky_crashed += 1
-        else:
-          self.failed.append(output)
-          if output.HasCrashed():
-            self.crashed += 1
-      else:
-        self.succeeded += 1
-      self.remaining -= 1
-      self.HasRun(output)
+      self.RecordOutput(output)
       self.lock.release()
 
 
@@ -442,6 +508,9 @@ class TestCase(object):
                       output,
                       self.context.store_unexpected_output)
 
+  def GetEnv(self):
+    return { "TEST_THREAD_ID": "%d" % self.thread_id }
+
   def BeforeRun(self):
     pass
 
@@ -452,19 +521,34 @@ class TestCase(object):
     self.BeforeRun()
 
     try:
-      result = self.RunCommand(self.GetCommand(), {
-        "TEST_THREAD_ID": "%d" % self.thread_id
-      })
+      result = self.RunCommand(self.GetCommand(), self.GetEnv())
     finally:
-      # Tests can leave the tty in non-blocking mode. If the test runner
-      # tries to print to stdout/stderr after that and the tty buffer is
-      # full, it'll die with a EAGAIN OSError. Ergo, put the tty back in
-      # blocking mode before proceeding.
-      if sys.platform != 'win32':
-        from fcntl import fcntl, F_GETFL, F_SETFL
-        from os import O_NONBLOCK
-        for fd in 0,1,2: fcntl(fd, F_SETFL, ~O_NONBLOCK & fcntl(fd, F_GETFL))
+      ResetTerminal()
+
+    self.AfterRun(result)
+    return result
+
+  # Start and Finish split Run in two for callers that run many tests at
+  # once: Start launches the test and returns its RunningCommand, and once
+  # the command is done (see CommandPoller), Finish returns the TestOutput.
+  def Start(self):
+    self.BeforeRun()
+    full_command = self.context.processor(self.GetCommand())
+    return RunningCommand(full_command,
+                          self.context,
+                          self.context.GetTimeout(self.mode),
+                          self.GetEnv())
 
+  def Finish(self, command):
+    try:
+      output = command.GetOutput()
+    finally:
+      ResetTerminal()
+    self.Cleanup()
+    result = TestOutput(self,
+                        command.args,
+                        output,
+                        self.context.store_unexpected_output)
     self.AfterRun(result)
     return result
 
@@ -538,7 +622,7 @@ def Win32SetErrorMode(mode):
     pass
   return prev_error_mode
 
-def RunProcess(context, timeout, args, **rest):
+def StartProcess(context, args, **rest):
   if context.verbose: print "#", " ".join(args)
   popen_args = args
   prev_error_mode = SEM_INVALID_VALUE;
@@ -557,6 +641,12 @@ def RunProcess(context, timeout, args, **rest):
   )
   if utils.IsWindows() and context.suppress_dialogs and prev_error_mode != SEM_INVALID_VALUE:
     Win32SetErrorMode(prev_error_mode)
+  return process
+
+# Waits for the process by polling it with a growing sleep. Only used on
+# Windows, where pipes can't be poll()ed; elsewhere see CommandPoller.
+def RunProcess(context, timeout, args, **rest):
+  process = StartProcess(context, args, **rest)
   # Compute the end time - if the process crosses this limit we
   # consider it timed out.
   if timeout is None: end_time = None
@@ -581,6 +671,281 @@ def RunProcess(context, timeout, args, **rest):
   return (process, exit_code, timed_out)
 
 
+# Tests can leave the tty in non-blocking mode. If the test runner
+# tries to print to stdout/stderr after that and the tty buffer is
+# full, it'll die with a EAGAIN OSError. Ergo, put the tty back in
+# blocking mode before proceeding.
+def ResetTerminal():
+  if sys.platform != 'win32':
+    from fcntl import fcntl, F_GETFL, F_SETFL
+    from os import O_NONBLOCK
+    for fd in 0,1,2: fcntl(fd, F_SETFL, ~O_NONBLOCK & fcntl(fd, F_GETFL))
+
+
+# Largest amount of each of stdout and stderr kept from a test. A test that
+# writes more keeps the beginning and the end of its output.
+MAX_OUTPUT_SIZE = 16 * 1024 * 1024
+READ_SIZE = 64 * 1024
+
+
+class OutputBuffer(object):
+
+  def __init__(self, max_size=MAX_OUTPUT_SIZE):
+    self.head_room = max_size / 2
+    self.tail_room = max_size - self.head_room
+    self.head = [ ]
+    self.tail = deque()
+    self.tail_size = 0
+    self.dropped = 0
+
+  def Append(self, data):
+    if self.head_room > 0:
+      self.head.append(data[:self.head_room])
+      data = data[self.head_room:]
+      self.head_room -= len(self.head[-1])
+    if not data:
+      return
+    self.tail.append(data)
+    self.tail_size += len(data)
+    while self.tail_size > self.tail_room:
+      excess = self.tail_size - self.tail_room
+      if len(self.tail[0]) <= excess:
+        excess = len(self.tail.popleft())
+      else:
+        self.tail[0] = self.tail[0][excess:]
+      self.tail_size -= excess
+      self.dropped += excess
+
+  def GetValue(self):
+    head = "".join(self.head)
+    tail = "".join(self.tail)
+    if self.dropped:
+      return "%s\n[... %d bytes of output omitted ...]\n%s" % (head, self.dropped, tail)
+    return head + tail
+
+
+# A child process whose stdout and stderr are read through pipes into memory,
+# unless CAPTURE is False. The owner waits for it with a CommandPoller, and
+# calls ReadFrom when one of its pipes is readable and CheckExited when a
+# child may have exited.
+class RunningCommand(object):
+
+  def __init__(self, args, context, timeout=None, env={}, capture=True):
+    from fcntl import fcntl, F_GETFL, F_SETFL
+    from os import O_NONBLOCK
+    self.args = args
+    # Extend environment
+    env_copy = os.environ.copy()
+    for key, value in env.iteritems():
+      env_copy[key] = value
+    if capture: pipe = subprocess.PIPE
+    else: pipe = None
+    self.process = StartProcess(context,
+                                args,
+                                stdout = pipe,
+                                stderr = pipe,
+                                env = env_copy)
+    if timeout is None: self.end_time = None
+    else: self.end_time = time.time() + timeout
+    self.timed_out = False
+    self.exit_code = None
+    self.stdout = OutputBuffer()
+    self.stderr = OutputBuffer()
+    self.pipes = { }
+    if capture:
+      self.pipes = {
+        self.process.stdout.fileno(): (self.process.stdout, self.stdout),
+        self.process.stderr.fileno(): (self.process.stderr, self.stderr)
+      }
+    for fd in self.pipes:
+      fcntl(fd, F_SETFL, O_NONBLOCK | fcntl(fd, F_GETFL))
+
+  # The pipes that are still open.
+  def GetFds(self):
+    return self.pipes.keys()
+
+  # Reads what is available from pipe FD. Returns False once the pipe is
+  # closed.
+  def ReadFrom(self, fd):
+    (pipe, buffer) = self.pipes[fd]
+    while True:
+      try:
+        data = os.read(fd, READ_SIZE)
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          continue
+        if e.errno == errno.EAGAIN:
+          return True
+        raise
+      if not data:
+        pipe.close()
+        del self.pipes[fd]
+        return False
+      buffer.Append(data)
+      if len(data) < READ_SIZE:
+        return True
+
+  # Reaps the child if it has exited. Whatever it wrote is then already in
+  # the pipes; read it and close them rather than waiting for EOF, which
+  # never comes if the child left behind a process holding the pipes open.
+  def CheckExited(self):
+    if self.exit_code is None:
+      self.exit_code = self.process.poll()
+      if self.exit_code is not None:
+        for fd in self.pipes.keys():
+          if self.ReadFrom(fd):
+            self.pipes[fd][0].close()
+            del self.pipes[fd]
+    return self.exit_code is not None
+
+  # Kills the child if it is past its deadline.
+  def CheckTimeout(self, now):
+    if self.end_time is None or now < self.end_time or self.timed_out:
+      return
+    if not self.CheckExited():
+      self.Kill()
+      self.timed_out = True
+
+  def Kill(self):
+    if self.exit_code is None:
+      try:
+        KillProcessWithID(self.process.pid)
+      except OSError, e:
+        if e.errno != errno.ESRCH:
+          raise
+
+  def IsDone(self):
+    return self.exit_code is not None and not self.pipes
+
+  def GetOutput(self):
+    assert self.IsDone()
+    return CommandOutput(self.exit_code,
+                         self.timed_out,
+                         self.stdout.GetValue(),
+                         self.stderr.GetValue())
+
+
+# select.poll() for platforms that lack it (OS X).
+class SelectPoll(object):
+
+  def __init__(self):
+    self.fds = set()
+
+  def register(self, fd, eventmask=None):
+    self.fds.add(fd)
+
+  def unregister(self, fd):
+    self.fds.remove(fd)
+
+  def poll(self, timeout=None):
+    if timeout is not None:
+      timeout = timeout / 1000.0
+    (readable, _, _) = select.select(list(self.fds), [], [], timeout)
+    return [ (fd, 0) for fd in readable ]
+
+
+POLL_READ_EVENTS = getattr(select, 'POLLIN', 0)
+
+
+# Waits for RunningCommands to finish, without threads or sleeping: a single
+# poll() covers the pipes of every command, and (from the main thread) a
+# SIGCHLD handler wakes it through a pipe of its own when a child exits.
+class CommandPoller(object):
+
+  def __init__(self):
+    if hasattr(select, 'poll'):
+      self.poll = select.poll()
+    else:
+      self.poll = SelectPoll()
+    self.commands = { }  # fd -> RunningCommand
+    self.running = { }  # RunningCommand -> its fds that are registered
+    (self.wakeup_fd, self.wakeup_write_fd) = os.pipe()
+    from fcntl import fcntl, F_GETFL, F_SETFL
+    from os import O_NONBLOCK
+    for fd in self.wakeup_fd, self.wakeup_write_fd:
+      fcntl(fd, F_SETFL, O_NONBLOCK | fcntl(fd, F_GETFL))
+    try:
+      self.old_wakeup_fd = signal.set_wakeup_fd(self.wakeup_write_fd)
+      self.old_sigchld_handler = signal.signal(signal.SIGCHLD,
+                                               lambda signum, frame: None)
+      # Let other system calls carry on when a child exits.
+      signal.siginterrupt(signal.SIGCHLD, False)
+      self.have_sigchld = True
+    except ValueError:
+      # Signals are only delivered to the main thread. Elsewhere, a child is
+      # reaped once its pipes close.
+      self.have_sigchld = False
+    self.poll.register(self.wakeup_fd, POLL_READ_EVENTS)
+
+  def Add(self, command):
+    self.running[command] = set(command.GetFds())
+    for fd in command.GetFds():
+      self.commands[fd] = command
+      self.poll.register(fd, POLL_READ_EVENTS)
+
+  # Stops watching the pipes that COMMAND has closed.
+  def _Unregister(self, command):
+    registered = self.running[command]
+    for fd in [ fd for fd in registered if not fd in command.pipes ]:
+      self.poll.unregister(fd)
+      del self.commands[fd]
+      registered.remove(fd)
+
+  # Blocks until at least one command is done, and returns the commands
+  # that are done. They are no longer watched.
+  def Wait(self):
+    while True:
+      done = [ c for c in self.running if c.IsDone() ]
+      if done:
+        for command in done:
+          del self.running[command]
+        return done
+      end_times = [ c.end_time for c in self.running
+                    if c.end_time is not None and not c.timed_out ]
+      if end_times:
+        timeout = max(0, int((min(end_times) - time.time()) * 1000) + 1)
+      else:
+        timeout = None
+      try:
+        events = self.poll.poll(timeout)
+      except select.error, e:
+        if e.args[0] != errno.EINTR:
+          raise
+        events = [ ]
+      check_exited = False
+      for (fd, event) in events:
+        if fd == self.wakeup_fd:
+          try:
+            while os.read(fd, READ_SIZE):
+              pass
+          except OSError, e:
+            if e.errno != errno.EAGAIN:
+              raise
+          check_exited = True
+        elif fd in self.commands:
+          command = self.commands[fd]
+          if not command.ReadFrom(fd):
+            # Usually the child is exiting; don't wait for its SIGCHLD.
+            command.CheckExited()
+          self._Unregister(command)
+      now = time.time()
+      for command in self.running:
+        if check_exited:
+          command.CheckExited()
+          self._Unregister(command)
+        if not command.pipes and command.exit_code is None and not self.have_sigchld:
+          command.exit_code = command.process.wait()
+        command.CheckTimeout(now)
+        self._Unregister(command)
+
+  def Close(self):
+    if self.have_sigchld:
+      signal.signal(signal.SIGCHLD, self.old_sigchld_handler)
+      signal.set_wakeup_fd(self.old_wakeup_fd)
+    os.close(self.wakeup_fd)
+    os.close(self.wakeup_write_fd)
+
+
 def PrintError(str):
   sys.stderr.write(str)
   sys.stderr.write('\n')
@@ -600,7 +965,20 @@ def CheckedUnlink(name):
       PrintError("os.unlink() " + str(e))
     break
 
-def Execute(args, context, timeout=None, env={}):
+def Execute(args, context, timeout=None, env={}, capture=True):
+  if utils.IsWindows():
+    return ExecuteWithTempFiles(args, context, timeout, env)
+  poller = CommandPoller()
+  try:
+    command = RunningCommand(args, context, timeout, env, capture)
+    poller.Add(command)
+    poller.Wait()
+  finally:
+    poller.Close()
+  return command.GetOutput()
+
+
+def ExecuteWithTempFiles(args, context, timeout=None, env={}):
   (fd_out, outname) = tempfile.mkstemp()
   (fd_err, errname) = tempfile.mkstemp()
 
@@ -627,6 +1005,9 @@ def Execute(args, context, timeout=None, env={}):
 
 
 def ExecuteNoCapture(args, context, timeout=None):
+  if not utils.IsWindows():
+    output = Execute(args, context, timeout, capture=False)
+    return CommandOutput(output.exit_code, False, "", "")
   (process, exit_code, timed_out) = RunProcess(
     context,
     timeout,
@@ -794,6 +1175,82 @@ class Context(object):
   def GetTimeout(self, mode):
     return self.timeout * TIMEOUT_SCALEFACTOR[ARCH_GUESS or 'ia32'][mode]
 
+# Durations of the tests in past runs, kept in a JSON file between runs so
+# that the tests expected to take longest can be started first. Like V8's
+# PerfDataStore, each test keeps an approximation of the average of its last
+# 100 durations.
+class TestDurations(object):
+
+  LEARN_RATE_LIMITER = 99  # Greater value means slower learning.
+
+  def __init__(self, filename):
+    self.filename = filename
+    self.entries = { }  # Test key -> [average duration in seconds, count]
+    if not filename or not exists(filename):
+      return
+    try:
+      with open(filename) as f:
+        self.entries = json.load(f)
+    except (IOError, ValueError), e:
+      print "Ignoring the test durations in %s: %s" % (filename, e)
+
+  def GetKey(self, case):
+    return "%s.%s.%s" % (case.arch, case.mode, "/".join(case.path))
+
+  def GetExpectedDuration(self, case):
+    entry = self.entries.get(self.GetKey(case))
+    if entry is None:
+      return None
+    return entry[0]
+
+  def AddDuration(self, case):
+    duration = case.duration.total_seconds()
+    key = self.GetKey(case)
+    (avg, count) = self.entries.get(key, [0.0, 0])
+    effective_count = min(count, self.LEARN_RATE_LIMITER)
+    avg = (avg * effective_count + duration) / (effective_count + 1)
+    self.entries[key] = [avg, effective_count + 1]
+
+  # Sorts the tests longest expected duration first: with the longest tests
+  # started first, the last tests to finish are short ones, so the workers
+  # run out of work at about the same time. Tests without a recorded
+  # duration are expected to take the average time of those with one, and
+  # tests expected to take equally long keep their relative order.
+  def Sort(self, tests):
+    expected = [ self.GetExpectedDuration(t.case) for t in tests ]
+    known = [ d for d in expected if d is not None ]
+    if known:
+      default = sum(known) / len(known)
+    else:
+      default = 0.0
+    order = sorted(xrange(len(tests)), key=lambda i:
+        -(default if expected[i] is None else expected[i]))
+    tests[:] = [ tests[i] for i in order ]
+
+  def Update(self, tests):
+    for test in tests:
+      if test.case.duration is not None:
+        self.AddDuration(test.case)
+
+  # Writes to a temporary file that then replaces the old one, so that an
+  # interrupted write can't leave a truncated file behind.
+  def Save(self):
+    if not self.filename:
+      return
+    try:
+      directory = dirname(abspath(self.filename))
+      if not exists(directory):
+        os.makedirs(directory)
+      (fd, temp) = tempfile.mkstemp(dir=directory)
+      with os.fdopen(fd, 'w') as f:
+        json.dump(self.entries, f)
+      if utils.IsWindows() and exists(self.filename):
+        os.unlink(self.filename)
+      os.rename(temp, self.filename)
+    except (IOError, OSError), e:
+      print "Could not save the test durations to %s: %s" % (self.filename, e)
+
+
 def RunTestCases(cases_to_run, progress, tasks, flaky_tests_mode):
   progress = PROGRESS_INDICATORS[progress](cases_to_run, flaky_tests_mode)
   return progress.Run(tasks)
@@ -1293,6 +1750,9 @@ def BuildOptions():
   result.add_option("-r", "--run",
       help="Divide the tests in m groups (interleaved) and run tests from group n (--run=n,m with n < m)",
       default="")
+  result.add_option("--durations-file",
+      help="Keep the test durations in this file, to run the slowest tests first (default out/test-durations.json, '' to disable)",
+      dest="durations_file", default=None)
   return result
 
 
@@ -1543,6 +2003,10 @@ def Main():
     print "No tests to run."
     return 1
   else:
+    if options.durations_file is None:
+      options.durations_file = join(workspace, 'out', 'test-durations.json')
+    durations = TestDurations(options.durations_file)
+    durations.Sort(cases_to_run)
     try:
       start = time.time()
       if RunTestCases(cases_to_run, options.progress, options.j, options.flaky_tests):
@@ -1553,6 +2017,9 @@ def Main():
     except KeyboardInterrupt:
       print "Interrupted"
       return 1
+    finally:
+      durations.Update(cases_to_run)
+      durations.Save()
 
   if options.time:
     # Write the times to stderr to make it easy to separate from the